@@ -0,0 +1,73 @@
+"""
+Compares the IVF approximate index against the exact scan: recall@k and queries/second.
+
+    python -m benchmarks.ann_benchmark --chunks 200000 --dim 1536 --k 3
+
+Uses synthetic clustered vectors by default, or the real vectors of an existing index
+with --index <embeddings folder>/<name>.
+"""
+import argparse
+import os
+import time
+import numpy as np
+
+from utils.AnnIndex import IVFIndex
+from utils.EmbeddingIndex import get_index, normalize_rows, search_vectors
+
+def synthetic_vectors(n_chunks, dim, n_topics, seed=0):
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    vectors = topics[rng.integers(0, n_topics, n_chunks)] + 0.6 * rng.normal(size=(n_chunks, dim)).astype(np.float32)
+    return normalize_rows(vectors)
+
+def make_queries(vectors, n_queries, seed=1):
+    rng = np.random.default_rng(seed)
+    picked = np.asarray(vectors[rng.choice(len(vectors), n_queries, replace=False)])
+    return normalize_rows(picked + 0.3 * rng.normal(size=picked.shape).astype(np.float32))
+
+def timed(search, queries):
+    start = time.perf_counter()
+    indices = np.vstack([search(query)[0] for query in queries])
+    return indices, len(queries) / (time.perf_counter() - start)
+
+def recall_at_k(exact, approximate):
+    hits = [len(set(e) & set(a)) / len(e) for e, a in zip(exact, approximate)]
+    return float(np.mean(hits))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="Benchmark an existing index, e.g. embeddings/general_info")
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--lists", type=int, default=None, help="IVF cells (default sqrt(chunks))")
+    parser.add_argument("--probes", default="1,2,4,8,16,32")
+    args = parser.parse_args()
+
+    if args.index:
+        folder, name = os.path.split(args.index)
+        vectors = get_index(folder, name).vectors
+    else:
+        vectors = synthetic_vectors(args.chunks, args.dim, args.topics)
+    queries = make_queries(vectors, min(args.queries, len(vectors)))
+
+    exact, exact_qps = timed(lambda q: search_vectors(vectors, q, args.k)[0], queries)
+    print(f"{len(vectors)} chunks x {vectors.shape[1]} dims, {len(queries)} queries, k={args.k}")
+    print(f"{'mode':<16}{'recall@k':>10}{'QPS':>12}{'speedup':>10}")
+    print(f"{'exact':<16}{1.0:>10.3f}{exact_qps:>12.1f}{1.0:>10.2f}")
+
+    start = time.perf_counter()
+    ivf = IVFIndex.build(vectors, n_lists=args.lists)
+    print(f"IVF build: {ivf.n_lists} cells in {time.perf_counter() - start:.1f}s")
+
+    for n_probe in (int(p) for p in args.probes.split(",")):
+        if n_probe > ivf.n_lists:
+            break
+        approximate, qps = timed(lambda q: ivf.search(vectors, q, args.k, n_probe=n_probe)[0], queries)
+        label = f"ivf nprobe={n_probe}"
+        print(f"{label:<16}{recall_at_k(exact, approximate):>10.3f}{qps:>12.1f}{qps / exact_qps:>10.2f}")
+
+if __name__ == "__main__":
+    main()
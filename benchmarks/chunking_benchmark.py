@@ -0,0 +1,83 @@
+"""
+Compares chunking strategies on the PDFs in data/: retrieval hit rate and the prompt
+tokens the retrieved context costs per question.
+
+    python -m benchmarks.chunking_benchmark --k 3
+
+Questions are generated from the documents themselves: a line of the PDF with some of its
+words dropped. A question is a hit when one of the top-k chunks contains the full line.
+Embeddings come from the deterministic stub in utils.stub_server, so no API key is needed.
+"""
+import argparse
+import os
+import random
+import numpy as np
+
+from utils.chunking import count_tokens, get_chunker, chunking_signature
+from utils.EmbeddingIndex import search_vectors
+from utils.extraction import iter_pdf_pages
+from utils.stub_server import stub_embedding
+
+STRATEGIES = [
+    ("fixed", {"size": 2000}),
+    ("fixed", {"size": 1000}),
+    ("structured", {"max_tokens": 200, "overlap_tokens": 40}),
+    ("structured", {"max_tokens": 300, "overlap_tokens": 50}),
+    ("structured", {"max_tokens": 500, "overlap_tokens": 80}),
+]
+
+def make_questions(pages, per_document, rng):
+    lines = [" ".join(line.split()) for _, text in pages for line in text.splitlines()]
+    lines = [line for line in lines if len(line.split()) >= 4]
+    picked = rng.sample(lines, min(per_document, len(lines)))
+    questions = []
+    for line in picked:
+        words = line.split()
+        kept = [w for w in words if rng.random() < 0.7] or words[:1]
+        questions.append((" ".join(kept), line))
+    return questions
+
+def evaluate(chunks, questions, k):
+    # Whitespace is normalized so lines that a chunker re-joined still match
+    texts = [" ".join(chunk.text.split()) for chunk in chunks]
+    vectors = np.vstack([stub_embedding(text) for text in texts])
+    queries = np.vstack([stub_embedding(question) for question, _ in questions])
+    top_indices, _ = search_vectors(vectors, queries, k)
+
+    hits, prompt_tokens = 0, 0
+    for (question, line), row in zip(questions, top_indices):
+        hits += any(line in texts[i] for i in row)
+        prompt_tokens += sum(count_tokens(chunks[i].text) for i in row)
+    return hits, prompt_tokens
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-folder", default="data")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--questions", type=int, default=40, help="Questions per PDF")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    pdfs = sorted(f for f in os.listdir(args.data_folder) if f.lower().endswith(".pdf"))
+    documents = {pdf: list(iter_pdf_pages(os.path.join(args.data_folder, pdf))) for pdf in pdfs}
+    rng = random.Random(args.seed)
+    questions = {pdf: make_questions(pages, args.questions, rng) for pdf, pages in documents.items()}
+    total_questions = sum(len(q) for q in questions.values())
+
+    print(f"{len(pdfs)} PDFs, {total_questions} questions, k={args.k}")
+    print(f"{'strategy':<42}{'chunks':>8}{'tok/chunk':>11}{'hit@k':>8}{'prompt tok/q':>14}")
+    for name, options in STRATEGIES:
+        chunker = get_chunker(name, **options)
+        n_chunks, chunk_tokens, hits, prompt_tokens = 0, 0, 0, 0
+        for pdf, pages in documents.items():
+            chunks = list(chunker(pages))
+            n_chunks += len(chunks)
+            chunk_tokens += sum(count_tokens(chunk.text) for chunk in chunks)
+            doc_hits, doc_tokens = evaluate(chunks, questions[pdf], args.k)
+            hits += doc_hits
+            prompt_tokens += doc_tokens
+        print(f"{chunking_signature(name, **options):<42}{n_chunks:>8}{chunk_tokens / n_chunks:>11.0f}"
+              f"{hits / total_questions:>8.2f}{prompt_tokens / total_questions:>14.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+End-to-end benchmark of the question answering pipeline on the PDFs in data/, fully offline.
+
+    python -m benchmarks.qa_benchmark --repeat 20 --json results.json
+    python -m benchmarks.qa_benchmark --repeat 20 --compare results.json
+
+Every PDF is extracted, chunked, embedded and indexed, then the golden questions of
+benchmarks/golden_questions.json are embedded, retrieved and answered. The embedding and
+LLM backends are the deterministic "mock" backend, or the local stub server with --http
+(which adds real HTTP round trips). The report has latency percentiles per stage, question
+throughput, peak memory and the retrieval hit rate (the expected text is in the context).
+
+With --compare, the p50 of every stage is compared with an earlier --json run.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows; only the traced peak is reported there
+    resource = None
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "golden_questions.json")
+INDEX_STAGES = ["extract", "chunk", "embed_chunks", "save_index"]
+QUESTION_STAGES = ["load_index", "embed_question", "retrieve", "generate", "total"]
+
+# None where the platform can't report it
+def max_rss_mb():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 1024
+
+class Timings:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def time(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.samples[stage].append(time.perf_counter() - start)
+        return result
+
+    def summary(self):
+        return {
+            stage: {
+                "count": len(values),
+                "p50_ms": float(np.percentile(values, 50) * 1000),
+                "p95_ms": float(np.percentile(values, 95) * 1000),
+                "p99_ms": float(np.percentile(values, 99) * 1000),
+                "total_s": float(np.sum(values)),
+            }
+            for stage, values in self.samples.items()
+        }
+
+def configure_environment(args, embeddings_folder):
+    os.environ["MODEL_TYPE"] = "mock"
+    os.environ["EMBEDDINGS_BACKEND"] = "mock"
+    os.environ["OPENAI_API_KEY"] = os.environ.get("OPENAI_API_KEY") or "stub"
+    # Caches would turn every repetition after the first into a lookup
+    if not args.with_caches:
+        os.environ["ANSWER_CACHE"] = "false"
+        os.environ["EMBEDDING_CACHE_PATH"] = ""
+        os.environ["EMBEDDING_CACHE_MAX_ENTRIES"] = "0"
+    else:
+        os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(embeddings_folder, "embedding_cache.sqlite")
+
+def index_documents(processor, pdf_names, timings):
+    from utils.EmbeddingIndex import EmbeddingIndex, chunk_hash, file_fingerprint
+
+    pages_total, chunks_total = 0, 0
+    for pdf_name in pdf_names:
+        pages = timings.time("extract", lambda: list(processor.iter_pdf_pages(pdf_name)))
+        chunks = timings.time("chunk", lambda: list(processor.chunker(pages)))
+        texts = [chunk.text for chunk in chunks]
+        vectors = timings.time("embed_chunks", processor.create_embedding_pipeline().run, texts)
+
+        index = EmbeddingIndex(
+            vectors, texts,
+            source=file_fingerprint(os.path.join(processor.data_folder, pdf_name)),
+            chunk_hashes=[chunk_hash(text) for text in texts],
+            model=processor.embeddings_model,
+            chunking=processor.chunking,
+            pages=[(chunk.first_page, chunk.last_page) for chunk in chunks]
+        )
+        timings.time("save_index", index.save, processor.embeddings_folder, os.path.splitext(pdf_name)[0])
+        pages_total += len(pages)
+        chunks_total += len(chunks)
+    return pages_total, chunks_total
+
+def answer_questions(processor, golden, repeat, timings):
+    hits, asked = 0, 0
+    for round_number in range(repeat):
+        for pdf_name, questions in golden.items():
+            for item in questions:
+                key = ("benchmark", round_number, item["question"])
+                start = time.perf_counter()
+                index = timings.time("load_index", processor.load_retrieval_index, pdf_name)
+                question_embedding = timings.time("embed_question", processor.embed_question, index, item["question"])
+                context = timings.time(
+                    "retrieve", processor.retrieve_context, index, item["question"], question_embedding
+                )
+                timings.time("generate", processor.generate_answer, item["question"], context, "", key)
+                timings.samples["total"].append(time.perf_counter() - start)
+
+                hits += item["expected"] in " ".join(context.split())
+                asked += 1
+    return hits, asked
+
+def print_report(report, baseline=None):
+    print(f"{'stage':<16}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}" + (f"{'p50 vs base':>14}" if baseline else ""))
+    for stage in INDEX_STAGES + QUESTION_STAGES:
+        row = report["stages"].get(stage)
+        if row is None:
+            continue
+        line = f"{stage:<16}{row['count']:>7}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+        base = baseline["stages"].get(stage) if baseline else None
+        if base and base["p50_ms"]:
+            line += f"{(row['p50_ms'] / base['p50_ms'] - 1) * 100:>+13.1f}%"
+        print(line)
+
+    print(f"Indexing: {report['pages']} pages, {report['chunks']} chunks, "
+          f"{report['pages_per_second']:.1f} pages/s")
+    print(f"Questions: {report['questions']}, {report['questions_per_second']:.1f} questions/s, "
+          f"hit rate {report['hit_rate']:.2f}")
+    rss = "n/a" if report['max_rss_mb'] is None else f"{report['max_rss_mb']:.1f} MB"
+    print(f"Peak memory: {report['peak_traced_mb']:.1f} MB traced, {rss} RSS")
+    if baseline:
+        print(f"Baseline: {baseline['questions_per_second']:.1f} questions/s, hit rate {baseline['hit_rate']:.2f}, "
+              f"{baseline['peak_traced_mb']:.1f} MB traced")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-folder", default="data")
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    parser.add_argument("--repeat", type=int, default=10, help="Times every question is asked")
+    parser.add_argument("--http", action="store_true", help="Go through the local stub server instead of in-process mocks")
+    parser.add_argument("--with-caches", action="store_true", help="Keep the embedding and answer caches enabled")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--compare", help="Compare with a report written by an earlier --json run")
+    args = parser.parse_args()
+
+    with open(args.golden, 'r', encoding='utf-8') as f:
+        golden = json.load(f)
+    golden = {pdf: questions for pdf, questions in golden.items()
+              if os.path.exists(os.path.join(args.data_folder, pdf))}
+
+    embeddings_folder = tempfile.mkdtemp(prefix="qa_benchmark_")
+    configure_environment(args, embeddings_folder)
+    server = None
+    if args.http:
+        from utils.stub_server import StubServer
+        server = StubServer().start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ["MODEL_TYPE"] = os.environ["EMBEDDINGS_BACKEND"] = "chatgpt"
+
+    from utils.PdfQAProcessor import PdfQAProcessor
+
+    try:
+        tracemalloc.start()
+        processor = PdfQAProcessor(data_folder=args.data_folder, embeddings_folder=embeddings_folder)
+        timings = Timings()
+
+        start = time.perf_counter()
+        pages, chunks = index_documents(processor, list(golden), timings)
+        indexing_seconds = time.perf_counter() - start
+
+        hits, asked = answer_questions(processor, golden, args.repeat, timings)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        if server is not None:
+            server.stop()
+        shutil.rmtree(embeddings_folder, ignore_errors=True)
+
+    stages = timings.summary()
+    report = {
+        "stages": stages,
+        "pages": pages,
+        "chunks": chunks,
+        "pages_per_second": pages / indexing_seconds if indexing_seconds else 0.0,
+        "questions": asked,
+        "questions_per_second": asked / stages["total"]["total_s"] if asked else 0.0,
+        "hit_rate": hits / asked if asked else 0.0,
+        "peak_traced_mb": peak / 2**20,
+        "max_rss_mb": max_rss_mb(),
+        "chunking": processor.chunking,
+        "http": args.http,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,19 @@
 import streamlit as st
 from streamlit_carousel import carousel
 from streamlit_extras.stylable_container import stylable_container
-import asyncio
-import json
 import os
-import base64
+import uuid
 from PIL import Image
 
-from utils.PdfQAProcessor import PdfQAProcessor
 from utils.counter import initialize_user_count, increment_user_count, get_user_count
 from utils.init import initialize
+from utils.site_config import ConfigError
+from utils.tenants import get_tenant
+from utils import metrics
+from utils import background_loop
+from utils.api import start_api_server
+from utils.TelegramSender import get_notifier, report_question
+from utils.media import media_file, media_url, prepare_media
 
 # Initialize session state
 if 'state' not in st.session_state:
@@ -18,17 +22,21 @@ if 'state' not in st.session_state:
     }
 
 # קונפיגורציה והגדרות
-@st.cache_data(show_spinner=False, ttl=None)
+# The community center is chosen by the ?tenant= query parameter (see utils.tenants)
+def current_tenant():
+    tenant = get_tenant(st.query_params.get("tenant"))
+    if tenant is None:
+        st.error("המתנ\"ס המבוקש לא נמצא.")
+        st.stop()
+    return tenant
+
 def load_data():
+    # Parsed and validated once; reloaded when matnas_data.json or the page assets change
     try:
-        with open('matnas_data.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        st.error("קובץ ה-JSON לא נמצא. אנא ודא שהקובץ 'matnas_data.json' קיים בתיקייה הנכונה.")
-        return {}
-    except json.JSONDecodeError:
-        st.error("שגיאה בקריאת קובץ ה-JSON. אנא בדוק את תקינות הקובץ.")
-        return {}
+        return current_tenant().config()
+    except ConfigError as e:
+        st.error(f"שגיאה בקובץ ההגדרות: {e}")
+        st.stop()
 
 def set_page_config():
     st.set_page_config(page_title="צ'אטבוט המתנ\"ס", layout="wide")
@@ -62,57 +70,51 @@ def hide_streamlit_header_footer():
         </style>
     """, unsafe_allow_html=True)
 
-def set_background_color(color):
-    st.markdown(f"""
-        <style>
-        .stApp {{ background-color: {color}; }}
-        </style>
-    """, unsafe_allow_html=True)
+def set_background_color(page):
+    st.markdown(page.background_html, unsafe_allow_html=True)
 
 # פונקציות תצוגה
-@st.cache_data(show_spinner=False, ttl=None)
-def get_image_base64(image_path):
-    with open(image_path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode()
+# Images and PDFs are served as static files (see utils.media) instead of inline base64
+def static_url(path, variant=None):
+    return media_url(path, variant, st.get_option("server.baseUrlPath"))
+
+# Create the image renditions once per process, before the first page needs them
+@st.cache_resource(show_spinner=False)
+def prepare_uploads(uploads_folder):
+    uploads = [os.path.join(uploads_folder, name) for name in sorted(os.listdir(uploads_folder))] if os.path.isdir(uploads_folder) else []
+    prepare_media([path for path in uploads if path.lower().endswith(('.png', '.jpg', '.jpeg'))])
 
 def display_and_download_images(image_filenames, button_name):
     images = []
     for image_filename in image_filenames:
-        image_path = os.path.abspath(os.path.join('uploads', image_filename))
+        image_path = os.path.abspath(os.path.join(current_tenant().uploads_folder, image_filename))
         if os.path.exists(image_path):
             images.append({"title": f"{button_name} - {image_filename}", "img": image_path})
         else:
             st.error(f"התמונה {image_filename} לא נמצאה בנתיב: {image_path}")
 
     if len(images) == 1:
-        st.image(images[0]["img"], use_column_width=True)
+        st.image(media_file(images[0]["img"], "display"), use_column_width=True)
     elif len(images) > 1:
-        carousel_items = [{"title": "", "text": "", "img": f"data:image/png;base64,{get_image_base64(img['img'])}"} for img in images]
+        carousel_items = [{"title": "", "text": "", "img": static_url(img['img'], "display")} for img in images]
         carousel(items=carousel_items, width=1.0)
 
     st.write("---")
     st.subheader("הורדת תמונות")
     for i, image in enumerate(images):
-        image_b64 = get_image_base64(image["img"])
         st.markdown(f"""
-            <a href="data:image/png;base64,{image_b64}" download="{image_filenames[i]}" 
+            <a href="{static_url(image["img"])}" download="{image_filenames[i]}" 
                onclick="event.preventDefault(); const link = document.createElement('a'); link.href = this.href; link.download = this.download; document.body.appendChild(link); link.click(); document.body.removeChild(link);">
                 הורד תמונה {i+1}
             </a>
         """, unsafe_allow_html=True)
 
 def display_pdf_download(pdf_file):
-    pdf_path = os.path.join('data', pdf_file)
+    pdf_path = os.path.join(current_tenant().data_folder, pdf_file)
     if os.path.exists(pdf_path):
-        with open(pdf_path, "rb") as pdf:
-            pdf_bytes = pdf.read()
-        
-        # Encode the PDF content
-        b64_pdf = base64.b64encode(pdf_bytes).decode()
-        
         # Create a custom styled button with PDF icon and black text (larger size)
         custom_button = f"""
-        <a href="data:application/pdf;base64,{b64_pdf}" download="{pdf_file}" 
+        <a href="{static_url(pdf_path)}" download="{pdf_file}" 
            style="text-decoration: none; color: black; background-color: #f0f0f0; padding: 15px 25px; border-radius: 8px; display: inline-flex; align-items: center; border: 1px solid #ddd; font-size: 16px; transition: all 0.3s;">
             <svg xmlns="http://www.w3.org/2000/svg" width="32" height="32" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
                 <path d="M14 2H6a2 2 0 0 0-2 2v16a2 2 0 0 0 2 2h12a2 2 0 0 0 2-2V8z"></path>
@@ -132,14 +134,14 @@ def page_transition_callback(next_page):
     st.session_state.next_page = next_page
 
 def create_dialog(dialog_data):
-    cols = st.columns([1] + [2] * len(dialog_data["buttons"]))
+    cols = st.columns([1] + [2] * len(dialog_data.buttons))
     
     if cols[0].button("חזרה לדף הראשי", key="back_to_main", on_click=page_transition_callback, args=('main',)):
         pass  # The actual state change is handled in the callback
     
-    for i, button in enumerate(dialog_data["buttons"], start=1):
-        button_key = f"{dialog_data['title']}_{button['key']}"
-        if cols[i].button(button["name"], key=button_key, on_click=button_callback, args=(button["key"], button.get("images", []), button.get("videos", []))):
+    for i, button in enumerate(dialog_data.buttons, start=1):
+        button_key = f"{dialog_data.title}_{button.key}"
+        if cols[i].button(button.name, key=button_key, on_click=button_callback, args=(button.key, list(button.images), list(button.videos))):
             pass  # The actual state change is handled in the callback
 
 def button_callback(button_key, images, videos=None):
@@ -150,19 +152,44 @@ def button_callback(button_key, images, videos=None):
     else:
         st.session_state.current_videos = []
 
+# Serve the HTTP QA API (see utils.api) from this process, sharing its indexes and caches.
+# It starts with the app, not with the first chat, so API clients don't wait for a visitor.
 @st.cache_resource
+def start_api():
+    if os.getenv("API_PORT"):
+        start_api_server(int(os.getenv("API_PORT")))
+
+# Metrics and Telegram reports start with the app too, so they cover visits without a chat
+@st.cache_resource
+def start_services():
+    # Expose the QA metrics on http://<host>:METRICS_PORT/metrics and/or in a file
+    if os.getenv("METRICS_PORT"):
+        metrics.start_metrics_server(int(os.getenv("METRICS_PORT")))
+    if os.getenv("METRICS_DUMP_PATH"):
+        metrics.start_metrics_dump(os.getenv("METRICS_DUMP_PATH"), int(os.getenv("METRICS_DUMP_INTERVAL", 60)))
+    # Telegram alerts and statistics are sent from a background queue (see utils.TelegramSender)
+    notifier = get_notifier()
+    if notifier is not None:
+        notifier.add_stats_source("סה\"כ משתמשים", lambda: get_user_count(formatted=True))
+
+# Every tenant has its own processor; their indexes share one memory-bounded pool
 def get_pdf_processor():
-    return PdfQAProcessor()
+    return current_tenant().processor()
 
 # ניהול צ'אט
 def manage_chat(chat_key, system_prompt, pdf_name):
     if 'chat_histories' not in st.session_state:        
         st.session_state.chat_histories = {}
     
+    # The processor is shared by all sessions, so its history is keyed by session and chat
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = str(uuid.uuid4())
+    conversation_key = (st.session_state.session_id, chat_key)
+
     if chat_key not in st.session_state.chat_histories:
         st.session_state.chat_histories[chat_key] = []
         # Clear conversation history when starting a new chat
-        get_pdf_processor().clear_conversation_history()
+        get_pdf_processor().clear_conversation_history(conversation_key)
 
     for message in st.session_state.chat_histories[chat_key]:
         with st.chat_message(message["role"]):
@@ -173,27 +200,28 @@ def manage_chat(chat_key, system_prompt, pdf_name):
         with st.chat_message("user"):
             st.markdown(prompt)
         
-        with st.spinner('מעבד את השאלה שלך...'):
-            processor = get_pdf_processor()            
-            answer = processor.process_pdf_and_answer(pdf_name, prompt, system_prompt)
+        with st.chat_message("assistant"):
+            with st.spinner('מעבד את השאלה שלך...'):
+                processor = get_pdf_processor()            
+                answer_stream = background_loop.run(
+                    processor.aprocess_pdf_and_answer_stream(pdf_name, prompt, system_prompt, conversation_key)
+                )
+            # Render the answer as it is generated. If the user navigates away, Streamlit stops
+            # this script, and iterate() closes the stream, which cancels the request to the model.
+            # The stream runs on the shared background loop, so its connection pool outlives the rerun.
+            placeholder = st.empty()
+            answer = ""
+            for piece in background_loop.iterate(answer_stream):
+                answer += piece
+                placeholder.markdown(answer + "▌")
+            answer = answer.strip()
+            placeholder.markdown(answer)
+        report_question(prompt, answer, source=f"{current_tenant().name}/{chat_key}")
         
         st.session_state.chat_histories[chat_key].append({"role": "assistant", "content": answer})
-        with st.chat_message("assistant"):
-            st.markdown(answer)
         
         st.rerun()
             
-def load_html_file(file_name):
-    with open(file_name, 'r', encoding='utf-8') as f:
-        return f.read()
-    
-def load_footer():
-    footer_path = os.path.join('utils', 'footer.md')
-    if os.path.exists(footer_path):
-        with open(footer_path, 'r', encoding='utf-8') as footer_file:
-            return footer_file.read()
-    return None  # Return None if the file doesn't exist
-
 def display_images():
     if 'current_images' in st.session_state and st.session_state.current_images:
         display_and_download_images(st.session_state.current_images, st.session_state.current_chat)
@@ -214,7 +242,7 @@ def display_videos(videos):
                 st.exception(e)
 
 # תהליך ראשי
-async def main():
+def main():
     
     # אתחול משתני המצב
     if 'current_page' not in st.session_state:
@@ -227,13 +255,15 @@ async def main():
         st.session_state.chat_histories = {}
 
     set_page_config()
-    data = load_data()    
-    title, image_path, footer_content = initialize()
+    start_api()
+    start_services()
+    data = load_data()
+    prepare_uploads(current_tenant().uploads_folder)
+    title, image_path, footer_content = initialize(data)
 
     st.title(title, anchor=None, help="נוצר על ידי שגיא בר און")
 
-    expander_html = load_html_file('expander.html')
-    st.markdown(expander_html, unsafe_allow_html=True)
+    st.markdown(data.expander_html, unsafe_allow_html=True)
     
     # Handle page transitions
     if st.session_state.next_page is not None:
@@ -244,25 +274,25 @@ async def main():
         st.rerun()
 
     if st.session_state.current_page == 'main':
-        set_background_color(data["main_page"]["background_color"])
-        st.header(data["main_page"]["title"])
-        st.subheader(data["main_page"]["description"])
+        set_background_color(data.main_page)
+        st.header(data.main_page.title)
+        st.subheader(data.main_page.description)
 
         # Display main page videos
-        if "videos" in data["main_page"]:
-            display_videos(data["main_page"]["videos"])
+        if data.main_page.videos:
+            display_videos(data.main_page.videos)
 
         # Add carousel for main page if images are provided
-        if "images" in data["main_page"]:
-            main_images = data["main_page"]["images"]
+        if data.main_page.images:
+            main_images = data.main_page.images
             carousel_items = []
             for image in main_images:
-                image_path = os.path.abspath(os.path.join('uploads', image))
+                image_path = os.path.abspath(os.path.join(current_tenant().uploads_folder, image))
                 if os.path.exists(image_path):
                     carousel_items.append({
                         "title": "",
                         "text": "",
-                        "img": f"data:image/png;base64,{get_image_base64(image_path)}"
+                        "img": static_url(image_path, "display")
                     })
                 else:
                     st.error(f"התמונה {image} לא נמצאה בנתיב: {image_path}")
@@ -270,36 +300,36 @@ async def main():
             if carousel_items:
                 carousel(items=carousel_items, width=0.8)
 
-        cols = st.columns(len(data["main_buttons"]))
-        for i, button in enumerate(reversed(data["main_buttons"])):
-            if cols[i].button(button["name"], on_click=page_transition_callback, args=(button["key"],)):
+        cols = st.columns(len(data.main_buttons))
+        for i, button in enumerate(reversed(data.main_buttons)):
+            if cols[i].button(button.name, on_click=page_transition_callback, args=(button.key,)):
                 pass  # The actual state change is handled in the callback
     else:
-        dialog_data = data["dialogs"][st.session_state.current_page]
-        set_background_color(dialog_data["background_color"])
-        st.header(dialog_data["title"])
+        dialog_data = data.dialogs[st.session_state.current_page]
+        set_background_color(dialog_data)
+        st.header(dialog_data.title)
         
         # with col2:
-        pdf_button = display_pdf_download(dialog_data["pdf_file"])
+        pdf_button = display_pdf_download(dialog_data.pdf_file) if dialog_data.pdf_file else None
         if pdf_button:
             st.markdown(pdf_button, unsafe_allow_html=True)
         
         create_dialog(dialog_data)
 
         # Display dialog videos
-        if "videos" in dialog_data:
-            display_videos(dialog_data["videos"])
+        if dialog_data.videos:
+            display_videos(dialog_data.videos)
         
         # Display images only if they are present in the current state
         if 'current_images' in st.session_state and st.session_state.current_images:
             display_images()
         
-        if dialog_data["is_chatbot"]:            
-            manage_chat(st.session_state.current_page, dialog_data["system_prompt"], dialog_data["pdf_file"])
+        if dialog_data.is_chatbot:
+            manage_chat(st.session_state.current_page, dialog_data.system_prompt, dialog_data.pdf_file)
             
             if st.session_state.chat_histories[st.session_state.current_page] == []:
                 with st.chat_message("assistant"):
-                    st.markdown(dialog_data["description"])   
+                    st.markdown(dialog_data.description)   
         else:
             st.write("זהו מסך מידע. אין כאן אפשרות לצ'אט.")             
 
@@ -317,4 +347,4 @@ if __name__ == "__main__":
         st.session_state.counted = True
         increment_user_count()
     initialize_user_count()
-    asyncio.run(main())
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def mock_env(monkeypatch, tmp_path):
+    """Deterministic in-process backends and no files outside tmp_path."""
+    monkeypatch.setenv("MODEL_TYPE", "mock")
+    monkeypatch.setenv("EMBEDDINGS_BACKEND", "mock")
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", "")
+    monkeypatch.setenv("ANSWER_CACHE", "true")
+    monkeypatch.setenv("ANSWER_CACHE_PATH", "")
+    return tmp_path
@@ -0,0 +1,59 @@
+import numpy as np
+
+from utils.AnswerCache import AnswerCache
+from utils.EmbeddingIndex import EmbeddingIndex
+from utils.PdfQAProcessor import PdfQAProcessor
+
+def test_saved_entries_are_found_after_load(mock_env):
+    processor = PdfQAProcessor(data_folder=str(mock_env), embeddings_folder=str(mock_env / "embeddings"))
+    index = EmbeddingIndex(
+        np.eye(2, dtype=np.float32), ["first chunk", "second chunk"],
+        source={"sha256": "abc", "size": 1, "mtime": 0.0}, chunking="structured:max_tokens=300"
+    )
+    scope = processor.answer_cache_scope("pool.pdf", index, "system prompt", ("session", "pool"))
+    vector = np.array([0.6, 0.8], dtype=np.float32)
+
+    path = str(mock_env / "answers")
+    cache = AnswerCache(path=path)
+    cache.put(scope, vector, "question", "answer")
+    cache.save()
+
+    reloaded = AnswerCache(path=path)
+    assert len(reloaded) == 1
+    assert reloaded.lookup(scope, vector) == "answer"
+
+def test_vectors_of_another_dimension_are_a_miss():
+    cache = AnswerCache()
+    cache.put(("pool.pdf",), np.array([0.6, 0.8], dtype=np.float32), "question", "answer")
+    assert cache.lookup(("pool.pdf",), np.array([0.6, 0.8, 0.0], dtype=np.float32)) is None
+    assert cache.lookup(("pool.pdf",), np.array([0.6, 0.8], dtype=np.float32)) == "answer"
+
+def test_scope_changes_with_the_embeddings_model(mock_env, monkeypatch):
+    index = EmbeddingIndex(
+        np.eye(2, dtype=np.float32), ["first chunk", "second chunk"],
+        source={"sha256": "abc", "size": 1, "mtime": 0.0}, chunking="structured:max_tokens=300"
+    )
+    scopes = []
+    for model in ("text-embedding-ada-002", "text-embedding-3-large"):
+        monkeypatch.setenv("EMBEDDINGS_MODEL", model)
+        processor = PdfQAProcessor(data_folder=str(mock_env), embeddings_folder=str(mock_env / "embeddings"))
+        scopes.append(processor.answer_cache_scope("pool.pdf", index, "system prompt", ("session", "pool")))
+    assert scopes[0] != scopes[1]
+
+def test_tenants_keep_their_own_answer_cache_file(mock_env, monkeypatch):
+    monkeypatch.setenv("ANSWER_CACHE_PATH", str(mock_env / "answers"))
+    vector = np.array([0.6, 0.8], dtype=np.float32)
+    processors = {}
+    for tenant in ("north", "south"):
+        processors[tenant] = PdfQAProcessor(
+            data_folder=str(mock_env / tenant / "data"),
+            embeddings_folder=str(mock_env / tenant / "embeddings"),
+            tenant=tenant
+        )
+    processors["north"].answer_cache.put(("pool.pdf",), vector, "question", "north answer")
+    processors["south"].answer_cache.put(("pool.pdf",), vector, "question", "south answer")
+    processors["north"].answer_cache.save()
+    processors["south"].answer_cache.save()
+
+    assert processors["north"].answer_cache.path != processors["south"].answer_cache.path
+    assert AnswerCache(path=processors["north"].answer_cache.path).lookup(("pool.pdf",), vector) == "north answer"
@@ -0,0 +1,35 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from utils.api import create_app
+
+def call(method, path, **kwargs):
+    async def run():
+        async with TestClient(TestServer(create_app())) as client:
+            response = await client.request(method, path, **kwargs)
+            return response.status, await response.json()
+    return asyncio.run(run())
+
+def test_conversation_ids_are_issued_by_the_server(mock_env):
+    status, body = call("POST", "/v1/conversations")
+    assert status == 201
+    assert call("POST", "/v1/conversations")[1]["conversation_id"] != body["conversation_id"]
+
+    # An ID the server didn't sign is refused before anything is answered
+    status, body = call("POST", "/v1/ask", json={"question": "?", "dialog": "pool", "conversation_id": "alice"})
+    assert (status, body["error"]) == (404, "Unknown conversation_id")
+
+def test_token_is_required_when_set(mock_env, monkeypatch):
+    monkeypatch.setenv("API_TOKEN", "secret")
+    assert call("POST", "/v1/conversations")[0] == 401
+    assert call("POST", "/v1/conversations", headers={"Authorization": "Bearer wrong"})[0] == 401
+    assert call("POST", "/v1/conversations", headers={"Authorization": "Bearer secret"})[0] == 201
+    assert call("GET", "/health")[0] == 200
+
+def test_tenant_and_dialog_of_the_wrong_type_are_bad_requests(mock_env):
+    for body in ({"question": "?", "dialog": ["pool"]}, {"question": "?", "dialog": "pool", "tenant": {"a": 1}}):
+        status, answer = call("POST", "/v1/ask", json=body)
+        assert status == 400
+        assert "error" in answer
+    assert call("POST", "/v1/retrieve", json={"question": "?", "tenant": ["a"]})[0] == 400
@@ -0,0 +1,32 @@
+from utils.chunking import get_chunker
+
+def page_of(lengths, offset):
+    for page_number, length in enumerate(lengths, start=1):
+        if offset < length:
+            return page_number
+        offset -= length
+
+def test_fixed_chunk_after_a_cut_on_a_page_boundary():
+    # Chunk 20 starts exactly where page 5 starts
+    lengths = [57, 407, 9, 527, 12]
+    pages = [(page_number, "x" * length) for page_number, length in enumerate(lengths, start=1)]
+    chunks = list(get_chunker("fixed", size=50)(pages))
+    assert len(chunks) == 21
+    for i, chunk in enumerate(chunks):
+        assert chunk.first_page == page_of(lengths, i * 50)
+        assert chunk.last_page == page_of(lengths, i * 50 + len(chunk.text) - 1)
+
+def test_structured_chunks_keep_line_and_paragraph_breaks():
+    page = "Opening hours:\nSunday 08:00-20:00\nFriday 08:00-14:00\n\nPrices. Adults 40 NIS. Children 25 NIS."
+    chunks = list(get_chunker("structured", max_tokens=300, overlap_tokens=50)([(1, page)]))
+    assert [chunk.text for chunk in chunks] == [
+        "Opening hours:\nSunday 08:00-20:00\nFriday 08:00-14:00\n\nPrices. Adults 40 NIS. Children 25 NIS."
+    ]
+
+def test_structured_overlap_keeps_its_breaks():
+    page = "\n".join(f"Line {i} of the price list." for i in range(40))
+    chunks = list(get_chunker("structured", max_tokens=60, overlap_tokens=20)([(1, page)]))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert " Line" not in chunk.text
+        assert chunk.text in page
@@ -0,0 +1,36 @@
+from utils.EmbeddingPipeline import EmbeddingPipeline
+
+TEXTS = [f"chunk {i}" for i in range(10)]
+
+def interrupted_run(checkpoint_path, **options):
+    calls = []
+    def embed(texts):
+        calls.append(len(calls))
+        if len(calls) > 2:
+            raise RuntimeError("interrupted")
+        return [[1.0] for _ in texts]
+    pipeline = EmbeddingPipeline(embed, max_workers=1, max_retries=0, **options)
+    try:
+        pipeline.run(TEXTS, checkpoint_path=checkpoint_path)
+    except RuntimeError:
+        pass
+
+def resumed_vectors(checkpoint_path, **options):
+    pipeline = EmbeddingPipeline(lambda texts: [[2.0] for _ in texts], max_workers=1, **options)
+    return pipeline.run(TEXTS, checkpoint_path=checkpoint_path)
+
+def test_checkpoint_resumes_the_same_run(tmp_path):
+    path = str(tmp_path / "run.partial.jsonl")
+    interrupted_run(path, max_batch_items=3, embedder="mock:a")
+    vectors = resumed_vectors(path, max_batch_items=3, embedder="mock:a")
+    assert vectors == [[1.0]] * 6 + [[2.0]] * 4
+
+def test_checkpoint_of_another_model_is_not_resumed(tmp_path):
+    path = str(tmp_path / "run.partial.jsonl")
+    interrupted_run(path, max_batch_items=3, embedder="mock:a")
+    assert resumed_vectors(path, max_batch_items=3, embedder="mock:b") == [[2.0]] * 10
+
+def test_checkpoint_of_other_batches_is_not_resumed(tmp_path):
+    path = str(tmp_path / "run.partial.jsonl")
+    interrupted_run(path, max_batch_items=3, embedder="mock:a")
+    assert resumed_vectors(path, max_batch_items=4, embedder="mock:a") == [[2.0]] * 10
@@ -0,0 +1,43 @@
+import numpy as np
+
+from utils.EmbeddingIndex import EmbeddingIndex, clear_indexes, file_fingerprint, index_pool_stats, set_index_pool_limit
+from utils.PdfQAProcessor import PdfQAProcessor
+
+def make_processor(mock_env, monkeypatch, documents=("events", "pool")):
+    data = mock_env / "data"
+    data.mkdir()
+    embeddings = str(mock_env / "embeddings")
+    monkeypatch.setenv("RETRIEVAL_SCOPE", "global")
+    processor = PdfQAProcessor(data_folder=str(data), embeddings_folder=embeddings)
+    for i, name in enumerate(documents):
+        (data / f"{name}.pdf").write_bytes(f"%PDF-1.4 {name}".encode())
+        vectors = np.random.default_rng(i).normal(size=(50, 64)).astype(np.float32)
+        EmbeddingIndex(
+            vectors, [f"{name} chunk {j}" for j in range(50)],
+            source=file_fingerprint(str(data / f"{name}.pdf")), model=processor.embeddings_model,
+            chunking=processor.chunking
+        ).save(embeddings, name)
+    return processor
+
+def test_global_index_counts_against_the_pool(mock_env, monkeypatch):
+    processor = make_processor(mock_env, monkeypatch)
+    try:
+        global_index = processor.load_global_index()
+        stats = index_pool_stats()
+        assert stats["indexes"] == 3
+        assert stats["bytes"] >= 2 * global_index.vectors.nbytes
+    finally:
+        clear_indexes()
+
+def test_global_index_survives_unloading_its_documents(mock_env, monkeypatch):
+    processor = make_processor(mock_env, monkeypatch)
+    try:
+        global_index = processor.load_global_index()
+        # Room for the merged index only: the per-document indexes are unloaded
+        set_index_pool_limit(global_index.memory_bytes())
+        assert index_pool_stats()["indexes"] == 1
+        assert processor.load_global_index() is global_index
+        assert index_pool_stats()["indexes"] == 1
+    finally:
+        set_index_pool_limit(None)
+        clear_indexes()
@@ -0,0 +1,27 @@
+import numpy as np
+
+from utils.EmbeddingIndex import EmbeddingIndex, file_fingerprint
+from utils.PdfQAProcessor import PdfQAProcessor
+from utils.indexing import needs_indexing
+
+def test_changing_the_embeddings_model_outdates_the_index(mock_env, monkeypatch):
+    data = mock_env / "data"
+    data.mkdir()
+    (data / "pool.pdf").write_bytes(b"%PDF-1.4 pool")
+    embeddings = str(mock_env / "embeddings")
+
+    monkeypatch.setenv("EMBEDDINGS_MODEL", "text-embedding-ada-002")
+    processor = PdfQAProcessor(data_folder=str(data), embeddings_folder=embeddings)
+    index = EmbeddingIndex(
+        np.eye(2, dtype=np.float32), ["first chunk", "second chunk"],
+        source=file_fingerprint(str(data / "pool.pdf")), model=processor.embeddings_model,
+        chunking=processor.chunking
+    )
+    index.save(embeddings, "pool")
+    assert processor.is_index_current(index, "pool.pdf")
+    assert not needs_indexing(processor, "pool.pdf")
+
+    monkeypatch.setenv("EMBEDDINGS_MODEL", "text-embedding-3-large")
+    processor = PdfQAProcessor(data_folder=str(data), embeddings_folder=embeddings)
+    assert not processor.is_index_current(index, "pool.pdf")
+    assert needs_indexing(processor, "pool.pdf")
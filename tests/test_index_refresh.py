@@ -0,0 +1,50 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.EmbeddingCache import EmbeddingCache
+from utils.EmbeddingIndex import EmbeddingIndex, clear_indexes, file_fingerprint
+from utils.PdfQAProcessor import PdfQAProcessor
+
+def test_connections_of_finished_threads_are_closed(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "cache.sqlite"))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda i: cache.embed([f"text {i}"], "mock", lambda texts: [[1.0, 0.0]] * len(texts)), range(16)))
+    assert cache._connections
+    cache.close_finished_connections()
+    assert all(thread is threading.current_thread() for thread in cache._connections)
+
+def test_outdated_index_is_served_while_it_is_rebuilt(mock_env):
+    data = mock_env / "data"
+    data.mkdir()
+    (data / "pool.pdf").write_bytes(b"%PDF-1.4 pool")
+    embeddings = str(mock_env / "embeddings")
+    processor = PdfQAProcessor(data_folder=str(data), embeddings_folder=embeddings)
+    EmbeddingIndex(
+        np.eye(2, dtype=np.float32), ["first chunk", "second chunk"],
+        source=file_fingerprint(str(data / "pool.pdf")), model=processor.embeddings_model,
+        chunking=processor.chunking
+    ).save(embeddings, "pool")
+    (data / "pool.pdf").write_bytes(b"%PDF-1.4 pool, edited")
+
+    started, release = threading.Event(), threading.Event()
+    def slow_refresh(pdf_name, previous):
+        started.set()
+        release.wait(10)
+        return previous
+    processor.refresh_index = slow_refresh
+
+    try:
+        refreshing = threading.Thread(target=processor.load_index, args=("pool.pdf",))
+        refreshing.start()
+        assert started.wait(5)
+        # Another question on the PDF doesn't wait for the rebuild
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert len(executor.submit(processor.load_index, "pool.pdf").result(timeout=2)) == 2
+        release.set()
+        refreshing.join(5)
+        assert not processor._refreshing
+    finally:
+        release.set()
+        clear_indexes()
@@ -0,0 +1,31 @@
+from utils.chunking import get_chunker
+from utils.prompt_budget import PromptBudgeter, dedupe_sentences
+
+def overlapping_chunks():
+    text = " ".join(f"The pool opens at {hour} on day number {day} of the summer season."
+                    for day, hour in enumerate(range(6, 26), start=1))
+    chunker = get_chunker("structured", max_tokens=60, overlap_tokens=20)
+    return [chunk.text for chunk in chunker([(1, text)])]
+
+def test_structured_overlap_is_removed():
+    chunks = overlapping_chunks()
+    first_sentence_of_second = chunks[1].split(". ")[0] + "."
+    # The chunker repeats the tail of every chunk at the start of the next one
+    assert first_sentence_of_second in chunks[0]
+
+    unique = dedupe_sentences(chunks)
+    assert len(unique) == len(chunks)
+    assert first_sentence_of_second not in unique[1]
+    assert unique[1] in chunks[1]
+    assert " ".join(unique) == " ".join(dedupe_sentences([" ".join(chunks)]))
+
+def test_select_context_keeps_every_sentence_once():
+    chunks = overlapping_chunks()
+    context = PromptBudgeter(context_tokens=10000).select_context(chunks)
+    for day in range(1, 21):
+        assert context.count(f"on day number {day} of") == 1
+
+def test_line_structure_is_kept():
+    assert dedupe_sentences(["Opening hours:\nSunday 8-20.", "Sunday 8-20.\nFriday 8-14."]) == [
+        "Opening hours:\nSunday 8-20.", "Friday 8-14."
+    ]
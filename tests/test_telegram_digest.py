@@ -0,0 +1,21 @@
+import html
+import re
+
+from utils.TelegramSender import MAX_MESSAGE_CHARS, _digest_messages
+
+# A message is valid HTML for Telegram when every "&" starts a whole entity
+ENTITY = re.compile(r"&(amp|lt|gt|quot|#x27);")
+
+def assert_valid(message):
+    assert len(message) <= MAX_MESSAGE_CHARS
+    assert message.count("&") == len(ENTITY.findall(message))
+
+def test_long_text_is_cut_before_escaping():
+    for offset in range(6):
+        text = "x" * offset + "<&>\"'" * MAX_MESSAGE_CHARS
+        for message in _digest_messages("Unanswered", [text]) + _digest_messages("Unanswered", [text, text]):
+            assert_valid(message)
+
+def test_short_texts_are_kept_whole():
+    messages = _digest_messages("Questions", ["a < b", "c & d"])
+    assert messages == [f"<b>Questions (2)</b>\n\n• {html.escape('a < b')}\n• {html.escape('c & d')}"]
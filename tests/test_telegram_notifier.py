@@ -0,0 +1,43 @@
+import asyncio
+import json
+import time
+
+from utils.TelegramSender import TelegramNotifier
+
+class FakeSender:
+    chat_id = "chat"
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.messages = []
+
+    async def send_message(self, text, chat_id=None):
+        await asyncio.sleep(self.delay)
+        self.messages.append(text)
+        return True
+
+    async def close_session(self):
+        pass
+
+def test_stop_ends_the_batch_wait_and_sends(tmp_path):
+    sender = FakeSender()
+    notifier = TelegramNotifier(sender, batch_seconds=10, path=str(tmp_path / "queue.json")).start()
+    notifier.notify("questions", "first question")
+    time.sleep(0.1)
+
+    start = time.perf_counter()
+    notifier.stop(5)
+    assert time.perf_counter() - start < 2
+    assert notifier.sent == 1 and len(sender.messages) == 1
+    assert json.load(open(tmp_path / "queue.json", encoding='utf-8')) == []
+
+def test_batch_still_being_sent_is_saved(tmp_path):
+    path = str(tmp_path / "queue.json")
+    notifier = TelegramNotifier(FakeSender(delay=30), batch_seconds=0, path=path).start()
+    notifier.notify("questions", "slow question")
+    time.sleep(0.2)
+
+    notifier.stop(0.2)
+    saved = json.load(open(path, encoding='utf-8'))
+    assert [notification["text"] for notification in saved] == ["slow question"]
+    assert [notification["text"] for notification in TelegramNotifier(FakeSender(), path=path)._pending] == ["slow question"]
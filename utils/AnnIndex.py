@@ -0,0 +1,160 @@
+import os
+import numpy as np
+from utils.EmbeddingIndex import normalize_rows, search_vectors, top_k_indices
+from utils.LexicalIndex import chunks_signature
+
+# Rows scored per block while clustering, keeps the score matrix small for large corpora
+_BLOCK_ROWS = 8192
+
+def _assign(vectors, centroids):
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + _BLOCK_ROWS])
+        assignments[start:start + _BLOCK_ROWS] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+def _cluster_sums(vectors, assignments, n_clusters):
+    sums = np.zeros((n_clusters, vectors.shape[1]), dtype=np.float32)
+    for start in range(0, len(vectors), _BLOCK_ROWS):
+        block_assignments = assignments[start:start + _BLOCK_ROWS]
+        order = np.argsort(block_assignments, kind='stable')
+        clusters, starts = np.unique(block_assignments[order], return_index=True)
+        block = np.asarray(vectors[start:start + _BLOCK_ROWS])[order]
+        sums[clusters] += np.add.reduceat(block, starts, axis=0)
+    return sums
+
+def spherical_kmeans(vectors, n_clusters, n_iter=20, seed=0):
+    """
+    Clusters unit-normalized vectors by cosine similarity.
+
+    Returns:
+    - (centroids, assignments): The unit-normalized centroids and the cluster of each row.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = np.array(vectors[rng.choice(len(vectors), n_clusters, replace=False)], dtype=np.float32)
+
+    for _ in range(n_iter):
+        assignments = _assign(vectors, centroids)
+        sums = _cluster_sums(vectors, assignments, n_clusters)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # Re-seed empty clusters with random rows so no list stays unused
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+        new_centroids = normalize_rows(sums)
+        if np.allclose(new_centroids, centroids, atol=1e-6):
+            break
+        centroids = new_centroids
+
+    return centroids, _assign(vectors, centroids)
+
+class IVFIndex:
+    """
+    Inverted-file (IVF) approximate nearest-neighbour index over unit-normalized vectors.
+
+    The vectors are clustered into `n_lists` cells. A query only scores the chunks of its
+    `n_probe` closest cells, so raising `n_probe` trades speed for recall
+    (`n_probe == n_lists` is an exact scan).
+    """
+
+    def __init__(self, centroids, order, offsets, n_probe=16, signature=None):
+        self.centroids = centroids
+        # Row ids grouped by cell: cell i holds order[offsets[i]:offsets[i + 1]]
+        self.order = order
+        self.offsets = offsets
+        self.n_probe = n_probe
+        # Identifies the chunks and model the index was built from (see vectors_signature)
+        self.signature = signature
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_probe=16, n_iter=20, seed=0):
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+
+        centroids, assignments = spherical_kmeans(vectors, n_lists, n_iter=n_iter, seed=seed)
+        order = np.argsort(assignments, kind='stable').astype(np.int64)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=n_lists)))).astype(np.int64)
+        return cls(centroids, order, offsets, n_probe=n_probe)
+
+    def save(self, filename):
+        with open(filename + ".tmp", 'wb') as f:
+            np.savez(f, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                     signature=self.signature or "")
+        os.replace(filename + ".tmp", filename)
+
+    @classmethod
+    def load(cls, filename, n_probe=16):
+        with np.load(filename) as data:
+            signature = str(data["signature"]) if "signature" in data.files else ""
+            return cls(data["centroids"], data["order"], data["offsets"], n_probe=n_probe, signature=signature or None)
+
+    def search(self, vectors, queries, top_k, n_probe=None):
+        """
+        Approximate top-k search.
+
+        Parameters:
+        - vectors: The unit-normalized matrix the index was built from.
+        - queries: One query vector or a matrix of query vectors.
+        - top_k: Number of chunks to return per query.
+        - n_probe: Cells to scan per query (defaults to the index setting).
+
+        Returns:
+        - (indices, scores): Arrays of shape (n_queries, top_k), best match first.
+          Rows with fewer candidates than top_k are padded with -1 / -inf.
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        queries = normalize_rows(np.atleast_2d(queries))
+        probes = top_k_indices(queries @ self.centroids.T, n_probe)
+
+        indices = np.full((len(queries), top_k), -1, dtype=np.int64)
+        scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        for row, (query, cells) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in cells])
+            if len(candidates) == 0:
+                continue
+            candidates.sort()  # sequential reads from the memory-mapped matrix
+            candidate_scores = np.asarray(vectors[candidates]) @ query
+            best = top_k_indices(candidate_scores, top_k)[0]
+            indices[row, :len(best)] = candidates[best]
+            scores[row, :len(best)] = candidate_scores[best]
+        return indices, scores
+
+class AnnSearcher:
+    """
+    Chooses between an IVF index and an exact scan for one document's vectors.
+    Small corpora (fewer than `min_chunks` rows) always use the exact scan.
+    """
+
+    def __init__(self, vectors, ivf=None):
+        self.vectors = vectors
+        self.ivf = ivf
+
+    @classmethod
+    def for_index(cls, index, filename, n_lists=None, n_probe=16, min_chunks=10000):
+        if len(index) < min_chunks:
+            return cls(index.vectors)
+
+        # A saved index is only reused if it was built from the same chunks and model
+        signature = f"{chunks_signature(index.chunk_hashes)}:{index.model}"
+        if os.path.exists(filename):
+            ivf = IVFIndex.load(filename, n_probe=n_probe)
+            if ivf.signature == signature and ivf.offsets[-1] == len(index):
+                return cls(index.vectors, ivf)
+
+        print(f"Building IVF index {filename} over {len(index)} chunks...")
+        ivf = IVFIndex.build(index.vectors, n_lists=n_lists, n_probe=n_probe)
+        ivf.signature = signature
+        ivf.save(filename)
+        return cls(index.vectors, ivf)
+
+    def search_batch(self, queries, top_k=3, n_probe=None):
+        if self.ivf is None:
+            return search_vectors(self.vectors, queries, top_k)
+        return self.ivf.search(self.vectors, queries, top_k, n_probe=n_probe)
@@ -0,0 +1,182 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.EmbeddingIndex import normalize_rows
+
+# JSON turns the (nested) tuples of a scope into lists; scopes are dict keys, so turn them back
+def _as_tuple(value):
+    if isinstance(value, list):
+        return tuple(_as_tuple(item) for item in value)
+    return value
+
+class AnswerCache:
+    """
+    Semantic cache of answers, looked up by question embedding similarity.
+
+    Answers are grouped by scope, e.g. (PDF name, system prompt hash, document version),
+    so an answer is only reused for the same document content and instructions. A new
+    question hits when its cosine similarity to a cached question of the same scope is at
+    least `threshold`.
+
+    Parameters:
+    - threshold: Minimum cosine similarity for a hit.
+    - max_entries: Total entries kept; the least recently used are evicted first.
+    - ttl_seconds: Entries older than this are never returned (0 keeps them forever).
+    - path: Optional file prefix to persist the cache to (`<path>.json` + `<path>.npy`).
+    - persist_every: Save to `path` after this many new entries (and at exit).
+    """
+
+    def __init__(self, threshold=0.95, max_entries=5000, ttl_seconds=86400, path=None, persist_every=20):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.persist_every = persist_every
+
+        # (scope, entry id) -> {"vector", "question", "answer", "created"}, least recently used first
+        self._entries = OrderedDict()
+        # scope -> (entry ids, matrix of their vectors), rebuilt when the scope changes
+        self._scopes = {}
+        self._next_id = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.path:
+            self.load()
+            atexit.register(self.save)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _scope_matrix(self, scope):
+        cached = self._scopes.get(scope)
+        if cached is None:
+            ids = [key[1] for key in self._entries if key[0] == scope]
+            vectors = [self._entries[(scope, entry_id)]["vector"] for entry_id in ids]
+            matrix = np.vstack(vectors) if vectors else None
+            cached = (ids, matrix)
+            self._scopes[scope] = cached
+        return cached
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds and now - entry["created"] > self.ttl_seconds
+
+    def lookup(self, scope, vector):
+        """
+        Returns the cached answer for the most similar earlier question of the scope,
+        or None if none is similar enough.
+        """
+        vector = normalize_rows(np.atleast_2d(vector))[0]
+        now = time.time()
+        with self._lock:
+            ids, matrix = self._scope_matrix(scope)
+            # Vectors of another embeddings model (e.g. from an older saved cache) never match
+            if matrix is not None and matrix.shape[1] == vector.shape[0]:
+                similarities = matrix @ vector
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    key = (scope, ids[i])
+                    entry = self._entries[key]
+                    if self._expired(entry, now):
+                        continue
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def put(self, scope, vector, question, answer):
+        vector = normalize_rows(np.atleast_2d(vector))[0]
+        with self._lock:
+            self._add((scope, self._next_id), vector, question, answer, time.time())
+            self._evict(time.time())
+            self._unsaved += 1
+            save_now = self.path and self._unsaved >= self.persist_every
+        if save_now:
+            self.save()
+
+    # Called with the lock held
+    def _add(self, key, vector, question, answer, created):
+        self._entries[key] = {"vector": vector, "question": question, "answer": answer, "created": created}
+        self._next_id = max(self._next_id, key[1]) + 1
+        self._scopes.pop(key[0], None)
+
+    def _evict(self, now):
+        while len(self._entries) > self.max_entries:
+            (scope, _), _ = self._entries.popitem(last=False)
+            self._scopes.pop(scope, None)
+            self.evictions += 1
+        if self.ttl_seconds:
+            for key in [key for key, entry in self._entries.items() if self._expired(entry, now)]:
+                del self._entries[key]
+                self._scopes.pop(key[0], None)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            keys = list(self._entries)
+            entries = [self._entries[key] for key in keys]
+            self._unsaved = 0
+
+        metadata = [
+            {"scope": list(key[0]), "question": e["question"], "answer": e["answer"], "created": e["created"]}
+            for key, e in zip(keys, entries)
+        ]
+        vectors = np.vstack([e["vector"] for e in entries]) if entries else np.zeros((0, 0), dtype=np.float32)
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".npy.tmp", 'wb') as f:
+            np.save(f, vectors)
+        with open(self.path + ".json.tmp", 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        os.replace(self.path + ".npy.tmp", self.path + ".npy")
+        os.replace(self.path + ".json.tmp", self.path + ".json")
+
+    def load(self):
+        if not (os.path.exists(self.path + ".json") and os.path.exists(self.path + ".npy")):
+            return
+        try:
+            with open(self.path + ".json", 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            vectors = np.load(self.path + ".npy")
+        except (ValueError, OSError) as e:
+            print(f"Ignoring unreadable answer cache {self.path}: {e}")
+            return
+        if len(metadata) != len(vectors):
+            return
+
+        now = time.time()
+        with self._lock:
+            for i, (item, vector) in enumerate(zip(metadata, vectors)):
+                entry = {"created": item["created"]}
+                if not self._expired(entry, now):
+                    self._add((_as_tuple(item["scope"]), i), vector, item["question"], item["answer"], item["created"])
+            self._evict(now)
@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+class ConversationStore:
+    """
+    Conversation history of many users, keyed by (session id, chat key).
+
+    Each conversation keeps its last `max_turns` question/answer pairs as an immutable
+    tuple, so readers never take a lock: they get a consistent snapshot even while
+    another thread appends. Writers are serialized by a lock. Memory is bounded by
+    `max_conversations` (least recently updated ones are dropped first) and by
+    `idle_seconds` (conversations without a new turn for that long are dropped).
+    """
+
+    def __init__(self, max_turns=10, max_conversations=10000, idle_seconds=3600):
+        self.max_turns = max_turns
+        self.max_conversations = max_conversations
+        self.idle_seconds = idle_seconds
+        # key -> (turns, last_update), ordered from least to most recently updated
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def get(self, key):
+        """
+        Returns the turns of a conversation as a tuple of {"question", "answer"} dicts.
+        """
+        entry = self._conversations.get(key)
+        if entry is None:
+            return ()
+        turns, last_update = entry
+        if self.idle_seconds and time.monotonic() - last_update > self.idle_seconds:
+            return ()
+        return turns
+
+    def append(self, key, question, answer):
+        turn = {"question": question, "answer": answer}
+        now = time.monotonic()
+        with self._lock:
+            turns = self.get(key) + (turn,)
+            self._conversations[key] = (turns[-self.max_turns:], now)
+            self._conversations.move_to_end(key)
+            self._evict(now)
+
+    def clear(self, key):
+        with self._lock:
+            self._conversations.pop(key, None)
+
+    def clear_all(self):
+        with self._lock:
+            self._conversations.clear()
+
+    # Called with the lock held; the oldest entries are always at the front
+    def _evict(self, now):
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+        if self.idle_seconds:
+            while self._conversations:
+                _, (_, last_update) = next(iter(self._conversations.items()))
+                if now - last_update <= self.idle_seconds:
+                    break
+                self._conversations.popitem(last=False)
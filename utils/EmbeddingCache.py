@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+def text_key(model, text):
+    """
+    Content address of an embedding: the model name and the hash of the text with
+    whitespace collapsed, so the same text from another PDF or question maps to one entry.
+    """
+    normalized = " ".join(text.split())
+    digest = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+    return f"{model}:{digest}"
+
+class EmbeddingCache:
+    """
+    Two-tier cache of embeddings by content address.
+
+    The memory tier keeps the `max_entries` most recently used vectors. The optional disk
+    tier is an SQLite file with one float32 blob per vector; it is shared by all processes
+    using the same path (e.g. the indexing workers) and survives restarts.
+    """
+
+    def __init__(self, path=None, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # sqlite3 connections can't be shared between threads: each thread opens its own,
+        # and the connections of finished threads are closed by close_finished_connections()
+        self._local = threading.local()
+        self._connections = {}
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with self._connection() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+                )
+
+    def __len__(self):
+        return len(self._memory)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            self.close_finished_connections()
+            # Only this thread uses it; the check is off so it can be closed once the thread ends
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections[threading.current_thread()] = connection
+        return connection
+
+    def close_finished_connections(self):
+        """
+        Closes the connections opened by threads that have ended, e.g. the worker threads
+        of an embedding run.
+        """
+        with self._lock:
+            finished = [thread for thread in self._connections if not thread.is_alive()]
+            connections = [self._connections.pop(thread) for thread in finished]
+        for connection in connections:
+            connection.close()
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """
+        Returns {position: vector} for the keys found in either tier.
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is None:
+                    missing.append(i)
+                else:
+                    self._memory.move_to_end(key)
+                    found[i] = vector
+            self.hits += len(found)
+
+        if missing and self.path:
+            wanted = {}
+            for i in missing:
+                wanted.setdefault(keys[i], []).append(i)
+            unique_keys = list(wanted)
+            rows = []
+            # Stay below SQLite's limit on the number of query parameters
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows += self._connection().execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                self._remember(key, vector)
+                for i in wanted[key]:
+                    found[i] = vector
+            with self._lock:
+                self.disk_hits += sum(len(wanted[key]) for key, _ in rows)
+
+        with self._lock:
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, keys, vectors):
+        vectors = [np.asarray(vector, dtype=np.float32) for vector in vectors]
+        for key, vector in zip(keys, vectors):
+            self._remember(key, vector)
+        if self.path:
+            with self._connection() as connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, vector.tobytes()) for key, vector in zip(keys, vectors)]
+                )
+
+    def embed(self, texts, model, embed_texts):
+        """
+        Returns the embeddings of texts, calling embed_texts only for the texts not cached yet.
+        Identical texts in one call are embedded once.
+        """
+        keys, found, pending = self._partition(texts, model)
+        if pending:
+            self._fill(keys, found, pending, embed_texts([texts[i] for i in pending.values()]))
+        return [found[i] for i in range(len(texts))]
+
+    async def aembed(self, texts, model, aembed_texts):
+        """
+        Async version of embed; aembed_texts is a coroutine function. The SQLite reads and
+        writes run on a worker thread, so a locked database doesn't stall the event loop.
+        """
+        keys, found, pending = await asyncio.to_thread(self._partition, texts, model)
+        if pending:
+            new_vectors = await aembed_texts([texts[i] for i in pending.values()])
+            await asyncio.to_thread(self._fill, keys, found, pending, new_vectors)
+        return [found[i] for i in range(len(texts))]
+
+    # Keys of the texts, the vectors already cached by position, and the first position of each missing key
+    def _partition(self, texts, model):
+        keys = [text_key(model, text) for text in texts]
+        found = self.get_many(keys)
+        pending = {}
+        for i, key in enumerate(keys):
+            if i not in found:
+                pending.setdefault(key, i)
+        return keys, found, pending
+
+    def _fill(self, keys, found, pending, new_vectors):
+        self.put_many(list(pending), new_vectors)
+        by_key = dict(zip(pending, new_vectors))
+        for i, key in enumerate(keys):
+            if i not in found:
+                found[i] = by_key[key]
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
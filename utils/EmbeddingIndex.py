@@ -0,0 +1,350 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import numpy as np
+from utils.LexicalIndex import BM25Index, chunks_signature
+
+INDEX_FORMAT_VERSION = 4
+
+# How indexes built before the chunking strategy was recorded were chunked
+LEGACY_CHUNKING = "fixed:size=2000"
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# Content hash, size and modification time of a source file
+def file_fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    stat = os.stat(path)
+    return {"sha256": digest.hexdigest(), "size": stat.st_size, "mtime": stat.st_mtime}
+
+# Scale every row to unit length so cosine similarity becomes a plain dot product
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_k_indices(scores, k):
+    """
+    Returns the indices of the k highest scores of each row, best first.
+    Uses argpartition so only the k winners are sorted, not the whole row.
+    """
+    scores = np.atleast_2d(scores)
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+def search_vectors(vectors, queries, top_k):
+    """
+    Scores a batch of query vectors against unit-normalized chunk vectors with a
+    single matrix product.
+
+    Parameters:
+    - vectors: Matrix of unit-normalized chunk vectors, one row per chunk.
+    - queries: One query vector or a matrix of query vectors (need not be normalized).
+    - top_k: Number of chunks to return per query.
+
+    Returns:
+    - (indices, scores): Two arrays of shape (n_queries, top_k), best match first.
+    """
+    queries = normalize_rows(np.atleast_2d(queries))
+    scores = queries @ np.asarray(vectors).T
+    indices = top_k_indices(scores, top_k)
+    return indices, np.take_along_axis(scores, indices, axis=1)
+
+class EmbeddingIndex:
+    """
+    The chunk vectors of one document, stored once as a contiguous float32 matrix
+    (`<name>_embeddings.npy`, memory-mapped on load) with the chunk texts kept in a
+    JSON sidecar (`<name>_chunks.json`). Vectors are unit-normalized when stored.
+
+    The sidecar doubles as the document's manifest: it records the fingerprint of the
+    source PDF the index was built from and a content hash per chunk, so re-indexing a
+    changed PDF only re-embeds the chunks whose text changed.
+    """
+
+    # Optional approximate searcher (see utils.AnnIndex); None means exact scan
+    ann = None
+    # BM25 index over the chunk texts (see utils.LexicalIndex), attached on demand
+    lexical = None
+
+    def __init__(self, vectors, chunks, source=None, chunk_hashes=None, model=None,
+                 chunking=LEGACY_CHUNKING, pages=None):
+        self.vectors = normalize_rows(vectors)
+        self.chunks = list(chunks)
+        self.source = source
+        self.model = model
+        self.chunking = chunking
+        # (first_page, last_page) of every chunk, when known
+        self.pages = [tuple(p) for p in pages] if pages is not None else None
+        self.chunk_hashes = list(chunk_hashes) if chunk_hashes is not None else [chunk_hash(c) for c in self.chunks]
+        if self.vectors.ndim != 2 or len(self.vectors) != len(self.chunks):
+            raise ValueError("Embedding matrix must have exactly one row per chunk.")
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def memory_bytes(self):
+        """
+        Approximate memory held by the index: the vectors (memory-mapped, so resident once
+        searched), the chunk texts and the attached lexical and IVF indexes.
+        """
+        text_bytes = self.__dict__.get("_text_bytes")
+        if text_bytes is None:
+            text_bytes = self._text_bytes = sum(len(chunk) for chunk in self.chunks) * 2
+        total = np.asarray(self.vectors).nbytes + text_bytes
+        if self.lexical is not None:
+            total += self.lexical.indptr.nbytes + self.lexical.chunk_ids.nbytes + self.lexical.weights.nbytes
+        ivf = getattr(self.ann, "ivf", None)
+        if ivf is not None:
+            total += ivf.centroids.nbytes + ivf.order.nbytes
+        return total
+
+    def matches_source(self, pdf_path):
+        """
+        Checks whether the index was built from the current content of pdf_path.
+        An unchanged size and mtime is trusted; otherwise the file is hashed.
+        """
+        if self.source is None:
+            return False
+        stat = os.stat(pdf_path)
+        if stat.st_size == self.source["size"] and stat.st_mtime == self.source["mtime"]:
+            return True
+        if stat.st_size != self.source["size"]:
+            return False
+        fingerprint = file_fingerprint(pdf_path)
+        if fingerprint["sha256"] != self.source["sha256"]:
+            return False
+        # Same content with a new mtime (e.g. a fresh checkout): remember it to skip hashing next time
+        self.source = fingerprint
+        return True
+
+    # Map of chunk hash to its stored vector, used to reuse embeddings of unchanged chunks
+    def vectors_by_hash(self):
+        return {h: self.vectors[i] for i, h in enumerate(self.chunk_hashes)}
+
+    def search(self, query, top_k=3):
+        indices, scores = search_vectors(self.vectors, query, top_k)
+        return indices[0], scores[0]
+
+    def search_batch(self, queries, top_k=3):
+        if self.ann is not None:
+            return self.ann.search_batch(queries, top_k)
+        return search_vectors(self.vectors, queries, top_k)
+
+    @staticmethod
+    def paths(embeddings_folder, name):
+        vectors_path = os.path.join(embeddings_folder, f"{name}_embeddings.npy")
+        chunks_path = os.path.join(embeddings_folder, f"{name}_chunks.json")
+        return vectors_path, chunks_path
+
+    @staticmethod
+    def ann_path(embeddings_folder, name):
+        return os.path.join(embeddings_folder, f"{name}_ivf.npz")
+
+    @staticmethod
+    def lexical_path(embeddings_folder, name):
+        return os.path.join(embeddings_folder, f"{name}_bm25.npz")
+
+    @staticmethod
+    def legacy_path(embeddings_folder, name):
+        return os.path.join(embeddings_folder, f"{name}_embeddings.pkl")
+
+    @classmethod
+    def exists(cls, embeddings_folder, name):
+        return all(os.path.exists(path) for path in cls.paths(embeddings_folder, name))
+
+    # Write both files to temporary names first so readers never see a half-written index
+    def save(self, embeddings_folder, name):
+        os.makedirs(embeddings_folder, exist_ok=True)
+        vectors_path, chunks_path = self.paths(embeddings_folder, name)
+
+        with open(vectors_path + ".tmp", 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        os.replace(vectors_path + ".tmp", vectors_path)
+        self.save_manifest(embeddings_folder, name)
+
+        # The lexical index is built with the embeddings so no query has to wait for it
+        lexical = BM25Index.build(self.chunks, signature=chunks_signature(self.chunk_hashes))
+        lexical.save(self.lexical_path(embeddings_folder, name))
+
+        # An IVF index of the previous vectors would be stale; it is rebuilt on first use
+        ann_path = self.ann_path(embeddings_folder, name)
+        if os.path.exists(ann_path):
+            os.remove(ann_path)
+
+    # Rewrite only the sidecar (chunks + manifest), leaving the vectors file untouched
+    def save_manifest(self, embeddings_folder, name):
+        _, chunks_path = self.paths(embeddings_folder, name)
+        sidecar = {
+            "version": INDEX_FORMAT_VERSION,
+            "normalized": True,
+            "model": self.model,
+            "chunking": self.chunking,
+            "source": self.source,
+            "pages": self.pages,
+            "chunk_hashes": self.chunk_hashes,
+            "chunks": self.chunks,
+        }
+        with open(chunks_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(sidecar, f, ensure_ascii=False)
+        os.replace(chunks_path + ".tmp", chunks_path)
+
+    @classmethod
+    def load(cls, embeddings_folder, name):
+        vectors_path, chunks_path = cls.paths(embeddings_folder, name)
+        vectors = np.load(vectors_path, mmap_mode='r')
+        with open(chunks_path, 'r', encoding='utf-8') as f:
+            sidecar = json.load(f)
+        chunks = sidecar["chunks"]
+
+        # Indexes written before vectors were normalized on store are normalized in memory
+        if not sidecar.get("normalized"):
+            vectors = normalize_rows(vectors)
+
+        index = cls.__new__(cls)
+        index.vectors = vectors
+        index.chunks = chunks
+        index.source = sidecar.get("source")
+        index.model = sidecar.get("model")
+        index.chunking = sidecar.get("chunking", LEGACY_CHUNKING)
+        index.pages = [tuple(p) for p in sidecar["pages"]] if sidecar.get("pages") else None
+        index.chunk_hashes = sidecar.get("chunk_hashes") or [chunk_hash(c) for c in chunks]
+        return index
+
+    # Convert an old `<name>_embeddings.pkl` (list of lists + chunks) into the new format
+    @classmethod
+    def from_legacy_pickle(cls, filename):
+        with open(filename, 'rb') as f:
+            embeddings, chunks = pickle.load(f)
+        return cls(embeddings, chunks)
+
+
+# Process-wide registry: every index is loaded at most once and shared by all sessions
+# (and all tenants). With a memory limit, the least recently used indexes are dropped
+# when it is exceeded and loaded again from disk on their next use. Any object with a
+# memory_bytes() method can be registered, e.g. the merged index of global retrieval.
+_indexes = {}
+_last_used = {}
+_indexes_lock = threading.Lock()
+_build_locks = {}
+_max_bytes = None
+
+def set_index_pool_limit(max_bytes):
+    """
+    Bounds the memory of the registered indexes (see EmbeddingIndex.memory_bytes).
+    None removes the bound.
+    """
+    global _max_bytes
+    _max_bytes = max_bytes
+    _evict()
+
+def _evict(keep=None):
+    if _max_bytes is None:
+        return
+    with _indexes_lock:
+        sizes = {key: index.memory_bytes() for key, index in _indexes.items()}
+        total = sum(sizes.values())
+        for key in sorted(sizes, key=lambda key: _last_used.get(key, 0.0)):
+            if total <= _max_bytes:
+                break
+            if key == keep:
+                continue
+            print(f"Unloading embeddings index {key[1]} from {key[0]} (index pool over {_max_bytes} bytes)")
+            del _indexes[key]
+            _last_used.pop(key, None)
+            total -= sizes[key]
+
+def index_pool_stats():
+    with _indexes_lock:
+        return {
+            "indexes": len(_indexes),
+            "bytes": sum(index.memory_bytes() for index in _indexes.values()),
+            "max_bytes": _max_bytes,
+        }
+
+def get_index(embeddings_folder, name, builder=None):
+    """
+    Returns the shared EmbeddingIndex for `name`, loading it on first use.
+
+    Parameters:
+    - embeddings_folder: Folder holding the index files.
+    - name: Document base name (the PDF file name without its extension).
+    - builder: Optional callable returning a new EmbeddingIndex when none exists on disk.
+      The built index is saved before it is registered.
+
+    Returns:
+    - The EmbeddingIndex for the document.
+    """
+    key = (os.path.abspath(embeddings_folder), name)
+    index = _indexes.get(key)
+    if index is not None:
+        _last_used[key] = time.monotonic()
+        return index
+
+    with _indexes_lock:
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+
+    # Only one thread loads or builds a given document; the others wait for its result
+    with build_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            return index
+
+        if not EmbeddingIndex.exists(embeddings_folder, name):
+            legacy_path = EmbeddingIndex.legacy_path(embeddings_folder, name)
+            if os.path.exists(legacy_path):
+                print(f"Converting legacy embeddings {legacy_path}...")
+                EmbeddingIndex.from_legacy_pickle(legacy_path).save(embeddings_folder, name)
+            elif builder is not None:
+                builder().save(embeddings_folder, name)
+            else:
+                raise FileNotFoundError(f"No embeddings index for '{name}' in '{embeddings_folder}'")
+
+        print(f"Loading embeddings index {name} from {embeddings_folder}...")
+        index = EmbeddingIndex.load(embeddings_folder, name)
+        _indexes[key] = index
+        _last_used[key] = time.monotonic()
+    _evict(keep=key)
+    return index
+
+# The registered index for `name` if it is loaded, without loading it
+def registered_index(embeddings_folder, name):
+    key = (os.path.abspath(embeddings_folder), name)
+    index = _indexes.get(key)
+    if index is not None:
+        _last_used[key] = time.monotonic()
+    return index
+
+# Swap in a newly saved index for a document, e.g. after its PDF changed
+def replace_index(embeddings_folder, name, index):
+    key = (os.path.abspath(embeddings_folder), name)
+    with _indexes_lock:
+        _indexes[key] = index
+        _last_used[key] = time.monotonic()
+    _evict(keep=key)
+
+def invalidate_index(embeddings_folder, name):
+    key = (os.path.abspath(embeddings_folder), name)
+    with _indexes_lock:
+        _indexes.pop(key, None)
+        _last_used.pop(key, None)
+
+def clear_indexes():
+    with _indexes_lock:
+        _indexes.clear()
+        _last_used.clear()
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def make_batches(texts, max_items=64, max_chars=60000):
+    """
+    Splits texts into consecutive batches bounded by item count and total characters.
+    A single text longer than max_chars gets a batch of its own.
+
+    Returns:
+    - A list of (start, end) ranges into texts.
+    """
+    batches = []
+    start, chars = 0, 0
+    for i, text in enumerate(texts):
+        if i > start and (i - start >= max_items or chars + len(text) > max_chars):
+            batches.append((start, i))
+            start, chars = i, 0
+        chars += len(text)
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+# Identifies a run: the texts and everything that decides their vectors and batch boundaries
+def texts_fingerprint(texts, embedder=None, batching=None):
+    digest = hashlib.sha256(json.dumps([embedder, batching]).encode('utf-8'))
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode('utf-8')).digest())
+    return digest.hexdigest()
+
+class EmbeddingPipeline:
+    """
+    Embeds many texts through a batch embedding function.
+
+    Texts are sent in size-bounded batches, several batches run at once on a bounded
+    thread pool, failed batches are retried with exponential backoff, and every finished
+    batch is appended to a checkpoint file so an interrupted run resumes where it stopped.
+    """
+
+    def __init__(self, embed_batch, max_batch_items=64, max_batch_chars=60000, max_workers=4,
+                 max_retries=5, backoff_seconds=1.0, embedder=None):
+        # embed_batch: callable taking a list of texts and returning one vector per text
+        self.embed_batch = embed_batch
+        # embedder: describes embed_batch (e.g. "backend:model"), so a checkpoint written with
+        # another model or backend is not resumed
+        self.embedder = embedder
+        self.max_batch_items = max_batch_items
+        self.max_batch_chars = max_batch_chars
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+
+    def _embed_with_retry(self, texts):
+        for attempt in range(self.max_retries + 1):
+            try:
+                vectors = self.embed_batch(texts)
+                if len(vectors) != len(texts):
+                    raise ValueError(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+                return vectors
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff_seconds * (2 ** attempt) * (0.5 + random.random())
+                print(f"Embedding batch failed ({e}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+    # The checkpoint is JSON lines: a header with the fingerprint of the run, then one line per finished batch
+    def _load_checkpoint(self, checkpoint_path, fingerprint):
+        done = {}
+        if not checkpoint_path or not os.path.exists(checkpoint_path):
+            return done
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        if not lines or json.loads(lines[0]).get("fingerprint") != fingerprint:
+            return done
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break  # a batch that was being written when the run stopped
+            done[record["start"]] = record["vectors"]
+        return done
+
+    def run(self, texts, checkpoint_path=None):
+        """
+        Embeds all texts and returns their vectors in input order.
+
+        Parameters:
+        - texts: The texts to embed.
+        - checkpoint_path: Optional file used to resume an interrupted run. It is removed
+          once every batch has been embedded.
+        """
+        texts = list(texts)
+        fingerprint = texts_fingerprint(texts, self.embedder, [self.max_batch_items, self.max_batch_chars])
+        batches = make_batches(texts, self.max_batch_items, self.max_batch_chars)
+        done = self._load_checkpoint(checkpoint_path, fingerprint)
+        if done:
+            print(f"Resuming embedding run: {len(done)}/{len(batches)} batches already done")
+
+        checkpoint = None
+        if checkpoint_path:
+            checkpoint = open(checkpoint_path, 'a' if done else 'w', encoding='utf-8')
+            if not done:
+                checkpoint.write(json.dumps({"fingerprint": fingerprint}) + "\n")
+                checkpoint.flush()
+        checkpoint_lock = threading.Lock()
+
+        def embed(batch):
+            start, end = batch
+            vectors = self._embed_with_retry(texts[start:end])
+            if checkpoint is not None:
+                line = json.dumps({"start": start, "vectors": [list(map(float, v)) for v in vectors]})
+                with checkpoint_lock:
+                    checkpoint.write(line + "\n")
+                    checkpoint.flush()
+            return start, vectors
+
+        try:
+            pending = [batch for batch in batches if batch[0] not in done]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for start, vectors in executor.map(embed, pending):
+                    done[start] = vectors
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        return [vector for start, _ in batches for vector in done[start]]
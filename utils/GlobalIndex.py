@@ -0,0 +1,105 @@
+import numpy as np
+from utils.EmbeddingIndex import normalize_rows, top_k_indices
+
+class GlobalIndex:
+    """
+    The chunks of several documents merged into one contiguous matrix, so a question is
+    scored against the whole corpus with a single matrix product.
+
+    Rows of one document are adjacent: document i owns rows offsets[i]:offsets[i + 1].
+    The merged index keeps references to the per-document indexes it was built from;
+    `is_current` tells whether any of them has since been replaced (e.g. re-indexed).
+    """
+
+    def __init__(self, indexes):
+        """
+        Parameters:
+        - indexes: Dict of document name (the PDF file name) to its EmbeddingIndex.
+        """
+        self.documents = list(indexes)
+        self.members = [indexes[name] for name in self.documents]
+        sizes = [len(index) for index in self.members]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self.doc_ids = np.repeat(np.arange(len(self.documents), dtype=np.int32), sizes)
+        # Copied out of the memory-mapped files once, so searches never page-fault
+        if self.members:
+            self.vectors = np.ascontiguousarray(np.vstack([np.asarray(index.vectors) for index in self.members]))
+        else:
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def memory_bytes(self):
+        """
+        Memory held by the merged index: its copy of the vectors and the chunk texts of its
+        documents, which it keeps alive even after their own indexes are unloaded.
+        """
+        text_bytes = self.__dict__.get("_text_bytes")
+        if text_bytes is None:
+            text_bytes = self._text_bytes = sum(len(chunk) for index in self.members for chunk in index.chunks) * 2
+        return self.vectors.nbytes + self.doc_ids.nbytes + text_bytes
+
+    def is_current(self, indexes):
+        return list(indexes) == self.documents and all(
+            indexes[name] is member for name, member in zip(self.documents, self.members)
+        )
+
+    def _row_mask(self, documents):
+        allowed = np.zeros(len(self.documents), dtype=bool)
+        for name in documents:
+            if name in self.documents:
+                allowed[self.documents.index(name)] = True
+        return allowed[self.doc_ids]
+
+    def search_batch(self, queries, top_k=3, documents=None):
+        """
+        Scores queries against every chunk of the corpus.
+
+        Parameters:
+        - queries: One query vector or a matrix of query vectors.
+        - top_k: Number of chunks to return per query.
+        - documents: Optional names of the documents to search; the others are skipped.
+
+        Returns:
+        - One list per query of hits {"document", "chunk", "score", "text"}, best first.
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        if not len(self):
+            return [[] for _ in queries]
+        scores = queries @ self.vectors.T
+        if documents is not None:
+            scores[:, ~self._row_mask(documents)] = -np.inf
+        indices = top_k_indices(scores, top_k)
+
+        results = []
+        for row, query_scores in zip(indices, scores):
+            hits = []
+            for i in row:
+                score = float(query_scores[i])
+                if score == -np.inf:
+                    continue
+                doc = int(self.doc_ids[i])
+                chunk = int(i - self.offsets[doc])
+                hits.append({
+                    "document": self.documents[doc],
+                    "chunk": chunk,
+                    "score": score,
+                    "text": self.members[doc].chunks[chunk],
+                })
+            results.append(hits)
+        return results
+
+    def search(self, query, top_k=3, documents=None):
+        return self.search_batch(query, top_k, documents)[0]
+
+def contributing_documents(hits):
+    """
+    Summarizes search hits per document: {name: {"chunks", "best_score"}}, best document first.
+    """
+    summary = {}
+    for hit in hits:
+        entry = summary.setdefault(hit["document"], {"chunks": 0, "best_score": hit["score"]})
+        entry["chunks"] += 1
+        entry["best_score"] = max(entry["best_score"], hit["score"])
+    return dict(sorted(summary.items(), key=lambda item: -item[1]["best_score"]))
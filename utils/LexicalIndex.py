@@ -0,0 +1,129 @@
+import hashlib
+import os
+import re
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# One-letter Hebrew prefixes (and, the, in, to, from, that, as): "ובריכה" also matches "בריכה"
+HEBREW_PREFIXES = "והבלמשכ"
+
+def tokenize(text):
+    """
+    Splits text into lowercase word terms. Hebrew words of four letters or more that start
+    with a one-letter prefix also yield the word without it.
+    """
+    terms = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        terms.append(word)
+        if len(word) >= 4 and word[0] in HEBREW_PREFIXES:
+            terms.append(word[1:])
+    return terms
+
+def chunks_signature(chunk_hashes):
+    return hashlib.sha256("".join(chunk_hashes).encode('utf-8')).hexdigest()
+
+class BM25Index:
+    """
+    Inverted index with precomputed BM25 weights over the chunks of one document.
+
+    Postings are stored in CSR form: the chunks containing term t are
+    chunk_ids[indptr[t]:indptr[t + 1]], with their BM25 term weights in `weights`.
+    Scoring a query is then a scatter-add of the postings of its terms.
+    """
+
+    def __init__(self, terms, indptr, chunk_ids, weights, n_chunks, signature=None):
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.terms = list(terms)
+        self.indptr = indptr
+        self.chunk_ids = chunk_ids
+        self.weights = weights
+        self.n_chunks = n_chunks
+        self.signature = signature
+
+    @classmethod
+    def build(cls, chunks, k1=1.5, b=0.75, signature=None):
+        vocabulary = {}
+        postings = []  # term id -> {chunk id: term frequency}
+        lengths = np.zeros(len(chunks), dtype=np.float32)
+        for chunk_id, text in enumerate(chunks):
+            terms = tokenize(text)
+            lengths[chunk_id] = len(terms)
+            for term in terms:
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append({})
+                postings[term_id][chunk_id] = postings[term_id].get(chunk_id, 0) + 1
+
+        average_length = lengths.mean() if len(chunks) and lengths.mean() > 0 else 1.0
+        indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        chunk_ids = np.empty(indptr[-1], dtype=np.int32)
+        weights = np.empty(indptr[-1], dtype=np.float32)
+        for term_id, term_postings in enumerate(postings):
+            start, end = indptr[term_id], indptr[term_id + 1]
+            ids = np.fromiter(term_postings.keys(), dtype=np.int32, count=len(term_postings))
+            tf = np.fromiter(term_postings.values(), dtype=np.float32, count=len(term_postings))
+            idf = np.log(1 + (len(chunks) - len(ids) + 0.5) / (len(ids) + 0.5))
+            chunk_ids[start:end] = ids
+            weights[start:end] = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[ids] / average_length))
+
+        return cls(list(vocabulary), indptr, chunk_ids, weights, len(chunks), signature)
+
+    def scores(self, query):
+        """
+        Returns the BM25 score of every chunk for the query (zero for chunks without a query term).
+        """
+        scores = np.zeros(self.n_chunks, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            np.add.at(scores, self.chunk_ids[start:end], self.weights[start:end])
+        return scores
+
+    def save(self, filename):
+        with open(filename + ".tmp", 'wb') as f:
+            np.savez(
+                f,
+                terms=np.array(self.terms, dtype=str),
+                indptr=self.indptr,
+                chunk_ids=self.chunk_ids,
+                weights=self.weights,
+                n_chunks=self.n_chunks,
+                signature=self.signature or "",
+            )
+        os.replace(filename + ".tmp", filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(
+                data["terms"].tolist(), data["indptr"], data["chunk_ids"], data["weights"],
+                int(data["n_chunks"]), str(data["signature"]) or None
+            )
+
+    # Load the saved index of an EmbeddingIndex, building it again if the chunks changed
+    @classmethod
+    def for_index(cls, index, filename):
+        signature = chunks_signature(index.chunk_hashes)
+        if os.path.exists(filename):
+            lexical = cls.load(filename)
+            if lexical.signature == signature:
+                return lexical
+
+        print(f"Building lexical index {filename} over {len(index)} chunks...")
+        lexical = cls.build(index.chunks, signature=signature)
+        lexical.save(filename)
+        return lexical
+
+def fuse_scores(vector_scores, lexical_scores, lexical_weight=0.3):
+    """
+    Combines cosine similarities with BM25 scores. BM25 scores are scaled per query to
+    [0, 1] by the best chunk's score, so the weight means the same for every query.
+    """
+    lexical_scores = np.atleast_2d(lexical_scores)
+    best = lexical_scores.max(axis=1, keepdims=True)
+    best[best == 0] = 1.0
+    return (1 - lexical_weight) * np.atleast_2d(vector_scores) + lexical_weight * lexical_scores / best
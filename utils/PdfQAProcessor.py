@@ -1,30 +1,79 @@
-import fitz  # PyMuPDF
-import openai
+import asyncio
+import hashlib
 import numpy as np
 import os
-import pickle
+import threading
 from dotenv import load_dotenv
-from groq import Groq
-from collections import deque
+from utils.EmbeddingIndex import EmbeddingIndex, get_index, registered_index, replace_index, set_index_pool_limit, chunk_hash, file_fingerprint, normalize_rows, search_vectors, top_k_indices
+from utils.LexicalIndex import BM25Index, fuse_scores
+from utils.AnnIndex import AnnSearcher
+from utils.GlobalIndex import GlobalIndex, contributing_documents
+from utils.EmbeddingPipeline import EmbeddingPipeline
+from utils.extraction import count_pages, iter_pdf_pages, iter_pdf_pages_parallel
+from utils.chunking import get_chunker, chunking_signature, count_tokens
+from utils.ConversationStore import ConversationStore
+from utils.prompt_budget import PromptBudgeter
+from utils.AnswerCache import AnswerCache
+from utils.EmbeddingCache import EmbeddingCache
+from utils.llm_clients import get_backend
+from utils import metrics
+
+# Conversation used when the caller doesn't pass a conversation key (single-user scripts)
+DEFAULT_CONVERSATION = ("default", None)
+# Registry name of the merged index of global retrieval (not a valid PDF base name on Windows)
+GLOBAL_INDEX_NAME = "*global*"
+
+NO_CONTEXT_MESSAGE = "לא נמצא מידע רלוונטי לשאלה שלך. נסה לשאול שאלה אחרת או לפרט יותר."
+NO_ANSWER_MESSAGE = "לא הצלחתי למצוא תשובה לשאלה שלך בהתבסס על המידע הקיים. נסה לשאול שאלה אחרת."
+ERROR_MESSAGE = "אירעה שגיאה בעת יצירת תשובה. אנא נסה שוב מאוחר יותר."
 
 class PdfQAProcessor:
-    def __init__(self, data_folder="data", embeddings_folder="embeddings"):
+    def __init__(self, data_folder="data", embeddings_folder="embeddings", tenant=None):
         # Load environment variables from the .env file
         load_dotenv()
 
+        # Name of the community center served by this processor (see utils.tenants), if several are
+        self.tenant = tenant
+
         # Get the API key from the environment variable
         self.model_type = os.environ.get("MODEL_TYPE")
+        # Embeddings always come from OpenAI unless a test backend such as "mock" is configured
+        self.embeddings_backend = os.getenv("EMBEDDINGS_BACKEND", "chatgpt")
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.embeddings_model = os.getenv("EMBEDDINGS_MODEL") #"text-embedding-ada-002", #text-embedding-3-small or any other embedding model
         self.llm_model = os.getenv("LLM_MODEL", "llama3-70b-8192") #"gpt-4o", #"gpt-4o",  "gpt-4o-mini"# Use GPT-4 or a smaller model if desired sagi
         self.max_token = int(os.getenv("MAX_TOKENS", 1024))
+        # "exact" scans every chunk, "ivf" uses an approximate index for large documents
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "exact")
+        # "document" searches the PDF of the current chat, "global" searches all PDFs at once
+        self.retrieval_scope = os.getenv("RETRIEVAL_SCOPE", "document")
+        # "hybrid" fuses BM25 with the vector scores, "lexical" uses BM25 only (no embeddings call), "off" disables it
+        self.lexical_retrieval = os.getenv("LEXICAL_RETRIEVAL", "hybrid")
+        self.lexical_weight = float(os.getenv("LEXICAL_WEIGHT", 0.3))
+        self.ivf_n_probe = int(os.getenv("IVF_NPROBE", 16))
+        self.ivf_min_chunks = int(os.getenv("IVF_MIN_CHUNKS", 10000))
+        # Batching and concurrency of the embedding calls made while indexing a PDF
+        self.embedding_batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+        self.embedding_batch_chars = int(os.getenv("EMBEDDING_BATCH_CHARS", 60000))
+        self.embedding_workers = int(os.getenv("EMBEDDING_WORKERS", 4))
+        # PDFs with at least this many pages are extracted on a process pool (0 disables it)
+        self.parallel_min_pages = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 100))
+        self.extraction_workers = int(os.getenv("PDF_EXTRACTION_WORKERS", 0)) or None
+        # Chunking strategy ("structured" or "fixed", see utils.chunking) and its options
+        chunk_strategy = os.getenv("CHUNK_STRATEGY", "structured")
+        if chunk_strategy == "fixed":
+            chunk_options = {"size": int(os.getenv("CHUNK_SIZE", 2000))}
+        else:
+            chunk_options = {
+                "max_tokens": int(os.getenv("CHUNK_MAX_TOKENS", 300)),
+                "overlap_tokens": int(os.getenv("CHUNK_OVERLAP_TOKENS", 50)),
+            }
+        self.chunker = get_chunker(chunk_strategy, **chunk_options)
+        self.chunking = chunking_signature(chunk_strategy, **chunk_options)
         # Check if the API key exists, raise an error if not found
-        if not self.api_key:
+        if not self.api_key and self.embeddings_backend != "mock":
             raise ValueError("OpenAI API key not found. Please add 'OPENAI_API_KEY' to your .env file.")
 
-        # Set the OpenAI API key
-        openai.api_key = self.api_key
-
         # Set the folders for PDFs and embeddings
         self.data_folder = data_folder
         self.embeddings_folder = embeddings_folder
@@ -32,51 +81,272 @@ class PdfQAProcessor:
         # Ensure the embeddings folder exists
         os.makedirs(self.embeddings_folder, exist_ok=True)
 
-        # Initialize conversation history
-        self.conversation_history = deque(maxlen=10)
+        # The indexes of all documents (and tenants) share one registry; cap its memory if configured
+        if os.getenv("INDEX_POOL_MAX_MB"):
+            set_index_pool_limit(int(float(os.getenv("INDEX_POOL_MAX_MB")) * 1024 * 1024))
 
-    # Extract text from PDF using PyMuPDF
-    def extract_text_from_pdf(self, pdf_name):
+        # Conversation history per (session id, chat key), shared safely by all sessions
+        self.conversations = ConversationStore(
+            max_turns=10,
+            max_conversations=int(os.getenv("CONVERSATION_MAX_SESSIONS", 10000)),
+            idle_seconds=int(os.getenv("CONVERSATION_IDLE_SECONDS", 3600))
+        )
+
+        # Embeddings by (model, text), in memory and in an SQLite file shared by all processes
+        embedding_cache_path = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(self.embeddings_folder, "embedding_cache.sqlite"))
+        self.embedding_cache = EmbeddingCache(
+            path=embedding_cache_path or None,
+            max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 10000))
+        )
+
+        # Token budgets of the prompt; up to RETRIEVAL_CANDIDATES chunks are retrieved and the
+        # best of them that fit the context budget are sent
+        self.retrieval_candidates = int(os.getenv("RETRIEVAL_CANDIDATES", 6))
+        self.prompt_budgeter = PromptBudgeter(
+            max_tokens=int(os.getenv("PROMPT_MAX_TOKENS", 6000)),
+            context_tokens=int(os.getenv("PROMPT_CONTEXT_TOKENS", 2500)),
+            history_tokens=int(os.getenv("PROMPT_HISTORY_TOKENS", 1500))
+        )
+
+        # Answers reused for questions similar enough to an earlier one on the same PDF and prompt
+        self.answer_cache = None
+        if os.getenv("ANSWER_CACHE", "true").lower() == "true":
+            answer_cache_path = os.getenv("ANSWER_CACHE_PATH") or None
+            # Every tenant saves its answers to its own file, in its embeddings folder, so the
+            # tenants' caches don't overwrite each other
+            if answer_cache_path and tenant:
+                answer_cache_path = os.path.join(embeddings_folder, os.path.basename(answer_cache_path))
+            self.answer_cache = AnswerCache(
+                threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95)),
+                max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 5000)),
+                ttl_seconds=int(os.getenv("ANSWER_CACHE_TTL_SECONDS", 86400)),
+                path=answer_cache_path
+            )
+
+        # Cache hit ratios are exported with the other metrics, see utils.metrics
+        metrics.register_collector(self.cache_metrics)
+
+        self._global_lock = threading.Lock()
+        self._ann_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # Documents being re-indexed right now
+        self._refreshing = set()
+
+    # Stream the text of a PDF page by page, using a process pool for large documents
+    def iter_pdf_pages(self, pdf_name):
         pdf_path = os.path.join(self.data_folder, pdf_name)
         if not os.path.exists(pdf_path):
             raise FileNotFoundError(f"PDF file '{pdf_name}' not found in '{self.data_folder}'")
 
-        pdf_document = fitz.open(pdf_path)
-        text = ""
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            text += page.get_text("text")
-        return text
+        if self.parallel_min_pages and count_pages(pdf_path) >= self.parallel_min_pages:
+            return iter_pdf_pages_parallel(pdf_path, workers=self.extraction_workers)
+        return iter_pdf_pages(pdf_path)
+
+    # Extract text from PDF using PyMuPDF
+    def extract_text_from_pdf(self, pdf_name):
+        return "".join(text for _, text in self.iter_pdf_pages(pdf_name))
+
+    # Pooled clients shared by the whole process, see utils.llm_clients
+    @property
+    def llm(self):
+        return get_backend(self.model_type)
+
+    @property
+    def embedder(self):
+        return get_backend(self.embeddings_backend)
 
     # Create embedding using OpenAI's API
     def create_embedding(self, text):
-        
-        response = openai.embeddings.create(
-            model= self.embeddings_model,
-            input=text
+        return self.create_embeddings([text])[0]
+
+    # Create embeddings for several texts with a single API call, skipping texts embedded before
+    def create_embeddings(self, texts):
+        return self.embedding_cache.embed(
+            texts, self.embeddings_model,
+            lambda missing: self.embedder.embed(missing, self.embeddings_model)
+        )
+
+    # Extract, chunk and embed a PDF into a new (unsaved) index
+    @metrics.span("build_index")
+    def build_index(self, pdf_name, previous=None):
+        """
+        Builds the index of a PDF.
+
+        Parameters:
+        - pdf_name: The PDF file name inside the data folder.
+        - previous: Optional older index of the same PDF. Chunks whose text is unchanged
+          reuse its vectors, only new or changed chunks are embedded.
+        """
+        print(f"Processing and embedding PDF: {pdf_name}...")
+        # Fingerprint the file before reading it, so a change made during the build is detected later
+        source = file_fingerprint(os.path.join(self.data_folder, pdf_name))
+
+        # Extract the PDF page by page and split the text into chunks as the pages arrive
+        pdf_chunks = list(self.chunker(self.iter_pdf_pages(pdf_name)))
+        chunks = [chunk.text for chunk in pdf_chunks]
+        pages = [(chunk.first_page, chunk.last_page) for chunk in pdf_chunks]
+        chunk_hashes = [chunk_hash(chunk) for chunk in chunks]
+
+        # Vectors from a different embeddings model are not comparable and are never reused
+        if previous is not None and previous.model not in (None, self.embeddings_model):
+            previous = None
+        reusable = previous.vectors_by_hash() if previous is not None else {}
+        missing = [i for i, h in enumerate(chunk_hashes) if h not in reusable]
+        if previous is not None:
+            print(f"Re-embedding {len(missing)} of {len(chunks)} chunks of {pdf_name}")
+
+        # Generate embeddings for the missing chunks in concurrent batches, resumable if interrupted
+        file_base_name = os.path.splitext(pdf_name)[0]
+        checkpoint_path = os.path.join(self.embeddings_folder, f"{file_base_name}_embeddings.partial.jsonl")
+        try:
+            new_embeddings = self.create_embedding_pipeline().run([chunks[i] for i in missing], checkpoint_path=checkpoint_path)
+        finally:
+            # The pipeline's worker threads have ended; close the cache connections they opened
+            self.embedding_cache.close_finished_connections()
+        new_embeddings = dict(zip(missing, new_embeddings))
+
+        embeddings = [new_embeddings[i] if i in new_embeddings else reusable[h] for i, h in enumerate(chunk_hashes)]
+        return EmbeddingIndex(
+            embeddings, chunks,
+            source=source,
+            chunk_hashes=chunk_hashes,
+            model=self.embeddings_model,
+            chunking=self.chunking,
+            pages=pages
+        )
+
+    def create_embedding_pipeline(self):
+        return EmbeddingPipeline(
+            self.create_embeddings,
+            max_batch_items=self.embedding_batch_size,
+            max_batch_chars=self.embedding_batch_chars,
+            max_workers=self.embedding_workers,
+            embedder=f"{self.embeddings_backend}:{self.embeddings_model}"
         )
 
-        # Access the embeddings from the response
-        embedding = response.data[0].embedding
-        return embedding
+    # Re-index a PDF whose content changed, reusing the vectors of unchanged chunks
+    def refresh_index(self, pdf_name, previous):
+        file_base_name = os.path.splitext(pdf_name)[0]
+        index = self.build_index(pdf_name, previous=previous)
+        # Saving also removes the stale IVF file of the old vectors
+        index.save(self.embeddings_folder, file_base_name)
+
+        index = EmbeddingIndex.load(self.embeddings_folder, file_base_name)
+        replace_index(self.embeddings_folder, file_base_name, index)
+        return index
+
+    # An index is current when it was built from this PDF content with the configured chunking
+    # and embeddings model (vectors of another model can't be compared with the question's)
+    def is_index_current(self, index, pdf_name):
+        return (
+            index.chunking == self.chunking
+            and index.model in (None, self.embeddings_model)
+            and index.matches_source(os.path.join(self.data_folder, pdf_name))
+        )
+
+    # Get the shared, memory-mapped index of a PDF, building it on first use
+    # and rebuilding it when the PDF's content, the chunking or the embeddings model changed
+    def load_index(self, pdf_name):
+        file_base_name = os.path.splitext(pdf_name)[0]
+        pdf_path = os.path.join(self.data_folder, pdf_name)
+        index = get_index(self.embeddings_folder, file_base_name, builder=lambda: self.build_index(pdf_name))
+
+        if not self.is_index_current(index, pdf_name):
+            with self._refresh_lock:
+                index = get_index(self.embeddings_folder, file_base_name)
+                if index.source is None:
+                    # Indexes from before the manifest existed are assumed to match the current PDF
+                    index.source = file_fingerprint(pdf_path)
+                    index.save_manifest(self.embeddings_folder, file_base_name)
+                refresh = not self.is_index_current(index, pdf_name) and file_base_name not in self._refreshing
+                if refresh:
+                    self._refreshing.add(file_base_name)
+            # Re-indexing embeds the changed chunks, which takes a while. It runs outside the
+            # lock: other questions on this PDF keep using the outdated index meanwhile, and the
+            # new one is swapped in when it is saved.
+            if refresh:
+                try:
+                    print(f"Index of {pdf_name} is outdated, re-indexing...")
+                    index = self.refresh_index(pdf_name, index)
+                finally:
+                    with self._refresh_lock:
+                        self._refreshing.discard(file_base_name)
+
+        if self.lexical_retrieval != "off" and index.lexical is None:
+            with self._ann_lock:
+                if index.lexical is None:
+                    index.lexical = BM25Index.for_index(
+                        index, EmbeddingIndex.lexical_path(self.embeddings_folder, file_base_name)
+                    )
+
+        if self.retrieval_mode == "ivf" and index.ann is None:
+            with self._ann_lock:
+                if index.ann is None:
+                    index.ann = AnnSearcher.for_index(
+                        index,
+                        EmbeddingIndex.ann_path(self.embeddings_folder, file_base_name),
+                        n_probe=self.ivf_n_probe,
+                        min_chunks=self.ivf_min_chunks
+                    )
+        return index
+
+    def list_pdf_names(self):
+        return sorted(f for f in os.listdir(self.data_folder) if f.lower().endswith(".pdf"))
+
+    # One merged index over all PDFs, rebuilt when one of them was re-indexed
+    # The merged index is registered in the index pool like the per-document ones, so its copy
+    # of the vectors counts against INDEX_POOL_MAX_MB. While it is current, the documents'
+    # own indexes aren't needed (or reloaded after being unloaded) to answer from it.
+    def load_global_index(self):
+        pdf_names = self.list_pdf_names()
+        global_index = registered_index(self.embeddings_folder, GLOBAL_INDEX_NAME)
+        if global_index is not None and self.is_global_index_current(global_index, pdf_names):
+            return global_index
+        with self._global_lock:
+            global_index = registered_index(self.embeddings_folder, GLOBAL_INDEX_NAME)
+            if global_index is None or not self.is_global_index_current(global_index, pdf_names):
+                indexes = {pdf_name: self.load_index(pdf_name) for pdf_name in pdf_names}
+                # Still the same indexes while a document is being re-indexed
+                if global_index is None or not global_index.is_current(indexes):
+                    global_index = GlobalIndex(indexes)
+                    replace_index(self.embeddings_folder, GLOBAL_INDEX_NAME, global_index)
+            return global_index
+
+    def is_global_index_current(self, global_index, pdf_names):
+        return global_index.documents == pdf_names and all(
+            self.is_index_current(member, pdf_name)
+            for pdf_name, member in zip(global_index.documents, global_index.members)
+        )
+
+    def search_documents(self, question, top_n=3, documents=None):
+        """
+        Searches the chunks of all PDFs at once.
 
-    # Save embeddings to a file (Pickle)
-    def save_embeddings_to_file(self, embeddings, chunks, filename):
-        with open(filename, 'wb') as f:
-            pickle.dump((embeddings, chunks), f)
+        Parameters:
+        - question: The input query string.
+        - top_n: Number of chunks to retrieve.
+        - documents: Optional PDF names to restrict the search to.
 
-    # Load embeddings from a file (Pickle)
-    def load_embeddings_from_file(self, filename):
-        # print(filename)
-        with open(filename, 'rb') as f:
-            embeddings, chunks = pickle.load(f)
-         
-        return embeddings, chunks
+        Returns:
+        - (hits, sources): The hits {"document", "chunk", "score", "text"}, best first, and
+          the contributing documents with their number of chunks and best score.
+        """
+        hits = self.load_global_index().search(self.create_embedding(question), top_n, documents)
+        return hits, contributing_documents(hits)
 
     # Cosine similarity function to compare embeddings
     def cosine_similarity(self, vec1, vec2):
         return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
 
+    # Load the indexes of the given PDFs up front and fault their pages into memory
+    def warm_up(self, pdf_names):
+        for pdf_name in pdf_names:
+            try:
+                index = self.load_index(pdf_name)
+                np.asarray(index.vectors).sum()
+            except Exception as e:
+                print(f"Warm-up failed for {pdf_name}: {e}")
+
     # Find the most relevant chunk based on the question
     def get_top_relevant_chunks(self, question, embeddings, chunks, top_n=3):
         """
@@ -84,30 +354,87 @@ class PdfQAProcessor:
         
         Parameters:
         - question: The input query string.
-        - embeddings: A list of embeddings corresponding to the chunks.
+        - embeddings: An EmbeddingIndex, or a matrix of unit-normalized embeddings with one
+          row per chunk. A plain list of raw embeddings is normalized first.
         - chunks: The actual chunks of text.
         - top_n: Number of top relevant chunks to retrieve (default is 3).
         
         Returns:
         - A single string containing the top-n most relevant chunks concatenated.
         """
+        return self.get_top_relevant_chunks_batch([question], embeddings, chunks, top_n)[0]
+
+    def get_top_relevant_chunks_batch(self, questions, embeddings, chunks, top_n=3, question_embeddings=None):
+        """
+        Retrieves the top-n most relevant chunks for a batch of questions. All questions
+        are embedded with one API call and scored with one matrix-matrix product.
         
-        # Create the embedding for the question
-        question_embedding = self.create_embedding(question)
-        
-        # Compute cosine similarities between the question and the chunks
-        similarities = [self.cosine_similarity(question_embedding, emb) for emb in embeddings]
-        
-        # Get indices of top-n most relevant chunks
-        top_indices = np.argsort(similarities)[-top_n:]  # Get top-n largest similarity scores
-        
-        # Retrieve the top-n most relevant chunks and concatenate them
-        top_relevant_chunks = [chunks[i] for i in top_indices]
+        Parameters:
+        - questions: A list of query strings.
+        - embeddings: An EmbeddingIndex, or a matrix of unit-normalized embeddings.
+        - chunks: The actual chunks of text.
+        - top_n: Number of top relevant chunks to retrieve per question (default is 3).
+        - question_embeddings: Embeddings of the questions, if the caller already created them.
         
-        # Return concatenated chunks as context
-        return "\n\n".join(top_relevant_chunks)
-
-    def generate_answer(self, question, context, system_prompt):
+        Returns:
+        - A list with one context string per question, most relevant chunk first.
+        """
+        top_indices = self.top_chunk_indices_batch(questions, embeddings, top_n, question_embeddings)
+        # Return concatenated chunks as context (approximate search pads missing hits with -1)
+        return ["\n\n".join(chunks[i] for i in row if i >= 0) for row in top_indices]
+
+    # Rows of chunk indices, best first, with -1 where fewer than top_n chunks were found
+    def top_chunk_indices_batch(self, questions, embeddings, top_n=3, question_embeddings=None):
+        lexical = embeddings.lexical if isinstance(embeddings, EmbeddingIndex) and self.lexical_retrieval != "off" else None
+
+        # Lexical-only retrieval never calls the embeddings API; chunks without a query term are skipped
+        if lexical is not None and self.lexical_retrieval == "lexical":
+            lexical_scores = np.vstack([lexical.scores(question) for question in questions])
+            top_indices = top_k_indices(lexical_scores, top_n)
+            return np.where(np.take_along_axis(lexical_scores, top_indices, axis=1) > 0, top_indices, -1)
+
+        # Create the embeddings for the questions
+        if question_embeddings is None:
+            question_embeddings = self.create_embeddings(questions)
+
+        # Score every question against every chunk and keep the top-n of each
+        if lexical is not None:
+            lexical_scores = np.vstack([lexical.scores(question) for question in questions])
+            if getattr(embeddings.ann, "ivf", None) is not None:
+                top_indices = self.hybrid_ann_indices(embeddings, question_embeddings, lexical_scores, top_n)
+            else:
+                # Hybrid: the exact cosine scores of all chunks fused with their BM25 scores
+                vector_scores = normalize_rows(np.atleast_2d(question_embeddings)) @ np.asarray(embeddings.vectors).T
+                top_indices = top_k_indices(fuse_scores(vector_scores, lexical_scores, self.lexical_weight), top_n)
+        elif isinstance(embeddings, EmbeddingIndex):
+            top_indices, _ = embeddings.search_batch(question_embeddings, top_n)
+        else:
+            if not isinstance(embeddings, np.ndarray):
+                embeddings = normalize_rows(embeddings)
+            top_indices, _ = search_vectors(embeddings, question_embeddings, top_n)
+        return top_indices
+
+    # Hybrid retrieval over an IVF index: only the approximate vector candidates and the best
+    # BM25 chunks of each question are scored and fused, instead of every chunk
+    def hybrid_ann_indices(self, index, question_embeddings, lexical_scores, top_n):
+        n_candidates = max(4 * top_n, 32)
+        ann_indices, _ = index.search_batch(question_embeddings, n_candidates)
+        lexical_indices = top_k_indices(lexical_scores, n_candidates)
+        queries = normalize_rows(np.atleast_2d(question_embeddings))
+
+        top_indices = np.full((len(queries), top_n), -1, dtype=np.int64)
+        for row, query in enumerate(queries):
+            lexical_row = lexical_indices[row][lexical_scores[row, lexical_indices[row]] > 0]
+            candidates = np.union1d(ann_indices[row][ann_indices[row] >= 0], lexical_row)
+            if len(candidates) == 0:
+                continue
+            vector_scores = np.asarray(index.vectors[candidates]) @ query
+            fused = fuse_scores(vector_scores, lexical_scores[row, candidates], self.lexical_weight)
+            best = top_k_indices(fused, top_n)[0]
+            top_indices[row, :len(best)] = candidates[best]
+        return top_indices
+
+    def generate_answer(self, question, context, system_prompt, conversation_key=DEFAULT_CONVERSATION):
         """
         Generates an answer in Hebrew using the provided context and system prompt with GPT-4.
         If no relevant context is found or there's no response from GPT-4, it notifies the user that no relevant information is available.
@@ -116,6 +443,7 @@ class PdfQAProcessor:
         - question: The user's question in Hebrew.
         - context: The relevant chunks (context) in Hebrew to guide the answer. Can be an empty string if no relevant chunks were found.
         - system_prompt: Instructions for how the assistant should behave (can also be in Hebrew).
+        - conversation_key: Identifies the user's conversation, e.g. (session id, chat key).
         
         Returns:
         - Generated answer in Hebrew from GPT-4o, or a message indicating no relevant information or an error occurred.
@@ -123,92 +451,355 @@ class PdfQAProcessor:
         
         # Check if the context is empty or too short
         if not context or len(context.strip()) == 0:
-            return "לא נמצא מידע רלוונטי לשאלה שלך. נסה לשאול שאלה אחרת או לפרט יותר."
+            return NO_CONTEXT_MESSAGE
         
         try:
-            # Prepare the conversation history
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "assistant", "content": f"Context: {context}"},
-            ]
+            messages = self.build_messages(question, context, system_prompt, conversation_key)
             
-            # Add conversation history
-            for history_item in self.conversation_history:
-                messages.append({"role": "user", "content": history_item["question"]})
-                messages.append({"role": "assistant", "content": history_item["answer"]})
-            
-            # Add the current question
-            messages.append({"role": "user", "content": question})
-            
-            if self.model_type == "chatgpt":
-                response = openai.chat.completions.create(
-                    model= self.llm_model, #"gpt-4o", #"gpt-4o",  "gpt-4o-mini"# Use GPT-4 or a smaller model if desired sagi
-                    messages=messages,
-                    max_tokens = self.max_token,  # Adjust based on the answer length you expect
-                    temperature=0.0  # Low temperature for more deterministic responses
-                )
-                answer = response.choices[0].message.content.strip()
-
-            elif self.model_type == "qroq":
-                groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-                response = groq_client.chat.completions.create(
-                    messages=messages,
-                    model=self.llm_model,
-                    temperature=0.0,
-                    max_tokens=self.max_token,
-                    stream=False
-                )
-                answer = response.choices[0].message.content.strip()
+            answer = self.llm.complete(
+                messages,
+                model=self.llm_model,
+                max_tokens=self.max_token,  # Adjust based on the answer length you expect
+                temperature=0.0  # Low temperature for more deterministic responses
+            ).strip()
 
             # Check if the answer is empty
             if not answer:
-                return "לא הצלחתי למצוא תשובה לשאלה שלך בהתבסס על המידע הקיים. נסה לשאול שאלה אחרת."
+                return NO_ANSWER_MESSAGE
             
             # Update conversation history
-            self.conversation_history.append({"question": question, "answer": answer})
+            self.conversations.append(conversation_key, question, answer)
+            metrics.observe("qa_answer_tokens", count_tokens(answer))
 
             return answer
         
         except Exception as e:
             # Handle errors like network issues, API errors, etc.
             print(f"Error occurred: {e}")
-            return "אירעה שגיאה בעת יצירת תשובה. אנא נסה שוב מאוחר יותר."
+            metrics.increment("qa_errors_total", stage="generate")
+            return ERROR_MESSAGE
 
-    # Process the PDF, store embeddings, and answer questions
-    def process_pdf_and_answer(self, pdf_name, question, system_prompt):
-        # Remove the ".pdf" extension and prepare the save path for embeddings
-        file_base_name = os.path.splitext(pdf_name)[0]
-        save_path = os.path.join(self.embeddings_folder, f"{file_base_name}_embeddings.pkl")        
+    def generate_answer_stream(self, question, context, system_prompt, conversation_key=DEFAULT_CONVERSATION):
+        """
+        Streaming version of generate_answer: yields the answer in pieces as the model
+        produces them. The full answer is added to the conversation history at the end.
+        
+        Yields:
+        - Text pieces of the answer, or a single message if there is no context, no answer or an error.
+        """
+        if not context or len(context.strip()) == 0:
+            yield NO_CONTEXT_MESSAGE
+            return
 
-        # Check if embeddings already exist in file
-        if os.path.exists(save_path):
-            print(f"Loading precomputed embeddings from {save_path}...")
-            embeddings, chunks = self.load_embeddings_from_file(save_path)
-            
-        else:
-            print(f"Processing and embedding PDF: {pdf_name}...")
-            # Extract text from the PDF
-            pdf_text = self.extract_text_from_pdf(pdf_name)
+        parts = []
+        try:
+            messages = self.build_messages(question, context, system_prompt, conversation_key)
 
-            # Split the PDF text into chunks (if necessary)
-            chunks = [pdf_text[i:i + 2000] for i in range(0, len(pdf_text), 2000)]
+            for delta in self.llm.stream(messages, model=self.llm_model, max_tokens=self.max_token, temperature=0.0):
+                parts.append(delta)
+                yield delta
 
-            # Generate embeddings for each chunk
-            embeddings = [self.create_embedding(chunk) for chunk in chunks]
+        except Exception as e:
+            print(f"Error occurred: {e}")
+            metrics.increment("qa_errors_total", stage="generate")
+            yield ("\n\n" if parts else "") + ERROR_MESSAGE
+            return
+
+        answer = "".join(parts).strip()
+        if not answer:
+            yield NO_ANSWER_MESSAGE
+            return
+
+        self.conversations.append(conversation_key, question, answer)
+        metrics.observe("qa_answer_tokens", count_tokens(answer))
+
+    # The system prompt, retrieved context, earlier turns of this conversation and the new question,
+    # with older turns folded into a note when they don't fit the prompt budget
+    def build_messages(self, question, context, system_prompt, conversation_key=DEFAULT_CONVERSATION):
+        return self.prompt_budgeter.build_messages(
+            system_prompt, context, self.conversations.get(conversation_key), question
+        )
 
-            # Save embeddings to file for future use
-            self.save_embeddings_to_file(embeddings, chunks, save_path)
+    # Cached answers are only valid for the same PDF content, chunking, model and system prompt.
+    # Follow-up questions depend on the conversation, so they are neither looked up nor stored.
+    def answer_cache_scope(self, pdf_name, index, system_prompt, conversation_key):
+        if self.answer_cache is None or self.uses_lexical_only(index) or self.conversations.get(conversation_key):
+            return None
+        prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()[:16]
+        members = index.members if isinstance(index, GlobalIndex) else [index]
+        document_version = tuple(((m.source or {}).get("sha256"), m.chunking) for m in members)
+        return (pdf_name, prompt_hash, document_version, self.llm_model, self.embeddings_model)
+
+    def uses_lexical_only(self, index):
+        return self.lexical_retrieval == "lexical" and isinstance(index, EmbeddingIndex) and index.lexical is not None
+
+    # None when retrieval is lexical only, so no embeddings call is made
+    def embed_question(self, index, question):
+        if self.uses_lexical_only(index):
+            return None
+        return self.create_embedding(question)
+
+    # The index a question is answered from: the chat's PDF, or all PDFs in global scope
+    def load_retrieval_index(self, pdf_name):
+        if self.retrieval_scope == "global":
+            return self.load_global_index()
+        return self.load_index(pdf_name)
+
+    # The best chunks for the question that fit the prompt's context budget
+    def retrieve_context(self, index, question, question_embedding, top_n=None):
+        top_n = top_n or self.retrieval_candidates
+        if isinstance(index, GlobalIndex):
+            chunks = [hit["text"] for hit in index.search(question_embedding, top_n)]
+        else:
+            question_embeddings = [question_embedding] if question_embedding is not None else None
+            top_indices = self.top_chunk_indices_batch([question], index, top_n, question_embeddings)[0]
+            chunks = [index.chunks[i] for i in top_indices if i >= 0]
+        return self.prompt_budgeter.select_context(chunks)
+
+    # A cached answer for the question (recorded in the conversation), or None
+    def lookup_cached_answer(self, cache_scope, question_embedding, question, conversation_key):
+        if cache_scope is None:
+            return None
+        with metrics.span("answer_cache"):
+            cached = self.answer_cache.lookup(cache_scope, question_embedding)
+        if cached is not None:
+            self.conversations.append(conversation_key, question, cached)
+            metrics.increment("qa_questions_total", cached="true")
+        return cached
+
+    # Hit ratios of the caches, exported as gauges
+    def cache_metrics(self):
+        samples = []
+        caches = [("embedding", self.embedding_cache), ("answer", self.answer_cache)]
+        for name, cache in caches:
+            if cache is None:
+                continue
+            stats = cache.stats()
+            labels = {"cache": name, "tenant": self.tenant} if self.tenant else {"cache": name}
+            samples.append(("qa_cache_hit_ratio", labels, stats["hit_ratio"]))
+            samples.append(("qa_cache_entries", labels, stats["entries"]))
+        return samples
+
+    def is_cacheable_answer(self, answer):
+        return bool(answer) and answer not in (NO_CONTEXT_MESSAGE, NO_ANSWER_MESSAGE) and ERROR_MESSAGE not in answer
+
+    # Process the PDF, store embeddings, and answer questions
+    def process_pdf_and_answer(self, pdf_name, question, system_prompt, conversation_key=DEFAULT_CONVERSATION):
+        # Load the PDF's index once per process (built and saved on the first question)
+        with metrics.span("load_index"):
+            index = self.load_retrieval_index(pdf_name)
+
+        # The question's embedding serves both the answer cache and the retrieval
+        with metrics.span("embed_question"):
+            question_embedding = self.embed_question(index, question)
+        cache_scope = self.answer_cache_scope(pdf_name, index, system_prompt, conversation_key)
+        cached = self.lookup_cached_answer(cache_scope, question_embedding, question, conversation_key)
+        if cached is not None:
+            return cached
 
         # Get the most relevant chunk for the question
-        relevant_chunk = self.get_top_relevant_chunks(question, embeddings, chunks, top_n=3)
+        with metrics.span("retrieve"):
+            relevant_chunk = self.retrieve_context(index, question, question_embedding)
 
         # Generate and return the answer, now with the system prompt and conversation history
-        answer = self.generate_answer(question, relevant_chunk, system_prompt)
+        with metrics.span("generate"):
+            answer = self.generate_answer(question, relevant_chunk, system_prompt, conversation_key)
+        metrics.increment("qa_questions_total", cached="false")
 
+        if cache_scope is not None and self.is_cacheable_answer(answer):
+            self.answer_cache.put(cache_scope, question_embedding, question, answer)
         return answer
 
-    def clear_conversation_history(self):
-        self.conversation_history.clear()
+    # Retrieve the context now and return a generator streaming the answer
+    def process_pdf_and_answer_stream(self, pdf_name, question, system_prompt, conversation_key=DEFAULT_CONVERSATION):
+        with metrics.span("load_index"):
+            index = self.load_retrieval_index(pdf_name)
+
+        with metrics.span("embed_question"):
+            question_embedding = self.embed_question(index, question)
+        cache_scope = self.answer_cache_scope(pdf_name, index, system_prompt, conversation_key)
+        cached = self.lookup_cached_answer(cache_scope, question_embedding, question, conversation_key)
+        if cached is not None:
+            return iter([cached])
+
+        with metrics.span("retrieve"):
+            relevant_chunk = self.retrieve_context(index, question, question_embedding)
+        answer_stream = metrics.timed_stream(
+            self.generate_answer_stream(question, relevant_chunk, system_prompt, conversation_key), "generate"
+        )
+        metrics.increment("qa_questions_total", cached="false")
+        if cache_scope is None:
+            return answer_stream
+        return self._cache_streamed_answer(answer_stream, cache_scope, question_embedding, question)
+
+    # Pass the answer through and cache it once it has been fully streamed
+    def _cache_streamed_answer(self, answer_stream, cache_scope, question_embedding, question):
+        parts = []
+        for piece in answer_stream:
+            parts.append(piece)
+            yield piece
+        answer = "".join(parts).strip()
+        if self.is_cacheable_answer(answer):
+            self.answer_cache.put(cache_scope, question_embedding, question, answer)
+
+    def clear_conversation_history(self, conversation_key=DEFAULT_CONVERSATION):
+        self.conversations.clear(conversation_key)
+
+    # Async pipeline: the same steps as above with non-blocking API calls. Independent steps
+    # run concurrently, and cancelling the calling task stops the request in flight. The
+    # CPU-bound and SQLite steps (retrieval, the caches) run on worker threads, so one
+    # question never stalls the others sharing the event loop.
+
+    async def acreate_embeddings(self, texts):
+        return await self.embedding_cache.aembed(
+            texts, self.embeddings_model,
+            lambda missing: self.embedder.aembed(missing, self.embeddings_model)
+        )
+
+    async def acreate_embedding(self, text):
+        return (await self.acreate_embeddings([text]))[0]
+
+    # Loading may read files or build the index, so it runs on a worker thread
+    async def aload_retrieval_index(self, pdf_name):
+        return await asyncio.to_thread(self.load_retrieval_index, pdf_name)
+
+    # Load the index and embed the question at the same time
+    async def _aprepare_question(self, pdf_name, question):
+        if self.lexical_retrieval == "lexical" and self.retrieval_scope != "global":
+            return await self.aload_retrieval_index(pdf_name), None
+        index, question_embedding = await asyncio.gather(
+            self.aload_retrieval_index(pdf_name), self.acreate_embedding(question)
+        )
+        return index, question_embedding
+
+    async def asearch_pdfs(self, pdf_names, question, top_n=3):
+        """
+        Searches several PDFs at once: their indexes are loaded concurrently while the
+        question is embedded, then the hits of all PDFs are merged by score.
+
+        Returns:
+        - The top-n hits {"document", "chunk", "score", "text"}, best first.
+        """
+        question_embedding, *indexes = await asyncio.gather(
+            self.acreate_embedding(question),
+            *(asyncio.to_thread(self.load_index, pdf_name) for pdf_name in pdf_names)
+        )
+        # The scoring is numpy work, so every index is searched on a worker thread
+        results = await asyncio.gather(
+            *(asyncio.to_thread(index.search, question_embedding, top_n) for index in indexes)
+        )
+        hits = []
+        for pdf_name, index, (top_indices, top_scores) in zip(pdf_names, indexes, results):
+            hits += [
+                {"document": pdf_name, "chunk": int(i), "score": float(score), "text": index.chunks[i]}
+                for i, score in zip(top_indices, top_scores)
+            ]
+        return sorted(hits, key=lambda hit: -hit["score"])[:top_n]
+
+    async def agenerate_answer(self, question, context, system_prompt, conversation_key=DEFAULT_CONVERSATION):
+        if not context or len(context.strip()) == 0:
+            return NO_CONTEXT_MESSAGE
+
+        try:
+            messages = self.build_messages(question, context, system_prompt, conversation_key)
+            answer = (await self.llm.acomplete(
+                messages, model=self.llm_model, max_tokens=self.max_token, temperature=0.0
+            )).strip()
+
+            if not answer:
+                return NO_ANSWER_MESSAGE
+
+            self.conversations.append(conversation_key, question, answer)
+            metrics.observe("qa_answer_tokens", count_tokens(answer))
+            return answer
+
+        except Exception as e:
+            print(f"Error occurred: {e}")
+            metrics.increment("qa_errors_total", stage="generate")
+            return ERROR_MESSAGE
+
+    async def agenerate_answer_stream(self, question, context, system_prompt, conversation_key=DEFAULT_CONVERSATION):
+        if not context or len(context.strip()) == 0:
+            yield NO_CONTEXT_MESSAGE
+            return
+
+        parts = []
+        try:
+            messages = self.build_messages(question, context, system_prompt, conversation_key)
+
+            async for delta in self.llm.astream(messages, model=self.llm_model, max_tokens=self.max_token, temperature=0.0):
+                parts.append(delta)
+                yield delta
+
+        except Exception as e:
+            print(f"Error occurred: {e}")
+            metrics.increment("qa_errors_total", stage="generate")
+            yield ("\n\n" if parts else "") + ERROR_MESSAGE
+            return
+
+        answer = "".join(parts).strip()
+        if not answer:
+            yield NO_ANSWER_MESSAGE
+            return
+
+        self.conversations.append(conversation_key, question, answer)
+        metrics.observe("qa_answer_tokens", count_tokens(answer))
+
+    async def aprocess_pdf_and_answer(self, pdf_name, question, system_prompt, conversation_key=DEFAULT_CONVERSATION):
+        with metrics.span("prepare"):
+            index, question_embedding = await self._aprepare_question(pdf_name, question)
+
+        cache_scope = self.answer_cache_scope(pdf_name, index, system_prompt, conversation_key)
+        cached = await asyncio.to_thread(self.lookup_cached_answer, cache_scope, question_embedding, question, conversation_key)
+        if cached is not None:
+            return cached
+
+        with metrics.span("retrieve"):
+            relevant_chunk = await asyncio.to_thread(self.retrieve_context, index, question, question_embedding)
+        with metrics.span("generate"):
+            answer = await self.agenerate_answer(question, relevant_chunk, system_prompt, conversation_key)
+        metrics.increment("qa_questions_total", cached="false")
+
+        if cache_scope is not None and self.is_cacheable_answer(answer):
+            await asyncio.to_thread(self.answer_cache.put, cache_scope, question_embedding, question, answer)
+        return answer
+
+    # Retrieve the context now and return an async generator streaming the answer
+    async def aprocess_pdf_and_answer_stream(self, pdf_name, question, system_prompt, conversation_key=DEFAULT_CONVERSATION):
+        with metrics.span("prepare"):
+            index, question_embedding = await self._aprepare_question(pdf_name, question)
+
+        cache_scope = self.answer_cache_scope(pdf_name, index, system_prompt, conversation_key)
+        cached = await asyncio.to_thread(self.lookup_cached_answer, cache_scope, question_embedding, question, conversation_key)
+        if cached is not None:
+            return self._aiterate([cached])
+
+        with metrics.span("retrieve"):
+            relevant_chunk = await asyncio.to_thread(self.retrieve_context, index, question, question_embedding)
+        answer_stream = metrics.atimed_stream(
+            self.agenerate_answer_stream(question, relevant_chunk, system_prompt, conversation_key), "generate"
+        )
+        metrics.increment("qa_questions_total", cached="false")
+        if cache_scope is None:
+            return answer_stream
+        return self._acache_streamed_answer(answer_stream, cache_scope, question_embedding, question)
+
+    async def _aiterate(self, pieces):
+        for piece in pieces:
+            yield piece
+
+    async def _acache_streamed_answer(self, answer_stream, cache_scope, question_embedding, question):
+        parts = []
+        try:
+            async for piece in answer_stream:
+                parts.append(piece)
+                yield piece
+        finally:
+            # Close the model's stream right away if the consumer stopped early
+            await answer_stream.aclose()
+        answer = "".join(parts).strip()
+        if self.is_cacheable_answer(answer):
+            await asyncio.to_thread(self.answer_cache.put, cache_scope, question_embedding, question, answer)
 
 # Example usage
 if __name__ == "__main__":
@@ -1,38 +1,131 @@
-import os
-from dotenv import load_dotenv
+"""
+Telegram notifications about the chatbot: new questions, questions it couldn't answer and
+periodic statistics.
+
+Notifications are queued in memory (bounded, optionally saved to a file) and delivered by a
+background worker, so sending one never delays an answer:
+
+    notifier = get_notifier()        # None unless TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID are set
+    notifier.notify("unanswered", "מה שעות הפתיחה?", title="שאלה ללא תשובה")
+    report_question(question, answer, source="pool")
+
+Notifications of the same kind that arrive within TELEGRAM_BATCH_SECONDS are sent as one
+digest. Each chat gets at most one message per TELEGRAM_MIN_INTERVAL seconds; on HTTP 429 the
+sender waits the retry_after Telegram asks for, and other failures are retried with
+exponential backoff. TELEGRAM_API_URL points the sender at a stub server in tests
+(see utils.stub_server.TelegramStubServer).
+"""
 import asyncio
-import aiohttp
+import atexit
+import collections
+import html
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
 from typing import Optional
 
+import aiohttp
+from dotenv import load_dotenv
+
+from utils import metrics
+from utils.PdfQAProcessor import NO_CONTEXT_MESSAGE, NO_ANSWER_MESSAGE, ERROR_MESSAGE
+
 # Load environment variables from .env file
 load_dotenv()
 
+TELEGRAM_API_URL = "https://api.telegram.org"
+MAX_MESSAGE_CHARS = 4096
+MAX_CAPTION_CHARS = 1024
+
 class TelegramSender:
-    def __init__(self):
-        self.bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
-        self.chat_id = os.getenv("TELEGRAM_CHAT_ID")
+    """
+    Parameters:
+    - min_interval: Minimum seconds between two messages to the same chat.
+    - max_retries: Retries of a request after a rate limit, a server error or a network error.
+    """
+
+    def __init__(self, bot_token=None, chat_id=None, api_url=None, min_interval=None, max_retries=5):
+        self.bot_token = bot_token or os.getenv("TELEGRAM_BOT_TOKEN")
+        self.chat_id = chat_id or os.getenv("TELEGRAM_CHAT_ID")
         if not self.bot_token or not self.chat_id:
             raise ValueError("TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID must be set in environment variables")
-        self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
+        api_url = api_url or os.getenv("TELEGRAM_API_URL", TELEGRAM_API_URL)
+        self.base_url = f"{api_url.rstrip('/')}/bot{self.bot_token}"
+        self.min_interval = float(os.getenv("TELEGRAM_MIN_INTERVAL", 1.0)) if min_interval is None else min_interval
+        self.max_retries = max_retries
         self.session = None
+        self._next_send = {}  # chat id -> monotonic time of its next allowed message
 
     async def ensure_session(self):
         if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
 
     async def close_session(self):
         if self.session and not self.session.closed:
             await self.session.close()
 
-    async def _make_request(self, method: str, endpoint: str, **kwargs):
+    async def _wait_for_turn(self, chat_id):
+        delay = self._next_send.get(chat_id, 0.0) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._next_send[chat_id] = time.monotonic() + self.min_interval
+
+    async def _make_request(self, method: str, endpoint: str, chat_id=None, build_data=None, **kwargs):
+        """
+        Sends one API request, retrying rate-limited and failed attempts.
+        `build_data` returns an async context manager yielding the form data of one attempt,
+        so uploads reopen their file on every attempt and close it afterwards.
+
+        Returns:
+        - The decoded response, or None if the request failed.
+        """
         await self.ensure_session()
         url = f"{self.base_url}/{endpoint}"
-        async with getattr(self.session, method)(url, **kwargs) as response:
-            if response.status != 200:
-                print(f"Failed to {endpoint}. Status: {response.status}")
-                print(f"Response: {await response.text()}")
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self._wait_for_turn(chat_id)
+            retry_after = 2 ** attempt
+            try:
+                if build_data is None:
+                    status, payload, text = await self._send(method, url, **kwargs)
+                else:
+                    async with build_data() as data:
+                        status, payload, text = await self._send(method, url, data=data, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Failed to {endpoint}: {e}")
+            except OSError as e:
+                # The file to upload can't be read; retrying won't help
+                print(f"Failed to {endpoint}: {e}")
                 return None
-            return await response.json()
+            else:
+                if status == 200:
+                    return payload
+                if status == 429:
+                    # Telegram says how long this chat (or bot) has to wait
+                    retry_after = ((payload or {}).get("parameters") or {}).get("retry_after", retry_after)
+                    if chat_id is not None:
+                        self._next_send[chat_id] = time.monotonic() + retry_after
+                    metrics.increment("telegram_rate_limited_total")
+                elif status < 500:
+                    print(f"Failed to {endpoint}. Status: {status}")
+                    print(f"Response: {text}")
+                    return None
+                else:
+                    print(f"Failed to {endpoint}. Status: {status}")
+            if attempt < self.max_retries:
+                await asyncio.sleep(retry_after)
+        return None
+
+    async def _send(self, method, url, **kwargs):
+        async with getattr(self.session, method)(url, **kwargs) as response:
+            text = await response.text()
+            try:
+                payload = json.loads(text)
+            except json.JSONDecodeError:
+                payload = None
+            return response.status, payload, text
 
     async def verify_bot_token(self):
         result = await self._make_request('get', 'getMe')
@@ -41,41 +134,361 @@ class TelegramSender:
             return True
         return False
 
-    async def send_message(self, text: str, title: Optional[str] = None) -> None:
+    async def send_message(self, text: str, title: Optional[str] = None, chat_id=None) -> bool:
+        chat_id = chat_id or self.chat_id
         params = {
-            "chat_id": self.chat_id,
+            "chat_id": chat_id,
             "text": text,
             "parse_mode": "HTML"
         }
         if title:
             params["text"] = f"<b>{title}</b>\n\n{text}"
-        
-        result = await self._make_request('post', 'sendMessage', params=params)
-        if result:
-            print("Message sent successfully")
 
-    async def send_image_and_text(self, image_path: str, caption: Optional[str] = None) -> None:
-        data = aiohttp.FormData()
-        data.add_field("chat_id", self.chat_id)
-        data.add_field("photo", open(image_path, "rb"))
-        if caption:
-            data.add_field("caption", caption)
+        result = await self._make_request('post', 'sendMessage', chat_id=chat_id, json=params)
+        return result is not None
 
-        result = await self._make_request('post', 'sendPhoto', data=data)
-        if result:
-            print("Image sent successfully")
+    @asynccontextmanager
+    async def _file_form(self, chat_id, field, path, caption):
+        with open(path, "rb") as f:
+            data = aiohttp.FormData()
+            data.add_field("chat_id", str(chat_id))
+            # The open file is streamed to Telegram, not read into memory
+            data.add_field(field, f, filename=os.path.basename(path))
+            if caption:
+                data.add_field("caption", caption[:MAX_CAPTION_CHARS])
+            yield data
 
-    async def send_document(self, document_path: str, caption: Optional[str] = None) -> None:
-        data = aiohttp.FormData()
-        data.add_field("chat_id", self.chat_id)
-        data.add_field("document", open(document_path, "rb"))
-        if caption:
-            data.add_field("caption", caption)
+    async def send_image_and_text(self, image_path: str, caption: Optional[str] = None, chat_id=None) -> bool:
+        chat_id = chat_id or self.chat_id
+        form = lambda: self._file_form(chat_id, "photo", image_path, caption)
+        result = await self._make_request('post', 'sendPhoto', chat_id=chat_id, build_data=form)
+        return result is not None
+
+    async def send_document(self, document_path: str, caption: Optional[str] = None, chat_id=None) -> bool:
+        chat_id = chat_id or self.chat_id
+        form = lambda: self._file_form(chat_id, "document", document_path, caption)
+        result = await self._make_request('post', 'sendDocument', chat_id=chat_id, build_data=form)
+        return result is not None
+
+# The longest prefix of text whose HTML-escaped form fits max_chars, so no entity is cut in half
+def _escape_prefix(text, max_chars):
+    escaped = html.escape(text)
+    if len(escaped) <= max_chars:
+        return escaped
+    parts, used = [], 0
+    for char in text:
+        piece = html.escape(char)
+        if used + len(piece) > max_chars:
+            break
+        parts.append(piece)
+        used += len(piece)
+    return "".join(parts)
+
+def _digest_messages(title, texts):
+    """
+    Formats the texts of one kind of notification as few messages as possible, each within
+    Telegram's length limit.
+    """
+    if len(texts) == 1:
+        header = f"<b>{html.escape(title)}</b>\n\n" if title else ""
+        return [header + _escape_prefix(texts[0], max(0, MAX_MESSAGE_CHARS - len(header)))]
+
+    header = f"<b>{html.escape(title or '')} ({len(texts)})</b>\n"
+    messages, current = [], header
+    for text in texts:
+        line = "\n• " + _escape_prefix(text, max(0, MAX_MESSAGE_CHARS - len(header) - len("\n• ")))
+        if len(current) + len(line) > MAX_MESSAGE_CHARS:
+            messages.append(current)
+            current = header
+        current += line
+    messages.append(current)
+    return messages
+
+class TelegramNotifier:
+    """
+    Delivers notifications from a background thread with its own event loop.
+
+    Parameters:
+    - sender: The TelegramSender to deliver with.
+    - max_queue: Notifications kept waiting at most; further ones are dropped and counted.
+    - batch_seconds: How long to collect a burst of notifications before sending it.
+    - path: Optional JSON file keeping the waiting notifications across restarts.
+    - max_attempts: Delivery rounds of a notification before it is given up.
+    """
+
+    def __init__(self, sender, max_queue=1000, batch_seconds=10.0, path=None, max_attempts=3):
+        self.sender = sender
+        self.max_queue = max_queue
+        self.batch_seconds = batch_seconds
+        self.path = path
+        self.max_attempts = max_attempts
+
+        self._pending = collections.deque()
+        # The batch being delivered; saved with the pending ones if the process exits meanwhile
+        self._in_flight = []
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._stop_requested = None
+        self._thread = None
+        self._stopping = False
+        self._schedules = []
+        self._stats_sources = []
+        self._counts = collections.Counter()  # questions since the last statistics report
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+        if self.path and os.path.exists(self.path):
+            self.load()
+        metrics.register_collector(self.queue_metrics)
+
+    def notify(self, kind, text, title=None, chat_id=None, image_path=None, document_path=None):
+        """
+        Queues a notification and returns at once. Returns False if the queue was full.
+        """
+        notification = {
+            "kind": kind, "text": text, "title": title, "chat_id": chat_id or self.sender.chat_id,
+            "image_path": image_path, "document_path": document_path, "attempts": 0,
+        }
+        with self._lock:
+            if len(self._pending) >= self.max_queue:
+                self.dropped += 1
+                return False
+            self._pending.append(notification)
+        self._wake()
+        return True
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def add_stats_source(self, label, value):
+        """
+        Adds a line "label: value()" to the periodic statistics report.
+        """
+        self._stats_sources.append((label, value))
+
+    def schedule_stats(self, interval_seconds, title="סטטיסטיקה יומית"):
+        self._schedules.append((interval_seconds, title))
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._start_schedule, interval_seconds, title)
+
+    def stats_text(self):
+        with self._lock:
+            counts, self._counts = self._counts, collections.Counter()
+        lines = [f"שאלות: {counts['questions']}", f"שאלות ללא תשובה: {counts['unanswered']}"]
+        for label, value in self._stats_sources:
+            try:
+                lines.append(f"{label}: {value()}")
+            except Exception as e:
+                print(f"Failed to compute {label}: {e}")
+        return "\n".join(lines)
+
+    def queue_metrics(self):
+        with self._lock:
+            waiting = len(self._pending) + len(self._in_flight)
+        return [
+            ("telegram_queue_length", {}, waiting),
+            ("telegram_notifications_sent", {}, self.sent),
+            ("telegram_notifications_dropped", {}, self.dropped),
+            ("telegram_notifications_failed", {}, self.failed),
+        ]
+
+    def _wake(self):
+        loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._wakeup = asyncio.Event()
+            self._stop_requested = asyncio.Event()
+            for interval_seconds, title in self._schedules:
+                self._start_schedule(interval_seconds, title)
+            started.set()
+            try:
+                self._loop.run_until_complete(self._run())
+            finally:
+                scheduled = asyncio.all_tasks(self._loop)
+                for task in scheduled:
+                    task.cancel()
+                self._loop.run_until_complete(asyncio.gather(*scheduled, return_exceptions=True))
+                self._loop.run_until_complete(self.sender.close_session())
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait(timeout=10)
+        return self
+
+    def stop(self, timeout=30):
+        """
+        Sends what is still waiting (within timeout seconds) and stops the worker.
+        """
+        self._stopping = True
+        self._wake()
+        loop = self._loop
+        if loop is not None and self._stop_requested is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._stop_requested.set)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.save()
+
+    def _start_schedule(self, interval_seconds, title):
+        async def repeat():
+            while True:
+                await asyncio.sleep(interval_seconds)
+                self.notify("stats", self.stats_text(), title=title)
+
+        self._loop.create_task(repeat())
+
+    async def _run(self):
+        while True:
+            if not self._pending and not self._stopping:
+                await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._stopping:
+                # Let a burst of notifications accumulate into one digest; stop() cuts the wait short
+                try:
+                    await asyncio.wait_for(self._stop_requested.wait(), self.batch_seconds)
+                except asyncio.TimeoutError:
+                    pass
+            with self._lock:
+                batch = list(self._pending)
+                self._pending.clear()
+                self._in_flight = list(batch)
+            if batch:
+                try:
+                    await self._deliver(batch)
+                except Exception as e:
+                    print(f"Failed to deliver notifications: {e}")
+                    with self._lock:
+                        self.failed += len(self._in_flight)
+                        self._in_flight = []
+                self.save()
+            if self._stopping:
+                with self._lock:
+                    if not self._pending:
+                        return
+
+    async def _deliver(self, batch):
+        groups = collections.OrderedDict()
+        files = []
+        for notification in batch:
+            if notification["image_path"] or notification["document_path"]:
+                files.append(notification)
+            else:
+                key = (notification["chat_id"], notification["kind"], notification["title"])
+                groups.setdefault(key, []).append(notification)
+
+        for (chat_id, kind, title), notifications in groups.items():
+            messages = _digest_messages(title or kind, [n["text"] for n in notifications])
+            delivered = True
+            for message in messages:
+                delivered = await self.sender.send_message(message, chat_id=chat_id) and delivered
+            self._settle(notifications, delivered)
+
+        for notification in files:
+            caption = notification["text"]
+            if notification["image_path"]:
+                delivered = await self.sender.send_image_and_text(notification["image_path"], caption, notification["chat_id"])
+            else:
+                delivered = await self.sender.send_document(notification["document_path"], caption, notification["chat_id"])
+            self._settle([notification], delivered)
+
+    def _settle(self, notifications, delivered):
+        settled = {id(notification) for notification in notifications}
+        with self._lock:
+            self._in_flight = [n for n in self._in_flight if id(n) not in settled]
+        if delivered:
+            self.sent += len(notifications)
+            return
+        retry = []
+        for notification in notifications:
+            notification["attempts"] += 1
+            if notification["attempts"] < self.max_attempts and not self._stopping:
+                retry.append(notification)
+            else:
+                self.failed += 1
+        with self._lock:
+            self._pending.extendleft(reversed(retry))
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            pending = self._in_flight + list(self._pending)
+        try:
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(pending, f, ensure_ascii=False)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            print(f"Failed to save the notification queue to {self.path}: {e}")
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                pending = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Failed to load the notification queue from {self.path}: {e}")
+            return
+        with self._lock:
+            self._pending.extend(pending[-self.max_queue:])
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+def get_notifier():
+    """
+    The process-wide notifier, started on first use, or None when Telegram isn't configured.
+    """
+    global _notifier
+    if _notifier is None:
+        if not os.getenv("TELEGRAM_BOT_TOKEN") or not os.getenv("TELEGRAM_CHAT_ID"):
+            return None
+        with _notifier_lock:
+            if _notifier is None:
+                notifier = TelegramNotifier(
+                    TelegramSender(),
+                    max_queue=int(os.getenv("TELEGRAM_QUEUE_SIZE", 1000)),
+                    batch_seconds=float(os.getenv("TELEGRAM_BATCH_SECONDS", 10)),
+                    path=os.getenv("TELEGRAM_QUEUE_PATH") or None
+                )
+                if "stats" in _notify_kinds():
+                    notifier.schedule_stats(float(os.getenv("TELEGRAM_STATS_INTERVAL", 86400)))
+                _notifier = notifier.start()
+                # Flush (or save) what is still waiting when the process exits
+                atexit.register(_notifier.stop, 5)
+    return _notifier
+
+def _notify_kinds():
+    return {kind.strip() for kind in os.getenv("TELEGRAM_NOTIFY", "unanswered,stats").split(",")}
+
+def report_question(question, answer, source=None):
+    """
+    Counts a question for the statistics and queues the alerts enabled in TELEGRAM_NOTIFY
+    ("questions", "unanswered"). Never blocks on Telegram.
+    """
+    notifier = get_notifier()
+    if notifier is None:
+        return
+    unanswered = not answer or answer in (NO_CONTEXT_MESSAGE, NO_ANSWER_MESSAGE) or ERROR_MESSAGE in answer
+    notifier.count("questions")
+    if unanswered:
+        notifier.count("unanswered")
+
+    kinds = _notify_kinds()
+    text = f"[{source}] {question}" if source else question
+    if unanswered and "unanswered" in kinds:
+        notifier.notify("unanswered", text, title="שאלה ללא תשובה")
+    elif "questions" in kinds:
+        notifier.notify("question", text, title="שאלה חדשה")
 
-        result = await self._make_request('post', 'sendDocument', data=data)
-        if result:
-            print("Document sent successfully")
-            
 # Example usage
 async def main():
     sender = TelegramSender()
@@ -88,4 +501,4 @@ async def main():
         await sender.close_session()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
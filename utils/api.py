@@ -0,0 +1,275 @@
+"""
+A headless HTTP API over the same processors, indexes and caches as the Streamlit UI, for
+front-ends (WhatsApp, Telegram) that send many questions without a page rerun per message.
+
+    python -m utils.api --port 8080          # on its own
+    API_PORT=8080 streamlit run main.py      # inside the Streamlit process, sharing its indexes
+
+The server listens on API_HOST (default 127.0.0.1, so only local front-ends reach it). When
+API_TOKEN is set, every /v1 request needs an "Authorization: Bearer <API_TOKEN>" header.
+
+Endpoints (the community center is picked with the `tenant` query parameter or JSON field,
+see utils.tenants):
+
+    POST /v1/conversations   -> {"conversation_id"}
+    POST /v1/ask             {"question", "dialog", "conversation_id"?}  -> {"answer", ...}
+    POST /v1/ask/stream      same body, answered as server-sent events:
+                             "token" events {"text"} then one "done" event {"answer"}
+    POST /v1/retrieve        {"question", "documents"?, "top_n"?}  -> {"hits", "sources"}
+    GET  /v1/index/status    the PDFs of the tenant and the state of their indexes
+    GET  /health, GET /metrics
+
+Without a conversation_id every question is answered on its own; with one, earlier turns of
+that conversation are part of the prompt, like in the chat UI. Conversation IDs are issued
+by /v1/conversations and signed by the server, so a client can't pick (or guess) another
+client's conversation. They stay valid until the process restarts, like the history itself.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import uuid
+
+from aiohttp import web
+
+from utils import metrics
+from utils.EmbeddingIndex import EmbeddingIndex, get_index, index_pool_stats
+from utils.GlobalIndex import contributing_documents
+from utils.site_config import ConfigError
+from utils.tenants import get_tenant
+from utils.TelegramSender import report_question
+
+MAX_QUESTION_CHARS = 2000
+MAX_TOP_N = 20
+
+# Signs the conversation IDs this process hands out
+_CONVERSATION_SECRET = secrets.token_bytes(32)
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _json(payload, status=200):
+    return web.json_response(payload, status=status, dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+
+def api_host():
+    return os.getenv("API_HOST", "127.0.0.1")
+
+@web.middleware
+async def auth_middleware(request, handler):
+    token = os.getenv("API_TOKEN")
+    if token and request.path.startswith("/v1/"):
+        expected = f"Bearer {token}".encode('utf-8')
+        if not hmac.compare_digest(request.headers.get("Authorization", "").encode('utf-8'), expected):
+            return _json({"error": "Missing or invalid API token"}, status=401)
+    return await handler(request)
+
+@web.middleware
+async def error_middleware(request, handler):
+    try:
+        return await handler(request)
+    except ApiError as e:
+        return _json({"error": str(e)}, status=e.status)
+    except ConfigError as e:
+        return _json({"error": f"Invalid site config: {e}"}, status=500)
+
+async def _read_body(request):
+    if not request.can_read_body:
+        return {}
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ApiError(400, "The body is not valid JSON")
+    if not isinstance(body, dict):
+        raise ApiError(400, "The body should be a JSON object")
+    return body
+
+def _tenant(request, body):
+    name = body.get("tenant") or request.query.get("tenant")
+    if name is not None and not isinstance(name, str):
+        raise ApiError(400, "'tenant' should be a string")
+    tenant = get_tenant(name)
+    if tenant is None:
+        raise ApiError(404, f"Unknown tenant: {name}")
+    return tenant
+
+def _question(body):
+    question = body.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise ApiError(400, "'question' is required")
+    if len(question) > MAX_QUESTION_CHARS:
+        raise ApiError(400, f"'question' is longer than {MAX_QUESTION_CHARS} characters")
+    return question.strip()
+
+def _sign(conversation):
+    return hmac.new(_CONVERSATION_SECRET, conversation.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+def new_conversation_id():
+    conversation = uuid.uuid4().hex
+    return f"{conversation}.{_sign(conversation)}"
+
+def _conversation(conversation_id):
+    """
+    The conversation behind an ID issued by new_conversation_id(); anything else is rejected.
+    """
+    if not isinstance(conversation_id, str) or conversation_id.count(".") != 1:
+        raise ApiError(404, "Unknown conversation_id")
+    conversation, signature = conversation_id.split(".")
+    if not hmac.compare_digest(signature, _sign(conversation)):
+        raise ApiError(404, "Unknown conversation_id")
+    return conversation
+
+async def conversations(request):
+    return _json({"conversation_id": new_conversation_id()}, status=201)
+
+# The dialog gives the PDF and the system prompt, exactly as in the UI
+async def _prepare_ask(request):
+    body = await _read_body(request)
+    tenant = _tenant(request, body)
+    question = _question(body)
+    if not isinstance(body.get("dialog"), str):
+        raise ApiError(400, "'dialog' should be the key of a chat dialog")
+    dialog = tenant.config().dialogs.get(body["dialog"])
+    if dialog is None or not dialog.is_chatbot:
+        raise ApiError(404, f"Unknown chat dialog: {body.get('dialog')}")
+
+    conversation_id = body.get("conversation_id")
+    if conversation_id is None:
+        conversation_key = (f"api-once:{uuid.uuid4()}", dialog.key)
+    else:
+        conversation_key = (f"api:{_conversation(conversation_id)}", dialog.key)
+    processor = await asyncio.to_thread(tenant.processor)
+    source = f"api/{tenant.name}/{dialog.key}"
+    return processor, dialog, question, conversation_key, conversation_id is None, source
+
+async def ask(request):
+    processor, dialog, question, conversation_key, once, source = await _prepare_ask(request)
+    try:
+        answer = await processor.aprocess_pdf_and_answer(dialog.pdf_file, question, dialog.system_prompt, conversation_key)
+    finally:
+        if once:
+            processor.clear_conversation_history(conversation_key)
+    report_question(question, answer, source=source)
+    return _json({"answer": answer, "dialog": dialog.key, "document": dialog.pdf_file})
+
+def _event(name, payload):
+    return f"event: {name}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8')
+
+async def ask_stream(request):
+    processor, dialog, question, conversation_key, once, source = await _prepare_ask(request)
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream; charset=utf-8",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+
+    answer_stream = None
+    try:
+        answer_stream = await processor.aprocess_pdf_and_answer_stream(
+            dialog.pdf_file, question, dialog.system_prompt, conversation_key
+        )
+        parts = []
+        async for piece in answer_stream:
+            parts.append(piece)
+            await response.write(_event("token", {"text": piece}))
+        answer = "".join(parts).strip()
+        await response.write(_event("done", {"answer": answer, "dialog": dialog.key}))
+        report_question(question, answer, source=source)
+    finally:
+        # A client that disconnects cancels the handler; closing the stream cancels the model request
+        if answer_stream is not None:
+            await answer_stream.aclose()
+        if once:
+            processor.clear_conversation_history(conversation_key)
+    await response.write_eof()
+    return response
+
+async def retrieve(request):
+    body = await _read_body(request)
+    tenant = _tenant(request, body)
+    question = _question(body)
+    top_n = body.get("top_n", 3)
+    if not isinstance(top_n, int) or not 1 <= top_n <= MAX_TOP_N:
+        raise ApiError(400, f"'top_n' should be a number from 1 to {MAX_TOP_N}")
+
+    processor = await asyncio.to_thread(tenant.processor)
+    available = processor.list_pdf_names()
+    documents = body.get("documents") or available
+    if not isinstance(documents, list):
+        raise ApiError(400, "'documents' should be a list of PDF names")
+    unknown = [name for name in documents if name not in available]
+    if unknown:
+        raise ApiError(404, f"Unknown documents: {', '.join(map(str, unknown))}")
+
+    hits = await processor.asearch_pdfs(documents, question, top_n)
+    return _json({"hits": hits, "sources": contributing_documents(hits)})
+
+def _index_status(processor):
+    documents = []
+    for pdf_name in processor.list_pdf_names():
+        name = os.path.splitext(pdf_name)[0]
+        status = {"document": pdf_name, "indexed": EmbeddingIndex.exists(processor.embeddings_folder, name)}
+        if status["indexed"]:
+            index = get_index(processor.embeddings_folder, name)
+            status["chunks"] = len(index)
+            status["current"] = processor.is_index_current(index, pdf_name)
+        documents.append(status)
+    return {"documents": documents, "pool": index_pool_stats()}
+
+async def index_status(request):
+    tenant = _tenant(request, {})
+    processor = await asyncio.to_thread(tenant.processor)
+    return _json(await asyncio.to_thread(_index_status, processor))
+
+async def health(request):
+    return _json({"status": "ok"})
+
+async def prometheus_metrics(request):
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+def create_app():
+    app = web.Application(middlewares=[auth_middleware, error_middleware], client_max_size=64 * 1024)
+    app.router.add_post("/v1/conversations", conversations)
+    app.router.add_post("/v1/ask", ask)
+    app.router.add_post("/v1/ask/stream", ask_stream)
+    app.router.add_post("/v1/retrieve", retrieve)
+    app.router.add_get("/v1/index/status", index_status)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", prometheus_metrics)
+    return app
+
+def start_api_server(port, host=None):
+    """
+    Serves the API from a background thread with its own event loop, e.g. inside the
+    Streamlit process so both share the loaded indexes and caches. The host defaults to
+    API_HOST.
+    """
+    host = host or api_host()
+    started = threading.Event()
+
+    def serve_forever():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(create_app())
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, host, port).start())
+        started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=serve_forever, daemon=True)
+    thread.start()
+    started.wait(timeout=10)
+    return thread
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=api_host())
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", 8080)))
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
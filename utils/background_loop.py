@@ -0,0 +1,47 @@
+"""
+One long-lived event loop on a background thread, for running coroutines from synchronous
+code such as the Streamlit script.
+
+asyncio.run() creates a new loop on every call, and the pooled async HTTP clients (see
+utils.llm_clients) are bound to their loop, so a loop per rerun would mean a new connection
+pool per question. Coroutines run here instead always share the same loop and pools.
+
+    answer = background_loop.run(processor.aprocess_pdf_and_answer(...))
+    for piece in background_loop.iterate(answer_stream):
+        ...
+"""
+import asyncio
+import threading
+
+_loop = None
+_lock = threading.Lock()
+
+def get_loop():
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="background-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+def run(coroutine):
+    """
+    Runs the coroutine on the background loop and waits for its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop()).result()
+
+def iterate(async_generator):
+    """
+    Iterates an async generator from synchronous code, each step running on the background
+    loop. Stopping early (or an exception in the caller) closes the generator.
+    """
+    try:
+        while True:
+            try:
+                yield run(async_generator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run(async_generator.aclose())
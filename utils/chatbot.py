@@ -1,16 +1,14 @@
 import os
-from groq import Groq
 from dotenv import load_dotenv
 
+from utils.llm_clients import get_backend
 
 # Load environment variables
 load_dotenv()
 
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-
 def get_prompt(system_prompt, user_prompt):
     try:
-        response = groq_client.chat.completions.create(
+        new_prompt = get_backend("qroq").complete(
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
@@ -18,9 +16,7 @@ def get_prompt(system_prompt, user_prompt):
             model=os.getenv("GROQ_MODEL", "llama3-70b-8192"),
             temperature=0.0,
             max_tokens=int(os.getenv("GROQ_MAX_TOKENS", 1024)),
-            stream=False,
         )
-        new_prompt = response.choices[0].message.content
         return new_prompt
     except Exception as e:
         print(f"Error in get_prompt: {str(e)}")
@@ -0,0 +1,169 @@
+"""
+Chunking strategies that turn a stream of PDF pages into retrieval chunks.
+
+Every strategy takes an iterable of (page_number, text) and yields Chunk tuples that
+remember the pages they came from. Strategies are looked up by name:
+
+    chunker = get_chunker("structured", max_tokens=300, overlap_tokens=50)
+    chunks = list(chunker(pages))
+"""
+import math
+import re
+from collections import namedtuple
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # optional dependency, or the encoding can't be downloaded
+    _encoding = None
+
+Chunk = namedtuple("Chunk", ["text", "first_page", "last_page"])
+
+# Paragraph breaks, then sentence ends (including the Hebrew sof pasuq) or single line breaks
+PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?׃])\s+|\n")
+
+def count_tokens(text):
+    """
+    Counts tokens with tiktoken when it is installed. Otherwise estimates them as one
+    token per four UTF-8 bytes, which is close for both English and Hebrew text.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text.encode('utf-8')) / 4)
+
+_chunkers = {}
+
+def register_chunker(name):
+    def decorator(func):
+        _chunkers[name] = func
+        return func
+    return decorator
+
+def available_chunkers():
+    return sorted(_chunkers)
+
+def get_chunker(name, **options):
+    """
+    Returns a callable that chunks a page stream with the named strategy and options.
+    """
+    if name not in _chunkers:
+        raise ValueError(f"Unknown chunking strategy '{name}'. Available: {', '.join(available_chunkers())}")
+    func = _chunkers[name]
+    return lambda pages: func(pages, **options)
+
+# A stable description of a strategy and its options, stored in the index manifest
+def chunking_signature(name, **options):
+    return ":".join([name] + [f"{key}={options[key]}" for key in sorted(options)])
+
+@register_chunker("fixed")
+def fixed_chunks(pages, size=2000):
+    """
+    Splits the page stream into fixed-size character chunks as the pages arrive. The
+    chunk texts are identical to slicing the concatenated text every `size` characters.
+    """
+    buffer = ""
+    # (offset in buffer, page number) of every page that starts inside the buffer
+    starts = []
+    for page_number, text in pages:
+        starts.append((len(buffer), page_number))
+        buffer += text
+        if len(buffer) >= size:
+            cut = len(buffer) - len(buffer) % size
+            for i in range(0, cut, size):
+                yield Chunk(buffer[i:i + size], _page_at(starts, i), _page_at(starts, i + size - 1))
+            carried = _page_at(starts, cut)
+            buffer = buffer[cut:]
+            starts = [(0, carried)] + [(start - cut, page) for start, page in starts if start > cut]
+    if buffer:
+        yield Chunk(buffer, _page_at(starts, 0), _page_at(starts, len(buffer) - 1))
+
+# The page containing a buffer offset: the last page that starts at or before it
+def _page_at(starts, offset):
+    page = starts[0][1]
+    for start, page_number in starts:
+        if start > offset:
+            break
+        page = page_number
+    return page
+
+# Yields (sentence, ends_paragraph, ends_line) for every sentence of the page
+def _split_sentences(page_text):
+    for paragraph in PARAGRAPH_PATTERN.split(page_text):
+        sentences, start = [], 0
+        for match in SENTENCE_PATTERN.finditer(paragraph):
+            sentences.append((paragraph[start:match.start()].strip(), "\n" in match.group()))
+            start = match.end()
+        sentences.append((paragraph[start:].strip(), True))
+        sentences = [(sentence, ends_line) for sentence, ends_line in sentences if sentence]
+        for i, (sentence, ends_line) in enumerate(sentences):
+            # The last sentence of a paragraph carries the paragraph break
+            yield sentence, i == len(sentences) - 1, ends_line
+
+def _split_long_sentence(sentence, max_tokens):
+    words = sentence.split()
+    piece = []
+    for word in words:
+        if piece and count_tokens(" ".join(piece + [word])) > max_tokens:
+            yield " ".join(piece)
+            piece = []
+        piece.append(word)
+    if piece:
+        yield " ".join(piece)
+
+@register_chunker("structured")
+def structured_chunks(pages, max_tokens=300, overlap_tokens=50):
+    """
+    Packs whole sentences into chunks of at most max_tokens tokens, preferring to end a
+    chunk at a paragraph break. Each chunk starts with the last sentences (up to
+    overlap_tokens tokens) of the previous one, so facts on a boundary appear in both.
+    Sentences keep the line and paragraph breaks that follow them in the PDF, so lists and
+    tables stay one item per line.
+    """
+    # Units are (text, tokens, page_number, ends_paragraph, separator), where the separator
+    # is the break between the unit and the next one
+    units = []
+    tokens = 0
+    # Units added since the last chunk was emitted (the rest is carried-over overlap)
+    fresh = 0
+
+    def flush():
+        text = "".join(unit[0] + unit[4] for unit in units[:-1]) + units[-1][0]
+        return Chunk(text, units[0][2], units[-1][2])
+
+    def overlap_tail():
+        tail, tail_tokens = [], 0
+        for unit in reversed(units):
+            if tail_tokens + unit[1] > overlap_tokens:
+                break
+            tail.insert(0, unit)
+            tail_tokens += unit[1]
+        return tail, tail_tokens
+
+    for page_number, page_text in pages:
+        for sentence, ends_paragraph, ends_line in _split_sentences(page_text):
+            separator = "\n\n" if ends_paragraph else "\n" if ends_line else " "
+            sentence_tokens = count_tokens(sentence)
+            pieces = [sentence] if sentence_tokens <= max_tokens else list(_split_long_sentence(sentence, max_tokens))
+            for i, piece in enumerate(pieces):
+                piece_tokens = sentence_tokens if len(pieces) == 1 else count_tokens(piece)
+                if fresh and tokens + piece_tokens > max_tokens:
+                    yield flush()
+                    units, tokens = overlap_tail()
+                    fresh = 0
+                    # Drop the overlap if it would not leave room for the new sentence
+                    if tokens + piece_tokens > max_tokens:
+                        units, tokens = [], 0
+                # The pieces of a long sentence are joined by spaces
+                units.append((piece, piece_tokens, page_number, ends_paragraph, separator if i == len(pieces) - 1 else " "))
+                tokens += piece_tokens
+                fresh += 1
+
+            # Close the chunk at a paragraph break once it is mostly full
+            if ends_paragraph and fresh and tokens >= 0.75 * max_tokens:
+                yield flush()
+                units, tokens = overlap_tail()
+                fresh = 0
+
+    if fresh:
+        yield flush()
@@ -1,46 +1,97 @@
 import os
 import json
+import sqlite3
+import threading
+import time
 import streamlit as st
 
-# File to store user count
+# The count is kept in SQLite (WAL mode), so increments from concurrent sessions and
+# processes are atomic. The old JSON file only seeds the count the first time.
 DATA_FOLDER = 'data'
 USER_COUNT_FILE = os.path.join(DATA_FOLDER, 'user_count.json')
+USER_COUNT_DB = os.path.join(DATA_FOLDER, 'user_count.sqlite')
+COUNTER_NAME = "users"
 
-def initialize_user_count():
-    os.makedirs(DATA_FOLDER, exist_ok=True)
-    if not os.path.exists(USER_COUNT_FILE):
-        with open(USER_COUNT_FILE, 'w') as f:
-            json.dump({"count": 0}, f)
+# The displayed count is read from the database at most this often
+REFRESH_SECONDS = float(os.getenv("USER_COUNT_REFRESH_SECONDS", 30))
 
-def get_user_count(formatted=False):
+_local = threading.local()
+_cache_lock = threading.Lock()
+_cached_count = None
+_cached_at = 0.0
+_initialized = False
+
+def _connection():
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        connection = sqlite3.connect(USER_COUNT_DB, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        _local.connection = connection
+    return connection
+
+def _legacy_count():
     try:
         with open(USER_COUNT_FILE, 'r') as f:
-            data = json.load(f)
-        count = data.get("count", 0)
-        if formatted:            
-            return format_count(count)
-        return count
+            return json.load(f).get("count", 0)
     except (json.JSONDecodeError, FileNotFoundError):
         return 0
 
-def increment_user_count():
-    count = get_user_count()
-    count += 1    
-    with open(USER_COUNT_FILE, 'w') as f:
-        json.dump({"count": count}, f)
+def _remember(count):
+    global _cached_count, _cached_at
+    with _cache_lock:
+        _cached_count = count
+        _cached_at = time.monotonic()
+
+def initialize_user_count():
+    global _initialized
+    if _initialized:
+        return
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+    connection = _connection()
+    connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    connection.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, ?)", (COUNTER_NAME, _legacy_count()))
+    _initialized = True
+
+def _add(delta):
+    initialize_user_count()
+    connection = _connection()
+    # BEGIN IMMEDIATE takes the write lock up front, so the update and the read are one step
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute("UPDATE counters SET value = MAX(0, value + ?) WHERE name = ?", (delta, COUNTER_NAME))
+        count = connection.execute("SELECT value FROM counters WHERE name = ?", (COUNTER_NAME,)).fetchone()[0]
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    _remember(count)
+    return count
+
+def get_user_count(formatted=False):
+    with _cache_lock:
+        count = _cached_count if time.monotonic() - _cached_at < REFRESH_SECONDS else None
+    if count is None:
+        try:
+            initialize_user_count()
+            row = _connection().execute("SELECT value FROM counters WHERE name = ?", (COUNTER_NAME,)).fetchone()
+            count = row[0] if row else 0
+        except sqlite3.Error as e:
+            print(f"Failed to read the user count: {e}")
+            count = _cached_count or 0
+        _remember(count)
+    if formatted:
+        return format_count(count)
     return count
 
+def increment_user_count():
+    return _add(1)
+
 def decrement_user_count():
     print("Decrementing user count")
-    
-    count = get_user_count()
-    count = max(0, count - 1)  # Ensure count doesn't go below 0
-    with open(USER_COUNT_FILE, 'w') as f:
-        json.dump({"count": count}, f)
-    return count
+    return _add(-1)
 
 def format_count(count):
-    """Format the count with commas and round to nearest thousand if over 1000"""    
+    """Format the count with commas and round to nearest thousand if over 1000"""
     if count >= 1000:
         return f"{count:,}"
     return f"{count:,}"
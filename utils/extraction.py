@@ -0,0 +1,42 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+def count_pages(pdf_path):
+    with fitz.open(pdf_path) as pdf_document:
+        return len(pdf_document)
+
+def iter_pdf_pages(pdf_path, start=0, end=None):
+    """
+    Yields the text of a PDF one page at a time, so a large document is never held in
+    memory as a single string.
+
+    Parameters:
+    - pdf_path: Path to the PDF file.
+    - start, end: Optional zero-based page range (end is exclusive).
+
+    Yields:
+    - (page_number, text) with 1-based page numbers.
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        end = len(pdf_document) if end is None else min(end, len(pdf_document))
+        for page_num in range(start, end):
+            page = pdf_document.load_page(page_num)
+            yield page_num + 1, page.get_text("text")
+
+# Runs in a worker process: each worker opens the PDF itself, documents can't be pickled
+def _extract_page_range(args):
+    pdf_path, start, end = args
+    return list(iter_pdf_pages(pdf_path, start, end))
+
+def iter_pdf_pages_parallel(pdf_path, workers=None, pages_per_task=16):
+    """
+    Like iter_pdf_pages, but splits the pages across a process pool. Pages are still
+    yielded in order, as soon as each range of pages is done.
+    """
+    page_count = count_pages(pdf_path)
+    tasks = [(pdf_path, start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for pages in executor.map(_extract_page_range, tasks):
+            yield from pages
@@ -0,0 +1,126 @@
+"""
+Offline pre-indexing of every PDF the chatbot answers from.
+
+    python -m utils.indexing             # build missing or outdated indexes
+    python -m utils.indexing --force     # rebuild everything
+    python -m utils.indexing pool.pdf    # only the given PDFs
+    python -m utils.indexing --tenant kiryat-ono   # a tenant's PDFs (see utils.tenants)
+
+PDFs are taken from `data/` and from `dialogs[*].pdf_file` in `matnas_data.json`, and are
+indexed in parallel worker processes.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.EmbeddingIndex import EmbeddingIndex
+from utils.PdfQAProcessor import PdfQAProcessor
+from utils.extraction import count_pages
+
+def collect_pdf_names(config_path="matnas_data.json", data_folder="data"):
+    """
+    Returns the PDF file names used by the dialogs in the config, followed by any other
+    PDFs found in the data folder.
+    """
+    names = []
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for dialog in data.get("dialogs", {}).values():
+            if dialog.get("pdf_file") and dialog["pdf_file"] not in names:
+                names.append(dialog["pdf_file"])
+
+    if os.path.isdir(data_folder):
+        for file_name in sorted(os.listdir(data_folder)):
+            if file_name.lower().endswith(".pdf") and file_name not in names:
+                names.append(file_name)
+    return names
+
+# An index is outdated when the PDF's content hash, the chunking or the embeddings model differs from its manifest
+def needs_indexing(processor, pdf_name):
+    name = os.path.splitext(pdf_name)[0]
+    if not EmbeddingIndex.exists(processor.embeddings_folder, name):
+        return True
+    index = EmbeddingIndex.load(processor.embeddings_folder, name)
+    return not processor.is_index_current(index, pdf_name)
+
+def index_pdf(pdf_name, data_folder="data", embeddings_folder="embeddings", force=False):
+    """
+    Builds and saves the index of one PDF. Runs inside a worker process.
+    Unless force is set, unchanged chunks reuse the vectors of the existing index.
+
+    Returns:
+    - (pdf_name, pages, chunks, seconds)
+    """
+    start = time.perf_counter()
+    name = os.path.splitext(pdf_name)[0]
+    previous = None
+    if not force and EmbeddingIndex.exists(embeddings_folder, name):
+        previous = EmbeddingIndex.load(embeddings_folder, name)
+    elif not force and os.path.exists(EmbeddingIndex.legacy_path(embeddings_folder, name)):
+        previous = EmbeddingIndex.from_legacy_pickle(EmbeddingIndex.legacy_path(embeddings_folder, name))
+
+    processor = PdfQAProcessor(data_folder=data_folder, embeddings_folder=embeddings_folder)
+    index = processor.build_index(pdf_name, previous=previous)
+    index.save(embeddings_folder, name)
+
+    pages = count_pages(os.path.join(data_folder, pdf_name))
+    return pdf_name, pages, len(index), time.perf_counter() - start
+
+def index_all(pdf_names, data_folder="data", embeddings_folder="embeddings", workers=None, force=False):
+    """
+    Indexes the given PDFs in parallel processes and prints per-file and total throughput.
+
+    Returns:
+    - A list of (pdf_name, pages, chunks, seconds) for the PDFs that were indexed.
+    """
+    processor = PdfQAProcessor(data_folder=data_folder, embeddings_folder=embeddings_folder)
+    todo = [name for name in pdf_names if force or needs_indexing(processor, name)]
+    for name in pdf_names:
+        if name not in todo:
+            print(f"Up to date: {name}")
+    if not todo:
+        return []
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(index_pdf, name, data_folder, embeddings_folder, force): name for name in todo}
+        for future in as_completed(futures):
+            try:
+                name, pages, chunks, seconds = future.result()
+            except Exception as e:
+                print(f"Failed to index {futures[future]}: {e}")
+                continue
+            results.append((name, pages, chunks, seconds))
+            print(f"Indexed {name}: {pages} pages, {chunks} chunks in {seconds:.1f}s")
+
+    elapsed = time.perf_counter() - start
+    total_pages = sum(result[1] for result in results)
+    total_chunks = sum(result[2] for result in results)
+    print(f"Indexed {len(results)}/{len(todo)} PDFs in {elapsed:.1f}s: "
+          f"{total_pages / elapsed:.1f} pages/s, {total_chunks / elapsed:.1f} chunks/s")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", help="PDF file names (default: all)")
+    parser.add_argument("--config", default="matnas_data.json")
+    parser.add_argument("--data-folder", default="data")
+    parser.add_argument("--embeddings-folder", default="embeddings")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Rebuild and re-embed every index, even if up to date")
+    parser.add_argument("--tenant", help="Index the tenant's folders instead of the ones above")
+    args = parser.parse_args()
+
+    if args.tenant:
+        from utils.tenants import get_tenant
+        tenant = get_tenant(args.tenant)
+        if tenant is None:
+            parser.error(f"Unknown tenant: {args.tenant}")
+        args.config, args.data_folder, args.embeddings_folder = tenant.config_path, tenant.data_folder, tenant.embeddings_folder
+
+    pdf_names = args.pdfs or collect_pdf_names(args.config, args.data_folder)
+    index_all(pdf_names, args.data_folder, args.embeddings_folder, workers=args.workers, force=args.force)
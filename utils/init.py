@@ -1,36 +1,9 @@
 import streamlit as st
-import os
 
-def initialize():    
-    # Load header content
-    header_file_path = os.path.join('utils', 'header.md')
-    try:
-        with open(header_file_path, 'r', encoding='utf-8') as header_file:
-            header_content = header_file.read()
-    except FileNotFoundError:
-        st.error("header.md file not found in utils folder.")
-        header_content = ""  # Provide a default empty header
+from utils.site_config import get_site_config
 
-    # Extract title and image path from header content
-    header_lines = header_content.split('\n')
-    title = header_lines[0].strip('# ')
-    image_path = None    
-    for line in header_lines:
-        if line.startswith('!['):
-            image_path = line.split('(')[1].split(')')[0]
-            break
-
-    # Load external CSS
-    css_file_path = os.path.join('utils', 'styles.css')
-    with open(css_file_path, 'r') as f:
-        st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)    
-    
-    # Load footer content
-    footer_path = os.path.join('utils', 'footer.md')
-    if os.path.exists(footer_path):
-        with open(footer_path, 'r', encoding='utf-8') as footer_file:
-            footer_content= footer_file.read()
-    else: 
-        footer_content= None  # Return None if the file doesn't exist
-
-    return title, image_path, footer_content
\ No newline at end of file
+def initialize(config=None):
+    # The header, styles and footer are read once and reloaded only when the files change
+    config = config or get_site_config()
+    st.markdown(config.styles_html, unsafe_allow_html=True)
+    return config.title, config.image_path, config.footer_content
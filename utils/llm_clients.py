@@ -0,0 +1,214 @@
+"""
+One process-wide client layer for the LLM and embedding APIs.
+
+Backends are registered by name (the MODEL_TYPE values "chatgpt" and "qroq", plus "mock"
+for tests) and created once per process. Each backend owns pooled keep-alive HTTP
+connections, so questions reuse open connections instead of a new TLS handshake each time.
+
+    backend = get_backend("chatgpt")
+    answer = backend.complete(messages, model="gpt-4o-mini", max_tokens=1024)
+    for piece in backend.stream(messages, model="gpt-4o-mini", max_tokens=1024): ...
+    answer = await backend.acomplete(messages, model="gpt-4o-mini", max_tokens=1024)
+"""
+import asyncio
+import os
+import threading
+
+import httpx
+import openai
+from dotenv import load_dotenv
+from groq import Groq, AsyncGroq
+
+from utils.stub_server import stub_answer, stub_embedding
+
+load_dotenv()
+
+# Seconds to wait for a connection and for a whole response
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))
+REQUEST_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+POOL_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", 100)),
+    max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", 20)),
+    keepalive_expiry=60
+)
+
+_backend_classes = {}
+_backends = {}
+_backends_lock = threading.Lock()
+
+def register_backend(*names):
+    def decorator(cls):
+        for name in names:
+            _backend_classes[name] = cls
+        return cls
+    return decorator
+
+def available_backends():
+    return sorted(_backend_classes)
+
+def get_backend(name):
+    """
+    Returns the shared backend registered under name, creating it on first use.
+    Aliases of the same backend share one instance.
+    """
+    if name not in _backend_classes:
+        raise ValueError(f"Unknown LLM backend '{name}'. Available: {', '.join(available_backends())}")
+    cls = _backend_classes[name]
+    backend = _backends.get(cls)
+    if backend is not None:
+        return backend
+    with _backends_lock:
+        if cls not in _backends:
+            _backends[cls] = cls()
+        return _backends[cls]
+
+def _timeout():
+    return httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+class LLMBackend:
+    """
+    Interface of a backend. `messages` are chat messages as dicts with role and content.
+    """
+
+    def complete(self, messages, model, max_tokens, temperature=0.0):
+        raise NotImplementedError
+
+    def stream(self, messages, model, max_tokens, temperature=0.0):
+        raise NotImplementedError
+
+    def embed(self, texts, model):
+        raise NotImplementedError(f"{type(self).__name__} does not create embeddings")
+
+    async def acomplete(self, messages, model, max_tokens, temperature=0.0):
+        raise NotImplementedError
+
+    async def astream(self, messages, model, max_tokens, temperature=0.0):
+        raise NotImplementedError
+        yield
+
+    async def aembed(self, texts, model):
+        raise NotImplementedError(f"{type(self).__name__} does not create embeddings")
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Shared implementation for SDKs with the OpenAI chat completions interface.
+    Subclasses provide the sync and async client classes and the API key.
+    """
+
+    def __init__(self):
+        self.client = self.create_client(httpx.Client(limits=POOL_LIMITS, timeout=_timeout()))
+        # httpx async clients are bound to the event loop that created them
+        self._async_clients = {}
+        self._async_lock = threading.Lock()
+
+    def create_client(self, http_client):
+        raise NotImplementedError
+
+    def create_async_client(self, http_client):
+        raise NotImplementedError
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            # Forget clients of loops that have been closed (e.g. by asyncio.run). Their connections
+            # can no longer be closed gracefully, so long-lived callers should share one loop
+            # (see utils.background_loop)
+            for old_loop in [l for l in self._async_clients if l.is_closed()]:
+                del self._async_clients[old_loop]
+            if loop not in self._async_clients:
+                http_client = httpx.AsyncClient(limits=POOL_LIMITS, timeout=_timeout())
+                self._async_clients[loop] = self.create_async_client(http_client)
+            return self._async_clients[loop]
+
+    def complete(self, messages, model, max_tokens, temperature=0.0):
+        response = self.client.chat.completions.create(
+            model=model, messages=messages, max_tokens=max_tokens, temperature=temperature, stream=False
+        )
+        return response.choices[0].message.content or ""
+
+    def stream(self, messages, model, max_tokens, temperature=0.0):
+        stream = self.client.chat.completions.create(
+            model=model, messages=messages, max_tokens=max_tokens, temperature=temperature, stream=True
+        )
+        for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+
+    def embed(self, texts, model):
+        response = self.client.embeddings.create(model=model, input=list(texts))
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def acomplete(self, messages, model, max_tokens, temperature=0.0):
+        response = await self.async_client.chat.completions.create(
+            model=model, messages=messages, max_tokens=max_tokens, temperature=temperature, stream=False
+        )
+        return response.choices[0].message.content or ""
+
+    async def astream(self, messages, model, max_tokens, temperature=0.0):
+        stream = await self.async_client.chat.completions.create(
+            model=model, messages=messages, max_tokens=max_tokens, temperature=temperature, stream=True
+        )
+        async for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+
+    async def aembed(self, texts, model):
+        response = await self.async_client.embeddings.create(model=model, input=list(texts))
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+@register_backend("chatgpt", "openai")
+class OpenAIBackend(OpenAICompatibleBackend):
+    def create_client(self, http_client):
+        return openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+
+    def create_async_client(self, http_client):
+        return openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+
+@register_backend("qroq", "groq")
+class GroqBackend(OpenAICompatibleBackend):
+    def create_client(self, http_client):
+        return Groq(api_key=os.getenv("GROQ_API_KEY"), http_client=http_client)
+
+    def create_async_client(self, http_client):
+        return AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), http_client=http_client)
+
+    def embed(self, texts, model):
+        raise NotImplementedError("Groq does not create embeddings, use the chatgpt backend")
+
+    async def aembed(self, texts, model):
+        raise NotImplementedError("Groq does not create embeddings, use the chatgpt backend")
+
+@register_backend("mock")
+class MockBackend(LLMBackend):
+    """
+    In-process backend for tests: no network, deterministic answers and embeddings
+    (the same ones the stub server returns). Every call is recorded in `calls`.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.calls = []
+
+    def complete(self, messages, model, max_tokens, temperature=0.0):
+        self.calls.append(("complete", messages))
+        return stub_answer(messages)
+
+    def stream(self, messages, model, max_tokens, temperature=0.0):
+        answer = self.complete(messages, model, max_tokens, temperature)
+        for word in answer.split(" "):
+            yield word + " "
+
+    def embed(self, texts, model):
+        self.calls.append(("embed", list(texts)))
+        return [stub_embedding(text, self.dim).tolist() for text in texts]
+
+    async def acomplete(self, messages, model, max_tokens, temperature=0.0):
+        return self.complete(messages, model, max_tokens, temperature)
+
+    async def astream(self, messages, model, max_tokens, temperature=0.0):
+        for piece in self.stream(messages, model, max_tokens, temperature):
+            yield piece
+
+    async def aembed(self, texts, model):
+        return self.embed(texts, model)
@@ -0,0 +1,99 @@
+"""
+Resized renditions of the uploaded images and copies of the PDFs, served as static files.
+
+Every file is written once to static/media/ under a name derived from its content hash,
+and Streamlit serves that folder (server.enableStaticServing) at /app/static/. Pages then
+reference short URLs instead of inlining megabytes of base64 on every rerun, and the
+browser can cache them.
+
+    media_url("uploads/main_image1.png", "display")   # resized, recompressed
+    media_url("uploads/main_image1.png", "thumb")     # small preview
+    media_url("data/pool.pdf")                        # the original bytes
+"""
+import hashlib
+import os
+import shutil
+import threading
+
+from PIL import Image
+
+MEDIA_FOLDER = os.path.join("static", "media")
+MEDIA_ROUTE = "app/static/media"
+
+# Longest side in pixels and JPEG quality of each rendition
+RENDITIONS = {
+    "display": (1600, 82),
+    "thumb": (400, 75),
+}
+
+_hashes = {}  # (path, size, mtime) -> content hash
+_lock = threading.Lock()
+
+def content_hash(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    digest = _hashes.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(block)
+        digest = sha.hexdigest()[:16]
+        _hashes[key] = digest
+    return digest
+
+def _render(source, target, max_side, quality):
+    with Image.open(source) as image:
+        image.thumbnail((max_side, max_side))
+        # JPEG has no alpha channel: flatten transparent images onto white
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(target + ".tmp", format="JPEG", quality=quality, optimize=True, progressive=True)
+    os.replace(target + ".tmp", target)
+
+def media_file(path, variant=None):
+    """
+    Returns the path of the static copy of `path`: the original file when variant is None,
+    otherwise the named rendition (see RENDITIONS). It is created on first use.
+    """
+    base_name, extension = os.path.splitext(os.path.basename(path))
+    digest = content_hash(path)
+    if variant is None:
+        file_name = f"{base_name}_{digest}{extension.lower()}"
+    else:
+        file_name = f"{base_name}_{digest}_{variant}.jpg"
+    target = os.path.join(MEDIA_FOLDER, file_name)
+
+    if not os.path.exists(target):
+        with _lock:
+            if not os.path.exists(target):
+                os.makedirs(MEDIA_FOLDER, exist_ok=True)
+                if variant is None:
+                    shutil.copyfile(path, target + ".tmp")
+                    os.replace(target + ".tmp", target)
+                else:
+                    _render(path, target, *RENDITIONS[variant])
+    return target
+
+def media_url(path, variant=None, base_url_path=""):
+    """
+    Absolute URL of the static copy of `path`, for <img> and <a href> in the page and in
+    components (which run in their own frames, so relative URLs would not resolve).
+    """
+    file_name = os.path.basename(media_file(path, variant))
+    parts = [part.strip("/") for part in (base_url_path, MEDIA_ROUTE, file_name) if part and part.strip("/")]
+    return "/" + "/".join(parts)
+
+def prepare_media(paths):
+    """
+    Creates every rendition of the given images up front, e.g. when the app starts.
+    """
+    for path in paths:
+        if os.path.exists(path):
+            for variant in RENDITIONS:
+                media_file(path, variant)
@@ -0,0 +1,215 @@
+"""
+Process-wide metrics of the QA path: latency histograms per stage, token histograms,
+counters and cache statistics, rendered in the Prometheus text format.
+
+    with metrics.span("retrieve"):
+        ...
+    metrics.observe("qa_prompt_tokens", 812)
+    metrics.increment("qa_errors_total", stage="generate")
+
+    metrics.start_metrics_server(9108)           # GET /metrics
+    metrics.start_metrics_dump("metrics.prom")   # or rewrite a file every minute
+"""
+import bisect
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+HELP = {
+    "qa_stage_seconds": "Duration of each stage of answering a question",
+    "qa_prompt_tokens": "Tokens of the prompts sent to the LLM",
+    "qa_answer_tokens": "Tokens of the generated answers",
+    "qa_questions_total": "Questions answered",
+    "qa_errors_total": "Errors while answering",
+}
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> Histogram
+_counters = {}    # (name, labels) -> value
+_collectors = []  # weak references to callables returning [(name, labels dict, value)]
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+def observe(name, value, buckets=None, **labels):
+    if buckets is None:
+        buckets = LATENCY_BUCKETS if name.endswith("_seconds") else TOKEN_BUCKETS
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+def increment(name, amount=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+@contextmanager
+def span(stage):
+    """
+    Times the block into qa_stage_seconds{stage=...}. Failed blocks are timed too and counted
+    in qa_errors_total.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        increment("qa_errors_total", stage=stage)
+        raise
+    finally:
+        observe("qa_stage_seconds", time.perf_counter() - start, stage=stage)
+
+def timed_stream(stream, stage):
+    """
+    Passes a stream of answer pieces through, timing the first piece as `<stage>_first_token`
+    and the whole stream as `stage`.
+    """
+    start = time.perf_counter()
+    first = True
+    for piece in stream:
+        if first:
+            observe("qa_stage_seconds", time.perf_counter() - start, stage=f"{stage}_first_token")
+            first = False
+        yield piece
+    observe("qa_stage_seconds", time.perf_counter() - start, stage=stage)
+
+async def atimed_stream(stream, stage):
+    start = time.perf_counter()
+    first = True
+    try:
+        async for piece in stream:
+            if first:
+                observe("qa_stage_seconds", time.perf_counter() - start, stage=f"{stage}_first_token")
+                first = False
+            yield piece
+    finally:
+        await stream.aclose()
+    observe("qa_stage_seconds", time.perf_counter() - start, stage=stage)
+
+def register_collector(collector):
+    """
+    Adds a callable whose (name, labels, value) samples are exported as gauges on every
+    render. Bound methods are held weakly, so collectors of discarded objects disappear.
+    """
+    reference = weakref.WeakMethod(collector) if hasattr(collector, "__self__") else (lambda: collector)
+    with _lock:
+        _collectors.append(reference)
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_prometheus():
+    with _lock:
+        histograms = sorted((key, list(h.counts), h.sum, h.count, h.buckets) for key, h in _histograms.items())
+        counters = sorted(_counters.items())
+        collectors = list(_collectors)
+
+    lines = []
+    typed = set()
+
+    def header(name, kind):
+        if name not in typed:
+            typed.add(name)
+            if name in HELP:
+                lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), counts, total, count, buckets in histograms:
+        header(name, "histogram")
+        cumulative = 0
+        for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    for (name, labels), value in counters:
+        header(name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    # Samples of one metric must be adjacent, even when several collectors report it
+    gauges = []
+    for reference in collectors:
+        collector = reference()
+        if collector is not None:
+            gauges += [(name, _labels(labels), value) for name, labels, value in collector()]
+    for name, labels, value in sorted(gauges, key=lambda sample: sample[:2]):
+        header(name, "gauge")
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_metrics_server(port, host=None):
+    """
+    Serves the metrics on http://host:port/metrics from a background thread. The host
+    defaults to METRICS_HOST, or 127.0.0.1 so only a local scraper can read them.
+    """
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+def start_metrics_dump(path, interval_seconds=60):
+    """
+    Rewrites `path` with the current metrics every interval_seconds from a background thread.
+    """
+    def dump_forever():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                with open(path + ".tmp", 'w', encoding='utf-8') as f:
+                    f.write(render_prometheus())
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                print(f"Failed to write metrics to {path}: {e}")
+
+    thread = threading.Thread(target=dump_forever, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,162 @@
+"""
+Assembles the chat prompt within a token budget.
+
+The retrieved chunks are taken best first until the context budget is used, with sentences
+already present in a better chunk left out (overlapping chunks repeat them). The newest
+conversation turns are kept while they fit the history budget; older ones are folded
+into a short note listing their questions.
+
+    budgeter = PromptBudgeter(max_tokens=6000, context_tokens=2500, history_tokens=1500)
+    context = budgeter.select_context(chunks)
+    messages = budgeter.build_messages(system_prompt, context, turns, question)
+    budgeter.stats()
+"""
+import threading
+
+from utils.chunking import SENTENCE_PATTERN, count_tokens
+from utils import metrics
+
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def _truncate_to_tokens(text, max_tokens):
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    return text[:max(0, len(text) * max_tokens // tokens)]
+
+def dedupe_sentences(chunks):
+    """
+    Removes from every chunk the sentences that an earlier chunk already contains. The
+    structured chunker joins sentences with spaces, so its overlap is a run of sentences
+    rather than of lines. Chunks left without any sentence are dropped.
+    """
+    seen = set()
+    result = []
+    for chunk in chunks:
+        lines = []
+        for line in chunk.splitlines():
+            sentences = []
+            for sentence in SENTENCE_PATTERN.split(line):
+                key = " ".join(sentence.split())
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                sentences.append(sentence.strip())
+            if sentences:
+                lines.append(" ".join(sentences))
+        text = "\n".join(lines).strip()
+        if text:
+            result.append(text)
+    return result
+
+class PromptBudgeter:
+    """
+    Parameters:
+    - max_tokens: Budget of the whole prompt (system prompt, context, history and question).
+    - context_tokens: Budget of the retrieved context.
+    - history_tokens: Budget of earlier conversation turns.
+    - summary_tokens: Budget of the note that replaces the turns that didn't fit.
+    """
+
+    def __init__(self, max_tokens=6000, context_tokens=2500, history_tokens=1500, summary_tokens=200):
+        self.max_tokens = max_tokens
+        self.context_tokens = context_tokens
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+
+        self._lock = threading.Lock()
+        self._prompts = 0
+        self._total_tokens = 0
+        self._max_seen = 0
+        self._turns_dropped = 0
+        self._chunks_dropped = 0
+        self.last = None
+
+    def select_context(self, chunks):
+        """
+        Joins chunks, best first, until the context budget is reached. The best chunk is
+        always included, cut to the budget if needed.
+        """
+        unique = dedupe_sentences(chunks)
+        selected, used = [], 0
+        for chunk in unique:
+            tokens = count_tokens(chunk)
+            if used + tokens > self.context_tokens:
+                if not selected:
+                    selected.append(_truncate_to_tokens(chunk, self.context_tokens))
+                continue
+            selected.append(chunk)
+            used += tokens
+
+        with self._lock:
+            self._chunks_dropped += len(chunks) - len(selected)
+        return "\n\n".join(selected)
+
+    def fit_history(self, turns, budget):
+        """
+        Returns (kept turns, summary note or None): the newest turns that fit the budget,
+        and a note with the questions of the older ones.
+        """
+        kept, used = [], 0
+        for turn in reversed(turns):
+            tokens = count_tokens(turn["question"]) + count_tokens(turn["answer"]) + 2 * MESSAGE_OVERHEAD_TOKENS
+            if used + tokens > budget:
+                break
+            kept.append(turn)
+            used += tokens
+        kept.reverse()
+
+        dropped = turns[:len(turns) - len(kept)]
+        summary = None
+        if dropped and budget - used > MESSAGE_OVERHEAD_TOKENS:
+            note = "Earlier questions in this conversation: " + " | ".join(turn["question"] for turn in dropped)
+            summary = _truncate_to_tokens(note, min(self.summary_tokens, budget - used - MESSAGE_OVERHEAD_TOKENS))
+        return kept, summary
+
+    def build_messages(self, system_prompt, context, turns, question):
+        fixed_tokens = sum(count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+                           for text in (system_prompt, f"Context: {context}", question))
+        history_budget = max(0, min(self.history_tokens, self.max_tokens - fixed_tokens))
+        kept, summary = self.fit_history(list(turns), history_budget)
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "assistant", "content": f"Context: {context}"},
+        ]
+        if summary:
+            messages.append({"role": "system", "content": summary})
+        for turn in kept:
+            messages.append({"role": "user", "content": turn["question"]})
+            messages.append({"role": "assistant", "content": turn["answer"]})
+        messages.append({"role": "user", "content": question})
+
+        self._record(messages, context, len(turns) - len(kept))
+        return messages
+
+    def _record(self, messages, context, turns_dropped):
+        total = sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+        last = {
+            "prompt_tokens": total,
+            "context_tokens": count_tokens(context),
+            "history_messages": len(messages) - 3,
+            "turns_dropped": turns_dropped,
+        }
+        metrics.observe("qa_prompt_tokens", total)
+        with self._lock:
+            self._prompts += 1
+            self._total_tokens += total
+            self._max_seen = max(self._max_seen, total)
+            self._turns_dropped += turns_dropped
+            self.last = last
+
+    def stats(self):
+        with self._lock:
+            return {
+                "prompts": self._prompts,
+                "mean_prompt_tokens": self._total_tokens / self._prompts if self._prompts else 0.0,
+                "max_prompt_tokens": self._max_seen,
+                "turns_dropped": self._turns_dropped,
+                "chunks_dropped": self._chunks_dropped,
+                "last": self.last,
+            }
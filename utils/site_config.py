@@ -0,0 +1,242 @@
+"""
+The site configuration (matnas_data.json) and page assets (header.md, styles.css,
+footer.md, expander.html), parsed and validated once into small objects with their HTML
+fragments pre-rendered.
+
+    config = get_site_config()
+    config.dialogs["pool"].pdf_file
+    st.markdown(config.styles_html, unsafe_allow_html=True)
+
+get_site_config() only stats the source files on each call and reloads them when a
+modification time changed. A config that fails validation raises ConfigError on the first
+load; a later broken edit is reported and the last valid config stays in use.
+"""
+import json
+import os
+import threading
+
+class ConfigError(ValueError):
+    pass
+
+def _background_html(color):
+    return f"<style>.stApp {{ background-color: {color}; }}</style>"
+
+class Button:
+    __slots__ = ("name", "key", "images", "videos")
+
+    def __init__(self, name, key, images=(), videos=()):
+        self.name = name
+        self.key = key
+        self.images = tuple(images)
+        self.videos = tuple(videos)
+
+class MainPage:
+    __slots__ = ("title", "description", "background_color", "images", "videos", "background_html")
+
+    def __init__(self, title, description, background_color, images=(), videos=()):
+        self.title = title
+        self.description = description
+        self.background_color = background_color
+        self.images = tuple(images)
+        self.videos = tuple(videos)
+        self.background_html = _background_html(background_color)
+
+class Dialog:
+    __slots__ = ("key", "title", "description", "background_color", "is_chatbot", "system_prompt",
+                 "pdf_file", "videos", "buttons", "background_html")
+
+    def __init__(self, key, title, description, background_color, is_chatbot, system_prompt=None,
+                 pdf_file=None, videos=(), buttons=()):
+        self.key = key
+        self.title = title
+        self.description = description
+        self.background_color = background_color
+        self.is_chatbot = is_chatbot
+        self.system_prompt = system_prompt
+        self.pdf_file = pdf_file
+        self.videos = tuple(videos)
+        self.buttons = tuple(buttons)
+        self.background_html = _background_html(background_color)
+
+class SiteConfig:
+    __slots__ = ("main_page", "main_buttons", "dialogs", "title", "image_path", "footer_content",
+                 "styles_html", "expander_html")
+
+    def __init__(self, main_page, main_buttons, dialogs, title, image_path, footer_content,
+                 styles_html, expander_html):
+        self.main_page = main_page
+        self.main_buttons = tuple(main_buttons)
+        self.dialogs = dialogs
+        self.title = title
+        self.image_path = image_path
+        self.footer_content = footer_content
+        self.styles_html = styles_html
+        self.expander_html = expander_html
+
+class _Validator:
+    def __init__(self):
+        self.errors = []
+
+    def field(self, data, key, kind, where, required=True, default=None):
+        if key not in data:
+            if required:
+                self.errors.append(f"{where}: missing '{key}'")
+            return default
+        value = data[key]
+        if not isinstance(value, kind):
+            self.errors.append(f"{where}: '{key}' should be {getattr(kind, '__name__', kind)}")
+            return default
+        return value
+
+    def files(self, names, folder, where):
+        for name in names:
+            if not os.path.exists(os.path.join(folder, name)):
+                self.errors.append(f"{where}: {os.path.join(folder, name)} not found")
+
+def _read(path, required=True):
+    if not os.path.exists(path):
+        if required:
+            raise ConfigError(f"{path} not found")
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def parse_site_config(data, data_folder="data", uploads_folder="uploads"):
+    """
+    Validates the parsed matnas_data.json. All problems are reported in one ConfigError.
+
+    Returns:
+    - (main_page, main_buttons, dialogs)
+    """
+    check = _Validator()
+    if not isinstance(data, dict):
+        raise ConfigError("The config should be a JSON object")
+
+    page = check.field(data, "main_page", dict, "main_page", default={})
+    main_page = MainPage(
+        check.field(page, "title", str, "main_page", default=""),
+        check.field(page, "description", str, "main_page", default=""),
+        check.field(page, "background_color", str, "main_page", default="#ffffff"),
+        check.field(page, "images", list, "main_page", required=False, default=[]),
+        check.field(page, "videos", list, "main_page", required=False, default=[]),
+    )
+    check.files(main_page.images, uploads_folder, "main_page")
+
+    dialogs = {}
+    for key, dialog in check.field(data, "dialogs", dict, "config", default={}).items():
+        where = f"dialogs.{key}"
+        if not isinstance(dialog, dict):
+            check.errors.append(f"{where}: should be an object")
+            continue
+        is_chatbot = check.field(dialog, "is_chatbot", bool, where, required=False, default=False)
+        buttons = []
+        for i, button in enumerate(check.field(dialog, "buttons", list, where, required=False, default=[])):
+            button_where = f"{where}.buttons[{i}]"
+            if not isinstance(button, dict):
+                check.errors.append(f"{button_where}: should be an object")
+                continue
+            buttons.append(Button(
+                check.field(button, "name", str, button_where, default=""),
+                check.field(button, "key", str, button_where, default=""),
+                check.field(button, "images", list, button_where, required=False, default=[]),
+                check.field(button, "videos", list, button_where, required=False, default=[]),
+            ))
+            check.files(buttons[-1].images, uploads_folder, button_where)
+
+        dialogs[key] = Dialog(
+            key,
+            check.field(dialog, "title", str, where, default=""),
+            check.field(dialog, "description", str, where, default=""),
+            check.field(dialog, "background_color", str, where, default="#ffffff"),
+            is_chatbot,
+            check.field(dialog, "system_prompt", str, where, required=is_chatbot),
+            check.field(dialog, "pdf_file", str, where, required=is_chatbot),
+            check.field(dialog, "videos", list, where, required=False, default=[]),
+            buttons,
+        )
+        if dialogs[key].pdf_file:
+            check.files([dialogs[key].pdf_file], data_folder, where)
+
+    main_buttons = []
+    for i, button in enumerate(check.field(data, "main_buttons", list, "config", default=[])):
+        where = f"main_buttons[{i}]"
+        if not isinstance(button, dict):
+            check.errors.append(f"{where}: should be an object")
+            continue
+        main_buttons.append(Button(check.field(button, "name", str, where, default=""),
+                                   check.field(button, "key", str, where, default="")))
+        if main_buttons[-1].key not in dialogs:
+            check.errors.append(f"{where}: no dialog named '{main_buttons[-1].key}'")
+
+    if check.errors:
+        raise ConfigError("Invalid site config:\n" + "\n".join(check.errors))
+    return main_page, main_buttons, dialogs
+
+class SiteConfigLoader:
+    def __init__(self, config_path="matnas_data.json", header_path=os.path.join("utils", "header.md"),
+                 styles_path=os.path.join("utils", "styles.css"), footer_path=os.path.join("utils", "footer.md"),
+                 expander_path="expander.html", data_folder="data", uploads_folder="uploads"):
+        self.config_path = config_path
+        self.header_path = header_path
+        self.styles_path = styles_path
+        self.footer_path = footer_path
+        self.expander_path = expander_path
+        self.data_folder = data_folder
+        self.uploads_folder = uploads_folder
+        self._config = None
+        self._mtimes = None
+        self._lock = threading.Lock()
+
+    def _source_mtimes(self):
+        mtimes = []
+        for path in (self.config_path, self.header_path, self.styles_path, self.footer_path, self.expander_path):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def load(self):
+        try:
+            data = json.loads(_read(self.config_path))
+        except json.JSONDecodeError as e:
+            raise ConfigError(f"{self.config_path} is not valid JSON: {e}")
+        main_page, main_buttons, dialogs = parse_site_config(data, self.data_folder, self.uploads_folder)
+
+        # The title is the header's first line; the image is its first markdown image
+        header_lines = (_read(self.header_path, required=False) or "").split('\n')
+        title = header_lines[0].strip('# ')
+        image_path = None
+        for line in header_lines:
+            if line.startswith('!['):
+                image_path = line.split('(')[1].split(')')[0]
+                break
+
+        return SiteConfig(
+            main_page, main_buttons, dialogs,
+            title=title,
+            image_path=image_path,
+            footer_content=_read(self.footer_path, required=False),
+            styles_html=f"<style>{_read(self.styles_path)}</style>",
+            expander_html=_read(self.expander_path),
+        )
+
+    def get(self):
+        mtimes = self._source_mtimes()
+        if self._config is not None and mtimes == self._mtimes:
+            return self._config
+        with self._lock:
+            if self._config is None or mtimes != self._mtimes:
+                try:
+                    self._config = self.load()
+                except ConfigError as e:
+                    if self._config is None:
+                        raise
+                    print(f"Keeping the previous site config: {e}")
+                self._mtimes = mtimes
+            return self._config
+
+_loader = SiteConfigLoader()
+
+def get_site_config():
+    return _loader.get()
@@ -0,0 +1,248 @@
+"""
+A local, OpenAI-compatible stub server for tests and benchmarks.
+
+Embeddings are deterministic hashed bag-of-words vectors, so texts that share words get
+similar vectors and no API key or network access is needed. Chat completions answer with
+a line of the retrieved context, optionally streamed word by word. Point the app
+at it with:
+
+    python -m utils.stub_server --port 8765
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub ...
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def stub_embedding(text, dim=256):
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in WORD_PATTERN.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], 'little') % dim
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vector[bucket] += sign
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+# A deterministic "answer": the first non-empty context line that shares a word with the question
+def stub_answer(messages):
+    question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    context = next((m["content"] for m in messages if m["content"].startswith("Context:")), "")
+    words = set(WORD_PATTERN.findall(question.lower()))
+    lines = [line.strip() for line in context[len("Context:"):].splitlines() if line.strip()]
+    for line in lines:
+        if words & set(WORD_PATTERN.findall(line.lower())):
+            return line
+    return lines[0] if lines else ""
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        stub = self.server.stub
+        request = self._read_json()
+        stub.record(self.path, request)
+
+        if stub.fail_rate and random.random() < stub.fail_rate:
+            self._send_json(503, {"error": {"message": "stub failure", "type": "server_error"}})
+            return
+
+        if self.path.rstrip("/").endswith("/embeddings"):
+            self._handle_embeddings(request)
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            self._handle_chat(request)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _handle_embeddings(self, request):
+        stub = self.server.stub
+        inputs = request.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        data = [
+            {"object": "embedding", "index": i, "embedding": stub_embedding(text, stub.dim).tolist()}
+            for i, text in enumerate(inputs)
+        ]
+        tokens = sum(len(WORD_PATTERN.findall(text)) for text in inputs)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "stub-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _handle_chat(self, request):
+        answer = stub_answer(request.get("messages", []))
+        model = request.get("model", "stub-llm")
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": "stub", "object": "chat.completion", "created": 0, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": answer}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+
+        # Server-sent events, one word per event, like the real streaming API
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        pieces = [word + " " for word in answer.split(" ")] if answer else []
+        for piece in pieces + [None]:
+            event = {
+                "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece} if piece else {},
+                             "finish_reason": None if piece else "stop"}],
+            }
+            self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+class StubServer:
+    """
+    Runs the stub on a background thread.
+
+    Parameters:
+    - port: Port to listen on (0 picks a free port).
+    - dim: Dimension of the stub embeddings.
+    - fail_rate: Fraction of requests answered with HTTP 503, to exercise retries.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, dim=256, fail_rate=0.0):
+        self.dim = dim
+        self.fail_rate = fail_rate
+        self.requests = []
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def record(self, path, request):
+        with self._lock:
+            self.requests.append((path, request))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+class TelegramStubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        stub = self.server.stub
+        method = self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            request = json.loads(body or b"{}")
+        else:
+            # Uploads are only recorded by size
+            request = {"bytes": len(body)}
+
+        retry_after = stub.rate_limit()
+        if retry_after:
+            self._send_json(429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                  "parameters": {"retry_after": retry_after}})
+            return
+        stub.record(method, request)
+        if method == "getMe":
+            self._send_json(200, {"ok": True, "result": {"id": 1, "first_name": "Stub", "username": "stub_bot"}})
+        else:
+            self._send_json(200, {"ok": True, "result": {"message_id": len(stub.requests)}})
+
+    do_GET = _handle
+    do_POST = _handle
+
+class TelegramStubServer(StubServer):
+    """
+    A stub of the Telegram Bot API for tests: every method succeeds and is recorded as
+    (method, request). Point TelegramSender at it with api_url=server.base_url.
+
+    Parameters:
+    - limit_every: Answer every n-th request with HTTP 429 (0 never does).
+    - retry_after: The retry_after of those answers, in seconds.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, limit_every=0, retry_after=1):
+        self.requests = []
+        self.limit_every = limit_every
+        self.retry_after = retry_after
+        self._received = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), TelegramStubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def rate_limit(self):
+        with self._lock:
+            self._received += 1
+            if self.limit_every and self._received % self.limit_every == 0:
+                return self.retry_after
+        return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubServer(port=args.port, dim=args.dim, fail_rate=args.fail_rate)
+    print(f"Stub server listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,135 @@
+"""
+Several community centers (tenants) served from one process.
+
+Every tenant is a folder under TENANTS_FOLDER (default "tenants"), laid out like the app's
+own root:
+
+    tenants/<tenant>/matnas_data.json
+    tenants/<tenant>/data/*.pdf
+    tenants/<tenant>/uploads/*
+    tenants/<tenant>/embeddings/      created on first use
+    tenants/<tenant>/header.md, styles.css, footer.md, expander.html   optional, else the shared ones
+
+The page picks its tenant from the `tenant` query parameter (?tenant=<name>). Without one,
+the default tenant is served from the app root, as before. All tenants' indexes live in the
+process-wide index registry, bounded by INDEX_POOL_MAX_MB (least recently used first out).
+
+    tenant = get_tenant("kiryat-ono")
+    tenant.config().dialogs
+    tenant.processor().process_pdf_and_answer(...)
+"""
+import os
+import re
+import threading
+
+from utils import metrics
+from utils.EmbeddingIndex import index_pool_stats
+from utils.PdfQAProcessor import PdfQAProcessor
+from utils.indexing import collect_pdf_names
+from utils.site_config import SiteConfigLoader
+
+DEFAULT_TENANT = "default"
+
+# Tenant names become folder names, so only plain names are accepted
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+def tenants_folder():
+    return os.getenv("TENANTS_FOLDER", "tenants")
+
+def _asset(root, name, shared):
+    path = os.path.join(root, name)
+    return path if os.path.exists(path) else shared
+
+class Tenant:
+    __slots__ = ("name", "root", "config_path", "data_folder", "uploads_folder", "embeddings_folder",
+                 "_site_config", "_processor", "_lock")
+
+    def __init__(self, name, root):
+        self.name = name
+        self.root = root
+        self.config_path = os.path.join(root, "matnas_data.json")
+        self.data_folder = os.path.join(root, "data")
+        self.uploads_folder = os.path.join(root, "uploads")
+        self.embeddings_folder = os.path.join(root, "embeddings")
+        self._site_config = SiteConfigLoader(
+            config_path=self.config_path,
+            header_path=_asset(root, "header.md", os.path.join("utils", "header.md")),
+            styles_path=_asset(root, "styles.css", os.path.join("utils", "styles.css")),
+            footer_path=_asset(root, "footer.md", os.path.join("utils", "footer.md")),
+            expander_path=_asset(root, "expander.html", "expander.html"),
+            data_folder=self.data_folder,
+            uploads_folder=self.uploads_folder,
+        )
+        self._processor = None
+        self._lock = threading.Lock()
+
+    def config(self):
+        return self._site_config.get()
+
+    def processor(self):
+        """
+        The tenant's PdfQAProcessor, created on first use. Its indexes are loaded into the
+        shared registry; its conversations and caches are the tenant's own.
+        """
+        if self._processor is None:
+            with self._lock:
+                if self._processor is None:
+                    processor = PdfQAProcessor(
+                        data_folder=self.data_folder,
+                        embeddings_folder=self.embeddings_folder,
+                        tenant=None if self.name == DEFAULT_TENANT else self.name
+                    )
+                    # Load every dialog's index up front instead of on its first question
+                    if os.getenv("WARMUP_INDEXES", "false").lower() == "true":
+                        processor.warm_up(collect_pdf_names(self.config_path, self.data_folder))
+                    self._processor = processor
+        return self._processor
+
+_tenants = {}
+_tenants_lock = threading.Lock()
+
+def get_tenant(name=None):
+    """
+    Returns the Tenant called `name` (the default tenant when name is empty), or None when
+    no such tenant exists.
+    """
+    name = name or DEFAULT_TENANT
+    tenant = _tenants.get(name)
+    if tenant is not None:
+        return tenant
+
+    if name == DEFAULT_TENANT:
+        root = ""
+    elif _NAME_PATTERN.match(name) and os.path.isfile(os.path.join(tenants_folder(), name, "matnas_data.json")):
+        root = os.path.join(tenants_folder(), name)
+    else:
+        return None
+
+    with _tenants_lock:
+        if name not in _tenants:
+            _tenants[name] = Tenant(name, root)
+        return _tenants[name]
+
+def tenant_names():
+    """
+    The default tenant followed by every tenant folder that has a matnas_data.json.
+    """
+    names = [DEFAULT_TENANT]
+    folder = tenants_folder()
+    if os.path.isdir(folder):
+        for name in sorted(os.listdir(folder)):
+            if name != DEFAULT_TENANT and _NAME_PATTERN.match(name) and os.path.isfile(os.path.join(folder, name, "matnas_data.json")):
+                names.append(name)
+    return names
+
+def _index_pool_metrics():
+    stats = index_pool_stats()
+    samples = [
+        ("qa_index_pool_indexes", {}, stats["indexes"]),
+        ("qa_index_pool_bytes", {}, stats["bytes"]),
+    ]
+    if stats["max_bytes"] is not None:
+        samples.append(("qa_index_pool_max_bytes", {}, stats["max_bytes"]))
+    return samples
+
+metrics.register_collector(_index_pool_metrics)